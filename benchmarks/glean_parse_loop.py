@@ -0,0 +1,106 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Measure the per-commit setup of the Glean parse loop in `runner`.
+
+Builds a synthetic scrape of 100k commits over the repositories in
+`repositories.yaml` and times preparing the parser inputs of every commit,
+without running the parsers themselves:
+
+- "scan": the previous loop, which looked up the repository with a linear
+  scan, rebuilt the parser config and filtered the paths three times
+  for each commit.
+- "context": `runner.GleanRepoContext`, built once per repository.
+
+Run from the repository root with:
+
+    python benchmarks/glean_parse_loop.py [--commits N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from probe_scraper import runner  # noqa: E402
+from probe_scraper.parsers.repositories import RepositoriesParser  # noqa: E402
+
+
+def synthetic_scrape(repositories, n_commits):
+    repos = [repo for repo in repositories if repo.get_change_files()]
+    data = {repo.name: {} for repo in repos}
+    for i in range(n_commits):
+        repo = repos[i % len(repos)]
+        commit_hash = "%040x" % i
+        data[repo.name][commit_hash] = [
+            os.path.join("/cache", repo.name, commit_hash, rel_path)
+            for rel_path in repo.get_change_files()
+        ]
+    return data
+
+
+def scan(repositories, data):
+    inputs = []
+    for repo_name, commits in data.items():
+        for commit_hash, paths in commits.items():
+            tags_files = [p for p in paths if p.endswith(runner.GLEAN_TAGS_FILENAME)]
+            metrics_files = [
+                p for p in paths if p.endswith(runner.GLEAN_METRICS_FILENAME)
+            ]
+            pings_files = [p for p in paths if p.endswith(runner.GLEAN_PINGS_FILENAME)]
+            config = {"allow_reserved": repo_name.startswith("glean")}
+            repo = next(r for r in repositories if r.name == repo_name).to_dict()
+            inputs.append((config, repo["url"], tags_files, metrics_files, pings_files))
+    return inputs
+
+
+def context(repositories, data):
+    contexts = {repo.name: runner.GleanRepoContext(repo) for repo in repositories}
+    inputs = []
+    for repo_name, commits in data.items():
+        ctx = contexts[repo_name]
+        for commit_hash, paths in commits.items():
+            files = ctx.classify(paths)
+            inputs.append(
+                (ctx.config, ctx.url, files["tags"], files["metrics"], files["pings"])
+            )
+    return inputs
+
+
+def best_of(fn, repeat, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--commits", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--repositories-file", default="repositories.yaml")
+    args = parser.parse_args()
+
+    repositories = RepositoriesParser().parse(args.repositories_file)
+    data = synthetic_scrape(repositories, args.commits)
+    print(
+        f"{args.commits} commits over {len(data)} of {len(repositories)} repositories"
+    )
+
+    scan_time, scan_inputs = best_of(scan, args.repeat, repositories, data)
+    context_time, context_inputs = best_of(context, args.repeat, repositories, data)
+    assert scan_inputs == context_inputs
+
+    print(f"scan:    {scan_time:.3f}s")
+    print(f"context: {context_time:.3f}s ({scan_time / context_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
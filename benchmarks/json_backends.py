@@ -0,0 +1,130 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Compare the JSON backends of `probe_scraper.serializers`.
+
+By default this times serializing synthetic outputs the size of
+`firefox/<channel>/main/all_probes` and gecko's `glean/<repo>/metrics`,
+built from the probe definitions in `tests/resources`. Existing output
+files can be timed instead with `--input`, e.g. ones downloaded from
+https://probeinfo.telemetry.mozilla.org/. Each backend's output is checked
+to be the same as the standard library's.
+
+Run from the repository root with:
+
+    python benchmarks/json_backends.py [--probes N] [--input FILE ...]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from probe_scraper import runner, serializers  # noqa: E402
+from probe_scraper.parsers.metrics import GleanMetricsParser  # noqa: E402
+
+HISTOGRAM_FILES = [
+    "tests/resources/Histograms.json",
+    "tests/resources/nsDeprecatedOperationList.h",
+    "tests/resources/UseCounters.conf",
+]
+
+
+def synthetic_all_probes(n_probes):
+    histograms = runner.PARSERS["histogram"].parse(HISTOGRAM_FILES, 64, "nightly")
+    definitions = list(histograms.values())
+    probes = {}
+    for i in range(n_probes):
+        name = "HISTOGRAM_%d" % i
+        history = []
+        for version in range(3):
+            defn = dict(definitions[i % len(definitions)])
+            defn["description"] += " (révision %d)" % version
+            defn["revisions"] = {"first": "%040x" % (i + version), "last": "%040x" % i}
+            defn["versions"] = {"first": str(60 + version), "last": str(61 + version)}
+            history.append(defn)
+        probes["histogram/" + name] = {
+            "history": {"nightly": history},
+            "name": name,
+            "type": "histogram",
+            "first_added": {"nightly": datetime.datetime(2019, 1, 1, i % 24)},
+        }
+    return probes
+
+
+def synthetic_metrics(n_metrics):
+    metrics, _ = GleanMetricsParser().parse(["tests/resources/metrics.yaml"], {})
+    definitions = list(metrics.values())
+    output = {}
+    for i in range(n_metrics):
+        name = "category.metric_%d" % i
+        defn = dict(definitions[i % len(definitions)])
+        defn["dates"] = {"first": "2019-01-01 00:00:00", "last": "2021-06-01 12:00:00"}
+        defn["git-commits"] = {"first": "%040x" % i, "last": "%040x" % (i + 1)}
+        defn["reflog-index"] = {"first": i, "last": 0}
+        output[name] = {
+            "history": [defn, defn],
+            "in-source": True,
+            "name": name,
+            "type": defn["type"],
+        }
+    return output
+
+
+def time_backend(serializer, data, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encoded = serializer.dumps(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, encoded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--probes", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--input", nargs="*", default=[])
+    args = parser.parse_args()
+
+    if args.input:
+        outputs = {}
+        for path in args.input:
+            with open(path) as f:
+                outputs[path] = json.load(f)
+    else:
+        outputs = {
+            "all_probes": synthetic_all_probes(args.probes),
+            "metrics": synthetic_metrics(args.probes),
+        }
+
+    backends = [b for b in serializers.BACKENDS if b != "auto"]
+    for name, data in outputs.items():
+        for compact in (False, True):
+            baseline = None
+            for backend in backends:
+                try:
+                    serializer = serializers.get_serializer(backend, compact)
+                except ValueError as e:
+                    print(f"{name} {backend}: {e}")
+                    continue
+                elapsed, encoded = time_backend(serializer, data, args.repeat)
+                if baseline is None:
+                    baseline, expected = elapsed, encoded
+                assert encoded == expected, f"{backend} output differs"
+                print(
+                    f"{name:<12} {backend:<7} {'compact' if compact else 'indented':<9}"
+                    f"{len(encoded) / 1e6:8.1f} MB {elapsed:7.3f}s"
+                    f" ({baseline / elapsed:.1f}x)"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+A content-addressed store for the files in the scraper cache.
+
+Most registry files are byte-identical across hg revisions, and most
+metrics/pings/tags files are byte-identical across git commits. Instead of
+keeping a copy per revision, the content is stored once in `BlobStore`,
+keyed by its git blob id, and a `RefIndex` records which blob each
+per-revision path refers to. The per-revision paths the parsers read are
+hard links into the store, and are not synced to S3.
+
+As the per-revision paths share their content with the store, they must
+never be written to in place, which would change the content of every
+path that refers to the same blob. They are replaced with a new file or
+link instead, see `_link`. Blobs are stored read-only to catch mistakes.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+BLOBS_DIR = "blobs"
+REFS_DIR = "refs"
+
+
+def git_blob_id(data):
+    """Return the id git would give `data` as a blob object."""
+    header = f"blob {len(data)}\0".encode("ascii")
+    return hashlib.sha1(header + data).hexdigest()
+
+
+def _atomic_write(path, data, mode=None):
+    dir = os.path.dirname(path)
+    os.makedirs(dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _link(src_path, dest_path):
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+    try:
+        os.link(src_path, dest_path)
+    except OSError:
+        # e.g. the cache spans file systems
+        shutil.copyfile(src_path, dest_path)
+
+
+class BlobStore:
+    def __init__(self, cache_dir):
+        self.root = os.path.join(cache_dir, BLOBS_DIR)
+
+    def path(self, blob_id):
+        return os.path.join(self.root, blob_id[:2], blob_id[2:])
+
+    def has(self, blob_id):
+        return os.path.exists(self.path(blob_id))
+
+    def put(self, data, blob_id=None):
+        if blob_id is None:
+            blob_id = git_blob_id(data)
+        if not self.has(blob_id):
+            _atomic_write(self.path(blob_id), data, mode=0o444)
+        return blob_id
+
+    def link(self, blob_id, dest_path):
+        _link(self.path(blob_id), dest_path)
+
+
+class RefIndex:
+    """
+    Maps the paths of files under `base_dir` to the blobs that hold their
+    content, and materializes those paths on demand.
+
+    The index is a single JSON file of {<path relative to base_dir>: <blob id>}.
+    """
+
+    def __init__(self, store, base_dir, index_path):
+        self.store = store
+        self.base_dir = base_dir
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                self.refs = json.load(f)
+        else:
+            self.refs = {}
+
+    def _key(self, path):
+        return os.path.relpath(path, self.base_dir).replace(os.path.sep, "/")
+
+    def _set(self, path, blob_id):
+        with self._lock:
+            self.refs[self._key(path)] = blob_id
+
+    def blob_id(self, path):
+        return self.refs.get(self._key(path))
+
+    def restore(self, path):
+        """
+        Materialize `path` from the store if we have its content.
+        Returns True if `path` exists afterwards.
+        """
+        blob_id = self.blob_id(path)
+        if blob_id is None or not self.store.has(blob_id):
+            return False
+        self.store.link(blob_id, path)
+        return True
+
+    def add(self, path, data, blob_id=None):
+        """Store `data` as the content of `path` and materialize it."""
+        blob_id = self.store.put(data, blob_id)
+        self.store.link(blob_id, path)
+        self._set(path, blob_id)
+        return blob_id
+
+    def link(self, path, blob_id):
+        """Make `path` refer to the blob `blob_id`, which must be in the store."""
+        self.store.link(blob_id, path)
+        self._set(path, blob_id)
+
+    def add_existing(self, path):
+        """
+        Move a file that is already materialized, e.g. from a cache written
+        before the store existed, into the store.
+        """
+        if self.blob_id(path) is not None:
+            return
+        with open(path, "rb") as f:
+            self.add(path, f.read())
+
+    def copy(self, src_path, dest_path):
+        """Make `dest_path` refer to the same content as `src_path`."""
+        blob_id = self.blob_id(src_path)
+        if blob_id is None:
+            self.add_existing(src_path)
+            blob_id = self.blob_id(src_path)
+        self.link(dest_path, blob_id)
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self.refs, sort_keys=True, indent=2).encode("utf-8")
+        _atomic_write(self.index_path, data)
+
+
+def open_refs(cache_dir, namespace, base_dir):
+    """Return the RefIndex for the files of `namespace` under `base_dir`."""
+    store = BlobStore(cache_dir)
+    index_path = os.path.join(cache_dir, REFS_DIR, f"{namespace}.json")
+    return RefIndex(store, base_dir, index_path)
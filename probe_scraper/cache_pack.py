@@ -0,0 +1,330 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Packed storage of the cache directory in S3.
+
+The cache is made of many small files, and syncing it file by file is
+dominated by the latency of each request. In packed mode, it is stored as
+a few large, append-only segments and an index of where the content of
+each file is in them:
+
+    <url>/index.json.gz
+    <url>/segments/000001.pack
+    <url>/segments/000002.pack
+    ...
+
+The files are restored with one ranged GET per contiguous run of content,
+and the files that changed since are uploaded as a single new segment.
+Changed and removed files leave dead space in the older segments, which
+`compact` reclaims by rewriting all live files into one segment.
+
+Run as a module to pack, restore or compact a packed cache by hand:
+
+    python -m probe_scraper.cache_pack compact s3://bucket/cache/probe-scraper-packed
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from botocore.exceptions import ClientError
+
+from . import s3_sync
+
+# Bump this whenever the layout of the index or the segments changes. Older
+# versions refuse to read or extend a packed cache with a newer format.
+FORMAT_VERSION = 1
+
+INDEX_NAME = "index.json.gz"
+SEGMENTS_DIR = "segments"
+SEGMENT_SUFFIX = ".pack"
+
+# Runs of content with gaps up to this size are fetched in a single GET, and
+# runs are split at about `MAX_RANGE` bytes so they are fetched in parallel.
+MAX_GAP = 1024 * 1024
+MAX_RANGE = 64 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+def new_index():
+    # `files` maps relative paths to [segment, offset, size, sha256], and
+    # `segments` maps segment names to their sizes.
+    return {"version": FORMAT_VERSION, "segments": {}, "files": {}}
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _local_path(local_dir, rel_path):
+    return os.path.join(local_dir, *rel_path.split("/"))
+
+
+def load_index(s3, url):
+    """Return the index of the packed cache at the S3 `url`, or None."""
+    bucket, prefix = s3_sync.parse_s3_url(url)
+    try:
+        response = s3.client.get_object(
+            Bucket=bucket, Key=s3_sync._key(prefix, INDEX_NAME)
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    index = json.loads(gzip.decompress(response["Body"].read()))
+    if index.get("version") != FORMAT_VERSION:
+        raise ValueError(
+            "Unsupported packed cache format {} at {}".format(index.get("version"), url)
+        )
+    return index
+
+
+def save_index(s3, url, index):
+    bucket, prefix = s3_sync.parse_s3_url(url)
+    body = gzip.compress(json.dumps(index, sort_keys=True).encode("utf-8"), mtime=0)
+    s3.client.put_object(Bucket=bucket, Key=s3_sync._key(prefix, INDEX_NAME), Body=body)
+
+
+def dead_bytes(index):
+    """Return the number of bytes in segments that no file points to."""
+    live = sum(size for _, _, size, _ in index["files"].values())
+    return sum(index["segments"].values()) - live
+
+
+def plan_ranges(index, rel_paths=None):
+    """
+    Return the ranges to fetch to restore `rel_paths`, or all files, as
+    `(segment, start, end, entries)` tuples. `end` is exclusive, and
+    `entries` are the `(rel_path, offset, size, sha256)` of the files in
+    the range, by offset.
+    """
+    if rel_paths is None:
+        rel_paths = index["files"]
+    by_segment = {}
+    for rel_path in rel_paths:
+        segment, offset, size, digest = index["files"][rel_path]
+        by_segment.setdefault(segment, []).append((rel_path, offset, size, digest))
+
+    ranges = []
+    for segment, entries in sorted(by_segment.items()):
+        entries.sort(key=lambda entry: entry[1])
+        current = []
+        start = end = None
+        for entry in entries:
+            _, offset, size, _ = entry
+            if current and (offset - end > MAX_GAP or end - start >= MAX_RANGE):
+                ranges.append((segment, start, end, current))
+                current = []
+            if not current:
+                start = offset
+            current.append(entry)
+            end = offset + size
+        if current:
+            ranges.append((segment, start, end, current))
+    return ranges
+
+
+def restore(s3, url, local_dir):
+    """
+    Restore the files of the packed cache at the S3 `url` into
+    `local_dir`, and return its index, or None if there is none. Files
+    that exist locally with the same content are kept.
+    """
+    index = load_index(s3, url)
+    if index is None:
+        return None
+    bucket, prefix = s3_sync.parse_s3_url(url)
+
+    to_restore = []
+    for rel_path, (_, _, size, digest) in index["files"].items():
+        path = _local_path(local_dir, rel_path)
+        if (
+            os.path.exists(path)
+            and os.path.getsize(path) == size
+            and _sha256(path) == digest
+        ):
+            s3.record(path)
+        else:
+            to_restore.append(rel_path)
+    ranges = plan_ranges(index, to_restore)
+
+    def fetch_range(segment, start, end, entries):
+        response = s3.client.get_object(
+            Bucket=bucket,
+            Key=s3_sync._key(prefix, f"{SEGMENTS_DIR}/{segment}"),
+            Range=f"bytes={start}-{end - 1}",
+        )
+        body = response["Body"]
+        position = start
+        for rel_path, offset, size, digest in entries:
+            # Skip the dead space between files.
+            while position < offset:
+                skipped = body.read(min(CHUNK_SIZE, offset - position))
+                if not skipped:
+                    raise IOError(f"Truncated segment {segment} at {url}")
+                position += len(skipped)
+            path = _local_path(local_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # A stale file is replaced rather than written to, as it may be
+            # read-only, or linked to from elsewhere; see `blob_store`.
+            if os.path.exists(path):
+                os.remove(path)
+            sha256 = hashlib.sha256()
+            remaining = size
+            with open(path, "wb") as f:
+                while remaining:
+                    chunk = body.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise IOError(f"Truncated segment {segment} at {url}")
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            position += size
+            if sha256.hexdigest() != digest:
+                os.remove(path)
+                raise IOError(f"Corrupt content for {rel_path} in {segment}")
+            s3.record(path)
+
+    print(
+        f"Restoring {len(to_restore)} of {len(index['files'])} files "
+        f"from {url} with {len(ranges)} requests"
+    )
+    s3.run(fetch_range, ranges)
+    return index
+
+
+def _next_segment(index):
+    numbers = [int(name[: -len(SEGMENT_SUFFIX)]) for name in index["segments"]]
+    return "{:06d}{}".format(max(numbers, default=0) + 1, SEGMENT_SUFFIX)
+
+
+def pack(s3, local_dir, url, include=None, index=None):
+    """
+    Store the files under `local_dir` in the packed cache at the S3 `url`,
+    and return its new index.
+
+    Only files with a relative path matching one of the `fnmatch` patterns
+    in `include` are stored, if given. `index` is the index the files were
+    restored from, if it is already loaded. Files that are unchanged since
+    are kept where they are, the others are appended as a new segment, and
+    segments without any live file left are deleted.
+    """
+    if index is None:
+        index = load_index(s3, url) or new_index()
+    bucket, prefix = s3_sync.parse_s3_url(url)
+    files = {}
+    to_pack = []
+    local = s3_sync.list_files(local_dir, include)
+    for rel_path, path in local:
+        entry = index["files"].get(rel_path)
+        if entry is not None and s3.unchanged(path):
+            files[rel_path] = entry
+            continue
+        digest = _sha256(path)
+        if entry is not None and entry[3] == digest:
+            files[rel_path] = entry
+        else:
+            to_pack.append((rel_path, path, digest))
+
+    segments = dict(index["segments"])
+    if to_pack:
+        segment = _next_segment(index)
+        with tempfile.TemporaryFile() as f:
+            for rel_path, path, digest in to_pack:
+                offset = f.tell()
+                with open(path, "rb") as f_in:
+                    shutil.copyfileobj(f_in, f, CHUNK_SIZE)
+                files[rel_path] = [segment, offset, f.tell() - offset, digest]
+            segments[segment] = f.tell()
+            f.seek(0)
+            print(
+                f"Packing {len(to_pack)} of {len(local)} files "
+                f"({segments[segment]} bytes) into {url}/{SEGMENTS_DIR}/{segment}"
+            )
+            s3.client.upload_fileobj(
+                f,
+                bucket,
+                s3_sync._key(prefix, f"{SEGMENTS_DIR}/{segment}"),
+                Config=s3.transfer_config,
+            )
+
+    live = {entry[0] for entry in files.values()}
+    unused = sorted(set(segments) - live)
+    for segment in unused:
+        del segments[segment]
+    new = {"version": FORMAT_VERSION, "segments": segments, "files": files}
+    if new != index:
+        # The new segment is uploaded before the index pointing into it, and
+        # unused segments are deleted after, so the index is always valid.
+        save_index(s3, url, new)
+        s3.delete(url, [f"{SEGMENTS_DIR}/{segment}" for segment in unused])
+    for _, path, _ in to_pack:
+        s3.record(path)
+    return new
+
+
+def compact(s3, url):
+    """
+    Rewrite all live files of the packed cache at the S3 `url` into a
+    single segment, and delete the old segments.
+    """
+    index = load_index(s3, url)
+    if index is None:
+        raise ValueError(f"No packed cache at {url}")
+    print(
+        f"Compacting {len(index['files'])} files in {len(index['segments'])} "
+        f"segments at {url}, {dead_bytes(index)} dead bytes"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        restore(s3, url, tmp)
+        # Packing against an empty index with the same segment numbering
+        # writes everything to a new segment, and drops all the old ones.
+        empty = new_index()
+        empty["segments"] = {segment: 0 for segment in index["segments"]}
+        compacted = pack(s3, tmp, url, index=empty)
+    return compacted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--s3-workers",
+        help="Number of requests to S3 to make concurrently.",
+        type=int,
+        default=s3_sync.WORKERS,
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack_command = commands.add_parser(
+        "pack", help="Store a local cache directory in a packed cache."
+    )
+    pack_command.add_argument("cache_dir")
+    pack_command.add_argument("url")
+    restore_command = commands.add_parser(
+        "restore", help="Restore a packed cache into a local directory."
+    )
+    restore_command.add_argument("url")
+    restore_command.add_argument("cache_dir")
+    compact_command = commands.add_parser(
+        "compact", help="Rewrite a packed cache without its dead space."
+    )
+    compact_command.add_argument("url")
+
+    args = parser.parse_args()
+    s3 = s3_sync.S3Sync(workers=args.s3_workers)
+    if args.command == "pack":
+        pack(s3, args.cache_dir, args.url)
+    elif args.command == "restore":
+        if restore(s3, args.url, args.cache_dir) is None:
+            parser.exit(1, f"No packed cache at {args.url}\n")
+    else:
+        compact(s3, args.url)
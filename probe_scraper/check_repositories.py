@@ -5,9 +5,9 @@ from pathlib import Path
 from typing import Set, Tuple
 
 import git
-import requests as reqs
 from glean_parser.lint import lint_yaml_files
 
+from . import http_client
 from .parsers.repositories import RepositoriesParser
 
 GIT = git.Git()
@@ -50,7 +50,7 @@ for repo in repos:
             + "/"
             + metric_file
         )
-        response = reqs.get(temp_url)
+        response = http_client.get(temp_url)
         if response.status_code != 200:
             temp_errors += ["Metrics file was not found at " + temp_url]
         else:
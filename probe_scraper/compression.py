@@ -0,0 +1,162 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Compression of the output files before they are uploaded.
+
+Files are compressed in chunks, so they are never held in memory as a
+whole, and on a pool of threads; zlib releases the GIL while compressing.
+Output files can also be written compressed in the first place, see
+`set_output_level`, or get pre-compressed gzip and brotli siblings
+(`<name>.gz`, `<name>.br`) written next to them, see `set_sibling_levels`.
+Either way, they are only linked when uploading. Output file names never
+end in these suffixes themselves.
+"""
+
+import gzip
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 9
+# Quality 10 and 11 compress a little better, but are far slower.
+BROTLI_LEVEL = 9
+WORKERS = os.cpu_count() or 1
+CHUNK_SIZE = 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+
+# The encodings of pre-compressed siblings, and their file name suffixes.
+SIBLING_SUFFIXES = {"gzip": ".gz", "br": ".br"}
+
+_output_level = None
+_sibling_levels = {}
+
+
+def set_output_level(level):
+    """
+    Write output files gzipped with compression `level`, or uncompressed
+    if it is None.
+    """
+    global _output_level
+    _output_level = level
+
+
+def get_output_level():
+    return _output_level
+
+
+def set_sibling_levels(levels):
+    """
+    Write a pre-compressed sibling of output files for each encoding in
+    `levels`, a dict of encodings in `SIBLING_SUFFIXES` to the compression
+    level to use.
+    """
+    global _sibling_levels
+    unknown = set(levels) - set(SIBLING_SUFFIXES)
+    if unknown:
+        raise ValueError("Unknown encodings: " + ", ".join(sorted(unknown)))
+    if "br" in levels and brotli is None:
+        raise ValueError("The brotli package is needed for brotli compression")
+    _sibling_levels = dict(levels)
+
+
+def get_sibling_levels():
+    return dict(_sibling_levels)
+
+
+def _gzip_writer(f, level):
+    # No file name or timestamp in the header, so the same content always
+    # compresses to the same bytes.
+    return gzip.GzipFile(
+        filename="", mode="wb", compresslevel=level, fileobj=f, mtime=0
+    )
+
+
+def write_gzipped(f, content, level=GZIP_LEVEL):
+    """Write the bytes `content` to the binary file `f`, gzipped."""
+    view = memoryview(content)
+    with _gzip_writer(f, level) as gz:
+        for start in range(0, len(view), CHUNK_SIZE):
+            end = start + CHUNK_SIZE
+            gz.write(view[start:end])
+
+
+def write_brotli(f, content, level=BROTLI_LEVEL):
+    """Write the bytes `content` to the binary file `f`, brotli-compressed."""
+    compressor = brotli.Compressor(quality=level)
+    view = memoryview(content)
+    for start in range(0, len(view), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        f.write(compressor.process(view[start:end]))
+    f.write(compressor.finish())
+
+
+def write_compressed(f, content, encoding, level):
+    if encoding == "gzip":
+        write_gzipped(f, content, level)
+    else:
+        write_brotli(f, content, level)
+
+
+def is_gzipped(path):
+    with open(path, "rb") as f:
+        return f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def gzip_file(src, dst, level=GZIP_LEVEL):
+    """
+    Write `src` gzipped to `dst`. Files that are gzipped already are linked
+    or copied instead.
+    """
+    if is_gzipped(src):
+        _link(src, dst)
+        return
+
+    with open(src, "rb") as f_in, open(dst, "wb") as f_out:
+        with _gzip_writer(f_out, level) as gz:
+            shutil.copyfileobj(f_in, gz, CHUNK_SIZE)
+
+
+def gzip_tree(src_dir, dst_dir, workers=WORKERS, level=GZIP_LEVEL):
+    """
+    Write all files under `src_dir` gzipped to the same paths under
+    `dst_dir`, compressing `workers` files at a time.
+
+    Files with a gzip sibling are replaced by it rather than compressed,
+    and brotli siblings are kept as they are.
+    """
+    gz, br = SIBLING_SUFFIXES["gzip"], SIBLING_SUFFIXES["br"]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = []
+        for root, dirnames, filenames in os.walk(src_dir):
+            rel_root = os.path.relpath(root, start=src_dir)
+            for dirname in dirnames:
+                os.makedirs(os.path.join(dst_dir, rel_root, dirname), exist_ok=True)
+            names = set(filenames)
+            for filename in filenames:
+                src = os.path.join(root, filename)
+                dst = os.path.join(dst_dir, rel_root, filename)
+                if filename.endswith(br):
+                    _link(src, dst)
+                elif filename.endswith(gz) and filename[: -len(gz)] in names:
+                    continue
+                elif filename + gz in names:
+                    _link(src + gz, dst)
+                else:
+                    futures.append(executor.submit(gzip_file, src, dst, level))
+    # All files are done before the first failure is raised.
+    for future in futures:
+        future.result()
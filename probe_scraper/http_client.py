@@ -0,0 +1,173 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+A shared HTTP session for all outbound requests made by probe-scraper.
+
+Requests made through `get` and `post` reuse pooled keep-alive connections,
+are retried with jittered exponential backoff on connection errors and
+transient server errors, and are rate limited per host. POST requests are
+only retried on server errors if they are read-only, see `post`. Counters for the
+number of requests, retries and bytes received are available from `stats`.
+"""
+
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 0.5
+POOL_SIZE = 32
+# The methods retried on transient server errors. Other methods, e.g. POST,
+# are only retried when the connection fails, as they may not be idempotent.
+RETRY_METHODS = Retry.DEFAULT_ALLOWED_METHODS
+
+# Maximum number of requests per second we start against a host.
+# Hosts that are not listed here are not rate limited.
+HOST_RATE_LIMITS = {
+    "hg.mozilla.org": 50,
+    "buildhub.moz.tools": 10,
+    "bugzilla.mozilla.org": 10,
+    "raw.githubusercontent.com": 20,
+}
+
+
+class Stats:
+    """Thread-safe counters of the outbound HTTP traffic."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.retries = 0
+            self.bytes = 0
+
+    def add(self, requests=0, retries=0, bytes=0):
+        with self._lock:
+            self.requests += requests
+            self.retries += retries
+            self.bytes += bytes
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "bytes": self.bytes,
+            }
+
+
+stats = Stats()
+
+
+class JitteredRetry(Retry):
+    """
+    A urllib3 Retry that uses "full jitter" backoff, so that concurrent
+    clients retrying against the same host don't do so in lockstep.
+    """
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+    def increment(self, *args, **kwargs):
+        stats.add(retries=1)
+        return super().increment(*args, **kwargs)
+
+
+class HostRateLimiter:
+    """Spaces out the start of requests to each host in `limits`."""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        rate = self.limits.get(host)
+        if not rate:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + 1.0 / rate
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Session(requests.Session):
+    def __init__(
+        self,
+        max_retries=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        pool_size=POOL_SIZE,
+        rate_limits=HOST_RATE_LIMITS,
+        retry_methods=RETRY_METHODS,
+    ):
+        super().__init__()
+        retry = JitteredRetry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=retry_methods,
+            # Callers inspect the status code of the final response themselves.
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.rate_limiter = HostRateLimiter(rate_limits)
+
+    def request(self, method, url, *args, **kwargs):
+        self.rate_limiter.wait(url)
+        response = super().request(method, url, *args, **kwargs)
+        if kwargs.get("stream"):
+            # Reading a streamed body here would load it all into memory, so
+            # its announced length is counted instead.
+            size = int(response.headers.get("Content-Length") or 0)
+        else:
+            size = len(response.content)
+        stats.add(requests=1, bytes=size)
+        return response
+
+
+_sessions = {}
+_session_lock = threading.Lock()
+
+
+def get_session(read_only_post=False):
+    """
+    Return the process-wide shared session, creating it on first use. With
+    `read_only_post`, it is a session that also retries POST requests.
+    """
+    with _session_lock:
+        if read_only_post not in _sessions:
+            methods = RETRY_METHODS | {"POST"} if read_only_post else RETRY_METHODS
+            _sessions[read_only_post] = Session(retry_methods=methods)
+        return _sessions[read_only_post]
+
+
+def get(url, **kwargs):
+    return get_session().get(url, **kwargs)
+
+
+def post(url, read_only=False, **kwargs):
+    """
+    POST to `url`. Only requests that are `read_only`, e.g. searches, are
+    retried on transient server errors, so nothing is ever created twice.
+    """
+    return get_session(read_only).post(url, **kwargs)
@@ -0,0 +1,80 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+A manifest of the output files of a run, with a hash of the content of each.
+
+Most output files are the same from one run to the next. The manifest of
+the last uploaded output is kept in the cache directory, and files that
+are unchanged since then are not written to the output directory at all,
+so they are not compressed or uploaded again either. Files that were
+uploaded before but are no longer written are listed by `removed`.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+MANIFEST_FILENAME = "output_manifest.json"
+
+# Bump this whenever the uploaded form of the same content changes, e.g. its
+# encoding, so that all files are uploaded again.
+MANIFEST_VERSION = 1
+
+
+class OutputManifest:
+    def __init__(self, out_dir, previous=None):
+        """
+        `previous` maps the paths of the files uploaded last, relative to
+        `out_dir`, to their digests. If it is None, all files are written.
+        """
+        self.out_dir = out_dir
+        self.previous = previous
+        self.files = {}
+
+    @classmethod
+    def load(cls, cache_dir, out_dir):
+        path = os.path.join(cache_dir, MANIFEST_FILENAME)
+        previous = None
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                previous = manifest["files"]
+        return cls(out_dir, previous)
+
+    def save(self, cache_dir):
+        """Record the files of this run as uploaded."""
+        path = os.path.join(cache_dir, MANIFEST_FILENAME)
+        manifest = {"version": MANIFEST_VERSION, "files": self.files}
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f, sort_keys=True, indent=2)
+        os.replace(tmp_path, path)
+
+    def add(self, path, content):
+        """
+        Record that this run produces `content` at `path`, and return
+        whether it needs to be written, i.e. whether it changed since the
+        last upload.
+        """
+        rel_path = os.path.relpath(path, self.out_dir)
+        digest = hashlib.sha256(content).hexdigest()
+        self.files[rel_path] = digest
+        return self.previous is None or self.previous.get(rel_path) != digest
+
+    def changed(self):
+        """Return the paths of the files written by this run."""
+        return sorted(
+            path
+            for path, digest in self.files.items()
+            if self.previous is None or self.previous.get(path) != digest
+        )
+
+    def removed(self):
+        """Return the paths of the files that were uploaded, but are gone."""
+        if self.previous is None:
+            return []
+        return sorted(set(self.previous) - set(self.files))
@@ -0,0 +1,122 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Memoization of parser results, keyed by the content of the parsed files.
+
+The same registry files are parsed for many revisions. `ParseCache` keeps
+the parsed result for each distinct input in memory and, if given a cache
+directory, on disk so that later runs can skip parsing unchanged inputs.
+With a cache directory, only the most recently used results are kept in
+memory, as the callers keep their own deduplicated copies of the results
+for the whole run, and the others are read back from disk when needed.
+Results are stored as JSON, as the cache directory is shared through S3,
+so they must be made of JSON types with string keys to round-trip.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+PARSE_CACHE_DIR = "parse_cache"
+
+# The number of results kept in memory when they are also stored on disk.
+MEMORY_SIZE = 128
+
+# Bump this whenever a parser starts producing different output for the
+# same input, so results persisted by older code aren't used.
+PARSE_CACHE_VERSION = 2
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    """
+    Return the SHA-256 of the content of `path`.
+
+    Files restored from the blob store are hard links to the same inode, so
+    digests are memoized per inode and each distinct file is only read once.
+    """
+    st = os.stat(path)
+    inode = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(inode)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with _digests_lock:
+            _digests[inode] = digest
+    return digest
+
+
+class ParseCache:
+    def __init__(self, cache_dir=None, memory_size=MEMORY_SIZE):
+        self.dir = None
+        if cache_dir is not None:
+            self.dir = os.path.join(cache_dir, PARSE_CACHE_DIR)
+        self.memory_size = memory_size
+        # Without a cache directory, memory is the only storage, and all
+        # results are kept.
+        self._memory = OrderedDict()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        if self.dir is not None:
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def key(self, parser_name, paths, flags=None, names=None):
+        """
+        Build the cache key for parsing `paths` with `parser_name`.
+
+        The file names are part of the key, as some parsers pick the format
+        based on them. They default to the base names of `paths`, and can be
+        given as `names` where more of the path ends up in the output.
+        `flags` holds any parser options that change the output for the same
+        input, e.g. version-dependent behaviour.
+        """
+        if names is None:
+            names = [os.path.basename(path) for path in paths]
+        parts = [
+            PARSE_CACHE_VERSION,
+            parser_name,
+            [(name, file_digest(path)) for name, path in zip(names, paths)],
+            flags or {},
+        ]
+        encoded = json.dumps(parts, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Return the cached result for `key`, or None."""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        if self.dir is None or not os.path.exists(self._path(key)):
+            return None
+
+        with open(self._path(key), "rb") as f:
+            value = json.load(f)
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.dir is None:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            # Key order is kept, as it is the order of the parsed output.
+            json.dump(value, f)
+        os.replace(tmp_path, path)
@@ -51,17 +51,26 @@ def extract_events_data(e):
     return data
 
 
+def is_supported_version(version, channel):
+    # Events.yaml had a format change in 53, see bug 1329620.
+    # We don't have important event usage yet, so lets skip
+    # backwards compatibility for now.
+    return not (
+        (version and channel)
+        and (
+            (channel != "nightly" and version < 53)
+            or (channel == "nightly" and version < 54)
+        )
+    )
+
+
 class EventsParser:
+    def cache_flags(self, version=None, channel=None):
+        """The options that change the output of `parse` for the same files."""
+        return {"supported_version": is_supported_version(version, channel)}
+
     def parse(self, filenames, version=None, channel=None):
-        # Events.yaml had a format change in 53, see bug 1329620.
-        # We don't have important event usage yet, so lets skip
-        # backwards compatibility for now.
-        if (version and channel) and (
-            (
-                (channel != "nightly" and version < 53)
-                or (channel == "nightly" and version < 54)
-            )
-        ):
+        if not is_supported_version(version, channel):
             return {}
 
         if len(filenames) > 1:
@@ -52,9 +52,8 @@ def extract_histogram_data(histogram, version):
     if hasattr(histogram, "dataset"):
         optout = getattr(histogram, "dataset")().endswith("_OPTOUT")
 
-    # Use Counters are shipped on release since 65.
     # If the parsers would set this flag, we couldn't differentiate between versions.
-    if int(version) >= 65:
+    if use_counters_are_optout(version):
         if histogram.name().startswith("USE_COUNTER2_"):
             optout = True
 
@@ -82,7 +81,16 @@ def transform_probe_info(probes, version):
     )
 
 
+def use_counters_are_optout(version):
+    # Use Counters are shipped on release since 65.
+    return version is not None and int(version) >= 65
+
+
 class HistogramsParser:
+    def cache_flags(self, version=None, channel=None):
+        """The options that change the output of `parse` for the same files."""
+        return {"use_counters_optout": use_counters_are_optout(version)}
+
     def parse(self, filenames, version=None, channel=None):
         # Call the histogram tools for each file.
         parsed_probes = list(histogram_tools.from_files(filenames))
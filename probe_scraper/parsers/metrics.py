@@ -7,7 +7,7 @@ from pathlib import Path
 from glean_parser.parser import parse_objects
 
 from .pings import normalize_ping_name
-from .utils import get_source_url
+from .utils import cached_glean_parse, get_source_url
 
 
 class GleanMetricsParser:
@@ -17,12 +17,7 @@ class GleanMetricsParser:
     to parse the metrics.yaml files.
     """
 
-    def parse(self, filenames, config, repo_url=None, commit_hash=None):
-        config = config.copy()
-        config["do_not_disable_expired"] = True
-
-        paths = [Path(fname) for fname in filenames]
-        paths = [path for path in paths if path.is_file()]
+    def _parse(self, paths, config):
         results = parse_objects(paths, config)
         errors = [err for err in results]
 
@@ -31,6 +26,63 @@ class GleanMetricsParser:
             for category, probes in results.value.items()
             for probe_name, metric in probes.items()
         }
+        return metrics, errors
+
+    def _parse_per_file(self, paths, config, commit_hash, parse_cache):
+        """
+        Parse each of `paths` on its own, so that the results of files that
+        didn't change are reused from `parse_cache`, and merge them into the
+        result of parsing them all at once.
+
+        The only check glean_parser makes across files is for metrics that
+        are defined more than once. Returns None if there are any of those,
+        or if any file has errors, so that the errors are reported exactly
+        like glean_parser does. Metric names can't contain dots, so the
+        category of a metric is the part of its identifier before the last
+        one; glean_parser groups the merged metrics by category.
+        """
+        categories = {}
+        for path in paths:
+            metrics, errors = cached_glean_parse(
+                self._parse,
+                "glean-metrics-file",
+                [path],
+                config,
+                commit_hash,
+                parse_cache,
+            )
+            if errors:
+                return None
+
+            for identifier, metric in metrics.items():
+                category = categories.setdefault(identifier.rpartition(".")[0], {})
+                if identifier in category:
+                    return None
+                category[identifier] = metric
+
+        return {
+            identifier: metric
+            for category in categories.values()
+            for identifier, metric in category.items()
+        }
+
+    def parse(
+        self, filenames, config, repo_url=None, commit_hash=None, parse_cache=None
+    ):
+        config = config.copy()
+        config["do_not_disable_expired"] = True
+
+        paths = [Path(fname) for fname in filenames]
+        paths = [path for path in paths if path.is_file()]
+
+        metrics = None
+        errors = []
+        if parse_cache is not None and commit_hash and len(paths) > 1:
+            metrics = self._parse_per_file(paths, config, commit_hash, parse_cache)
+        if metrics is None:
+            metrics, errors = cached_glean_parse(
+                self._parse, "glean-metrics", paths, config, commit_hash, parse_cache
+            )
 
         for v in metrics.values():
             v["send_in_pings"] = [normalize_ping_name(p) for p in v["send_in_pings"]]
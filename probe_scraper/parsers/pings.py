@@ -6,7 +6,7 @@ from pathlib import Path
 
 from glean_parser.parser import parse_objects
 
-from .utils import get_source_url
+from .utils import cached_glean_parse, get_source_url
 
 PING_NAME_NORMALIZATION = {
     "deletion_request": "deletion-request",
@@ -20,8 +20,7 @@ def normalize_ping_name(name):
     return PING_NAME_NORMALIZATION.get(name, name)
 
 
-def generate_definition(ping_data, repo_url, commit_hash):
-    serialized = ping_data.serialize()
+def generate_definition(serialized, repo_url, commit_hash):
     if repo_url and commit_hash:
         serialized["source_url"] = get_source_url(
             serialized["defined_in"], repo_url, commit_hash
@@ -38,19 +37,30 @@ class GleanPingsParser:
     to parse the pings.yaml files.
     """
 
-    def parse(self, filenames, config, repo_url=None, commit_hash=None):
-        config = config.copy()
-        paths = [Path(fname) for fname in filenames]
-        paths = [path for path in paths if path.is_file()]
+    def _parse(self, paths, config):
         results = parse_objects(paths, config)
         errors = [err for err in results]
 
         pings = {
-            normalize_ping_name(ping_name): generate_definition(
-                ping_data, repo_url, commit_hash
-            )
+            normalize_ping_name(ping_name): ping_data.serialize()
             for category, pings in results.value.items()
             for ping_name, ping_data in pings.items()
         }
+        return pings, errors
+
+    def parse(
+        self, filenames, config, repo_url=None, commit_hash=None, parse_cache=None
+    ):
+        config = config.copy()
+        paths = [Path(fname) for fname in filenames]
+        paths = [path for path in paths if path.is_file()]
+        pings, errors = cached_glean_parse(
+            self._parse, "glean-pings", paths, config, commit_hash, parse_cache
+        )
+
+        pings = {
+            ping_name: generate_definition(ping_data, repo_url, commit_hash)
+            for ping_name, ping_data in pings.items()
+        }
 
         return pings, errors
@@ -35,6 +35,10 @@ def transform_scalar_info(probes):
 
 
 class ScalarsParser:
+    def cache_flags(self, version=None, channel=None):
+        """The options that change the output of `parse` for the same files."""
+        return {}
+
     def parse(self, filenames, version=None, channel=None):
         if len(filenames) > 1:
             raise Exception("We don't support loading from more than one file.")
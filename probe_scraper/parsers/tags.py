@@ -6,7 +6,7 @@ from pathlib import Path
 
 from glean_parser.parser import parse_objects
 
-from .utils import get_source_url
+from .utils import cached_glean_parse, get_source_url
 
 
 class GleanTagsParser:
@@ -16,16 +16,24 @@ class GleanTagsParser:
     to parse tags.yaml files.
     """
 
-    def parse(self, filenames, config, repo_url=None, commit_hash=None):
-        config = config.copy()
-        paths = [Path(fname) for fname in filenames]
-        paths = [path for path in paths if path.is_file()]
+    def _parse(self, paths, config):
         results = parse_objects(paths, config)
         errors = [err for err in results]
         tags = {
             tag_name: tag_data.serialize()
             for tag_name, tag_data in results.value.get("tags", {}).items()
         }
+        return tags, errors
+
+    def parse(
+        self, filenames, config, repo_url=None, commit_hash=None, parse_cache=None
+    ):
+        config = config.copy()
+        paths = [Path(fname) for fname in filenames]
+        paths = [path for path in paths if path.is_file()]
+        tags, errors = cached_glean_parse(
+            self._parse, "glean-tags", paths, config, commit_hash, parse_cache
+        )
 
         for v in tags.values():
             if repo_url and commit_hash:
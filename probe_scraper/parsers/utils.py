@@ -2,6 +2,11 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import copy
+import os
+
+import glean_parser
+
 
 def set_in_nested_dict(dictionary, path, value):
     """Set a property in a nested dictionary by specifying a path to it.
@@ -33,3 +38,49 @@ def get_source_url(glean_definition, repo_url, commit_hash):
         glean_definition["filepath"].find(commit_hash) :  # noqa: E203
     ]
     return f"{repo_url}/blob/{file_path}#L{line_number}"
+
+
+def cached_glean_parse(parse, parser_name, paths, config, commit_hash, parse_cache):
+    """Call `parse(paths, config)`, reusing results from `parse_cache`.
+
+    `parse` must return a dictionary of serialized Glean definitions, which
+    include `defined_in`, and a list of errors. The results are cached by the
+    content and the path of the files within the checkout of `commit_hash`,
+    so commits with identical files share them; the file paths in
+    `defined_in` are stored relative to the checkout, and re-derived for the
+    commit that is parsed. Results with errors aren't cached.
+
+    The returned definitions are always fresh copies that can be modified.
+    """
+    if (
+        parse_cache is None
+        or not commit_hash
+        or not paths
+        or any(commit_hash not in str(path) for path in paths)
+    ):
+        return parse(paths, config)
+
+    # All files are in the checkout of the commit, i.e. <root>/<commit_hash>/...
+    checkout = str(paths[0])[: str(paths[0]).find(commit_hash) + len(commit_hash)]
+    names = [os.path.relpath(path, checkout) for path in paths]
+    flags = {"config": config, "glean_parser": glean_parser.__version__}
+    key = parse_cache.key(parser_name, paths, flags, names=names)
+
+    cached = parse_cache.get(key)
+    if cached is None:
+        definitions, errors = parse(paths, config)
+        if errors:
+            return definitions, errors
+
+        cached = copy.deepcopy(definitions)
+        for definition in cached.values():
+            defined_in = definition["defined_in"]
+            defined_in["filepath"] = os.path.relpath(defined_in["filepath"], checkout)
+        parse_cache.put(key, cached)
+        return definitions, errors
+
+    definitions = copy.deepcopy(cached)
+    for definition in definitions.values():
+        defined_in = definition["defined_in"]
+        defined_in["filepath"] = os.path.join(checkout, defined_in["filepath"])
+    return definitions, []
@@ -14,7 +14,7 @@ from typing import Dict, List, Tuple, Union
 
 import requests
 
-from probe_scraper import emailer
+from probe_scraper import emailer, http_client
 from probe_scraper.parsers.events import EventsParser
 from probe_scraper.parsers.histograms import HistogramsParser
 from probe_scraper.parsers.scalars import ScalarsParser
@@ -90,7 +90,7 @@ def bugzilla_request_header(api_key: str) -> Dict[str, str]:
 def get_bug_component(
     bug_id: int, api_key: str
 ) -> Tuple[Union[str, None], Union[str, None]]:
-    response = requests.get(
+    response = http_client.get(
         BUGZILLA_BUG_URL + "/" + str(bug_id), headers=bugzilla_request_header(api_key)
     )
     try:
@@ -116,7 +116,7 @@ def find_existing_bugs(
         "whiteboard": whiteboard_tag,
         "include_fields": "description,summary,id",
     }
-    response = requests.get(
+    response = http_client.get(
         BUGZILLA_BUG_URL,
         params=search_query_params,
         headers=bugzilla_request_header(api_key),
@@ -234,7 +234,7 @@ def create_bug(
         ],
         "cc": [email for email in probes[0].emails if not needinfo],
     }
-    create_response = requests.post(
+    create_response = http_client.post(
         BUGZILLA_BUG_URL, json=create_params, headers=bugzilla_request_header(api_key)
     )
     try:
@@ -263,7 +263,7 @@ def create_bug(
 
 
 def check_bugzilla_user_exists(email: str, api_key: str):
-    user_response = requests.get(
+    user_response = http_client.get(
         BUGZILLA_USER_URL + "?names=" + email, headers=bugzilla_request_header(api_key)
     )
     try:
@@ -281,14 +281,14 @@ def check_bugzilla_user_exists(email: str, api_key: str):
 
 
 def get_latest_nightly_version():
-    versions = requests.get(
+    versions = http_client.get(
         "https://product-details.mozilla.org/1.0/firefox_versions.json"
     ).json()
     return get_major_version(versions["FIREFOX_NIGHTLY"])
 
 
 def download_file(url: str, output_filepath: str):
-    content = requests.get(url).text
+    content = http_client.get(url).text
     with open(output_filepath, "w") as output_file:
         output_file.write(content)
 
@@ -5,20 +5,32 @@
 import argparse
 import datetime
 import errno
-import gzip
 import json
 import os
-import subprocess
 import sys
 import tempfile
 import traceback
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from typing import Optional
 
 from dateutil.tz import tzlocal
 
-from . import fog_checks, glean_checks, transform_probes, transform_revisions
+from . import (
+    blob_store,
+    cache_pack,
+    compression,
+    fog_checks,
+    glean_checks,
+    http_client,
+    s3_sync,
+    serializers,
+    transform_probes,
+    transform_revisions,
+)
 from .emailer import send_ses
+from .output_manifest import MANIFEST_FILENAME, OutputManifest
+from .parse_cache import PARSE_CACHE_DIR, ParseCache
 from .parsers.events import EventsParser
 from .parsers.histograms import HistogramsParser
 from .parsers.metrics import GleanMetricsParser
@@ -62,7 +74,28 @@ def general_data():
     }
 
 
-def dump_json(data, out_dir, file_name):
+def write_output(content, out_dir, file_name, manifest=None, siblings=False):
+    """
+    Write the bytes `content` to `file_name` in `out_dir`, and with
+    `siblings`, its pre-compressed siblings as configured in `compression`.
+    """
+    path = os.path.join(out_dir, file_name)
+    sibling_levels = compression.get_sibling_levels() if siblings else {}
+
+    # Files that are unchanged since the last upload are not written. The
+    # gzip sibling is uploaded in place of the file itself, while the brotli
+    # sibling is uploaded under its own name.
+    files = []
+    if manifest is None or manifest.add(path, content):
+        files.append((path, None, compression.get_output_level()))
+        if "gzip" in sibling_levels:
+            files.append((path + ".gz", "gzip", sibling_levels["gzip"]))
+    if "br" in sibling_levels:
+        if manifest is None or manifest.add(path + ".br", content):
+            files.append((path + ".br", "br", sibling_levels["br"]))
+    if not files:
+        return
+
     # Make sure that the output directory exists. This also creates
     # intermediate directories if needed.
     try:
@@ -71,96 +104,101 @@ def dump_json(data, out_dir, file_name):
         if e.errno != errno.EEXIST:
             raise
 
-    def date_serializer(o):
-        if isinstance(o, datetime.datetime):
-            return o.isoformat()
+    for file_path, encoding, level in files:
+        with open(file_path, "wb") as f:
+            print("  " + file_path)
+            if encoding is not None:
+                compression.write_compressed(f, content, encoding, level)
+            elif level is not None:
+                compression.write_gzipped(f, content, level)
+            else:
+                f.write(content)
 
-    path = os.path.join(out_dir, file_name)
-    with open(path, "w") as f:
-        print("  " + path)
-        json.dump(
-            data,
-            f,
-            sort_keys=True,
-            indent=2,
-            separators=(",", ": "),
-            default=date_serializer,
-        )
 
+def dump_json(data, out_dir, file_name, manifest=None):
+    content = serializers.get_default().dumps(data)
+    write_output(content, out_dir, file_name, manifest, siblings=True)
 
-def write_moz_central_probe_data(probe_data, revisions, out_dir):
+
+def write_moz_central_probe_data(probe_data, revisions, out_dir, manifest=None):
     # Save all our files to "outdir/firefox/..." to mimic a REST API.
     base_dir = os.path.join(out_dir, "firefox")
 
     print("\nwriting output:")
-    dump_json(general_data(), base_dir, "general")
-    dump_json(revisions, base_dir, "revisions")
+    dump_json(general_data(), base_dir, "general", manifest)
+    dump_json(revisions, base_dir, "revisions", manifest)
 
     # Break down the output by channel. We don't need to write a revisions
     # file in this case, the probe data will contain human readable version
     # numbers along with revision numbers.
     for channel, channel_probes in probe_data.items():
         data_dir = os.path.join(base_dir, channel, "main")
-        dump_json(channel_probes, data_dir, "all_probes")
+        dump_json(channel_probes, data_dir, "all_probes", manifest)
 
 
-def write_general_data(out_dir):
-    dump_json(general_data(), out_dir, "general")
-    with open(os.path.join(out_dir, "index.html"), "w") as f:
-        f.write(
-            """
+def write_general_data(out_dir, manifest=None):
+    dump_json(general_data(), out_dir, "general", manifest)
+    index = """
             <html><head><title>Mozilla Probe Info</title></head>
             <body>This site contains metadata used by Mozilla's data collection
             infrastructure, for more information see
             <a href=\"https://mozilla.github.io/probe-scraper/\">the generated documentation</a>.
             </body></html>
             """
-        )
+    write_output(index.encode("utf-8"), out_dir, "index.html", manifest)
 
 
-def write_glean_metric_data(metrics, dependencies, out_dir):
+def write_glean_metric_data(metrics, dependencies, out_dir, manifest=None):
     # Save all our files to "outdir/glean/<repo>/..." to mimic a REST API.
     for repo, metrics_data in metrics.items():
         dependencies_data = dependencies[repo]
 
         base_dir = os.path.join(out_dir, "glean", repo)
 
-        dump_json(general_data(), base_dir, "general")
-        dump_json(metrics_data, base_dir, "metrics")
-        dump_json(dependencies_data, base_dir, "dependencies")
+        dump_json(general_data(), base_dir, "general", manifest)
+        dump_json(metrics_data, base_dir, "metrics", manifest)
+        dump_json(dependencies_data, base_dir, "dependencies", manifest)
 
 
-def write_glean_tag_data(tags, out_dir):
+def write_glean_tag_data(tags, out_dir, manifest=None):
     # Save all our files to "outdir/glean/<repo>/..." to mimic a REST API.
     for repo, tags_data in tags.items():
         base_dir = os.path.join(out_dir, "glean", repo)
-        dump_json(tags_data, base_dir, "tags")
+        dump_json(tags_data, base_dir, "tags", manifest)
 
 
-def write_glean_ping_data(pings, out_dir):
+def write_glean_ping_data(pings, out_dir, manifest=None):
     # Save all our files to "outdir/glean/<repo>/..." to mimic a REST API.
     for repo, pings_data in pings.items():
         base_dir = os.path.join(out_dir, "glean", repo)
-        dump_json(pings_data, base_dir, "pings")
+        dump_json(pings_data, base_dir, "pings", manifest)
 
 
-def write_repositories_data(repos, out_dir):
+def write_repositories_data(repos, out_dir, manifest=None):
     json_data = [r.to_dict() for r in repos]
-    dump_json(json_data, os.path.join(out_dir, "glean"), "repositories")
+    dump_json(json_data, os.path.join(out_dir, "glean"), "repositories", manifest)
 
 
-def write_v2_data(repos, out_dir):
+def write_v2_data(repos, out_dir, manifest=None):
     dump_json(
-        repos["app-listings"], os.path.join(out_dir, "v2", "glean"), "app-listings"
+        repos["app-listings"],
+        os.path.join(out_dir, "v2", "glean"),
+        "app-listings",
+        manifest,
     )
     dump_json(
         repos["library-variants"],
         os.path.join(out_dir, "v2", "glean"),
         "library-variants",
+        manifest,
     )
 
 
-def parse_moz_central_probes(scraped_data):
+def parse_registry(probe_type, paths, version, channel):
+    return PARSERS[probe_type].parse(paths, version, channel)
+
+
+def parse_moz_central_probes(scraped_data, parse_cache=None, jobs=1):
     """
     Parse probe data from files into the form:
     channel_name: {
@@ -175,7 +213,13 @@ def parse_moz_central_probes(scraped_data):
       },
       ...
     }
+
+    Identical inputs are only parsed once, and if a `parse_cache` is given,
+    parse results are also reused across runs. With `jobs` > 1, the inputs
+    are parsed on a pool of that many processes.
     """
+    if parse_cache is None:
+        parse_cache = ParseCache()
 
     lookup_table = {}
 
@@ -202,13 +246,35 @@ def parse_moz_central_probes(scraped_data):
 
         return deduped
 
-    probes = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    # Find the distinct inputs that still need parsing.
+    keys = {}
+    to_parse = {}
     for channel, revisions in scraped_data.items():
         for revision, details in revisions.items():
             for probe_type, paths in details["registries"].items():
-                results = PARSERS[probe_type].parse(paths, details["version"], channel)
-                deduped = dedupe_probes(results)
-                probes[channel][revision][probe_type] = deduped
+                version = details["version"]
+                flags = PARSERS[probe_type].cache_flags(version, channel)
+                key = parse_cache.key(probe_type, paths, flags)
+                keys[(channel, revision, probe_type)] = key
+                if key not in to_parse and parse_cache.get(key) is None:
+                    to_parse[key] = (probe_type, paths, version, channel)
+
+    if jobs > 1 and len(to_parse) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            parsed = executor.map(parse_registry, *zip(*to_parse.values()))
+            for key, results in zip(to_parse, parsed):
+                parse_cache.put(key, results)
+    else:
+        for key, args in to_parse.items():
+            parse_cache.put(key, parse_registry(*args))
+
+    # Dedupe in scraping order, so the result doesn't depend on `jobs`.
+    deduped_by_key = {}
+    probes = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    for (channel, revision, probe_type), key in keys.items():
+        if key not in deduped_by_key:
+            deduped_by_key[key] = dedupe_probes(parse_cache.get(key))
+        probes[channel][revision][probe_type] = deduped_by_key[key]
 
     return probes
 
@@ -232,7 +298,15 @@ def add_first_appeared_dates(probes_by_channel, first_appeared_dates):
 
 
 def load_moz_central_probes(
-    cache_dir, out_dir, fx_version, min_fx_version, firefox_channel
+    cache_dir,
+    out_dir,
+    fx_version,
+    min_fx_version,
+    firefox_channel,
+    download_workers=moz_central_scraper.DOWNLOAD_WORKERS,
+    only_changed_files=False,
+    jobs=1,
+    manifest=None,
 ):
 
     if fx_version:
@@ -252,35 +326,190 @@ def load_moz_central_probes(
         min_fx_version=min_fx_version,
         max_fx_version=max_fx_version,
         channels=channels,
+        workers=download_workers,
+        only_changed=only_changed_files,
+    )
+    revision_probes = parse_moz_central_probes(
+        revision_data, ParseCache(cache_dir), jobs=jobs
     )
-    revision_probes = parse_moz_central_probes(revision_data)
 
-    # Get the minimum revision and date per probe-channel
+    # Build the probe histories and get the minimum revision and date
+    # per probe-channel
     revision_dates = transform_revisions.transform(revision_data)
-    first_appeared_dates = transform_probes.get_minimum_date(
+    probes_by_channel, first_appeared_dates = transform_probes.transform_all(
         revision_probes, revision_data, revision_dates
     )
 
-    probes_by_channel = transform_probes.transform(
-        revision_probes,
-        revision_data,
-        break_by_channel=True,
-        revision_dates=revision_dates,
-    )
-    probes_by_channel["all"] = transform_probes.transform(
-        revision_probes,
-        revision_data,
-        break_by_channel=False,
-        revision_dates=revision_dates,
-    )
-
     # Add in the first appeared dates
     probes_by_channel_with_dates = add_first_appeared_dates(
         probes_by_channel, first_appeared_dates
     )
 
     # Serialize the probe data to disk.
-    write_moz_central_probe_data(probes_by_channel_with_dates, revision_dates, out_dir)
+    write_moz_central_probe_data(
+        probes_by_channel_with_dates, revision_dates, out_dir, manifest
+    )
+
+
+# The parse cache of a Glean parsing worker process, see `_init_glean_worker`.
+_worker_parse_cache = None
+
+
+def _init_glean_worker(cache_dir):
+    global _worker_parse_cache
+    _worker_parse_cache = ParseCache(cache_dir)
+
+
+class GleanRepoContext:
+    """
+    The state for parsing the Glean files of a repository that is the same
+    for each of its commits.
+    """
+
+    FILE_TYPES = [
+        ("tags", GLEAN_TAGS_FILENAME),
+        ("metrics", GLEAN_METRICS_FILENAME),
+        ("pings", GLEAN_PINGS_FILENAME),
+    ]
+
+    def __init__(self, repo):
+        self.name = repo.name
+        self.url = repo.url
+        self.config = {"allow_reserved": repo.name.startswith("glean")}
+        self._types_by_name = {}
+
+    def classify(self, paths):
+        """
+        Split `paths` by file type, into a dict of "tags", "metrics" and
+        "pings" to the paths of that type.
+
+        A repository has the same few file names at every commit, so the
+        type of each file name is only looked up once.
+        """
+        files = {file_type: [] for file_type, _ in self.FILE_TYPES}
+        for path in paths:
+            name = os.path.basename(path)
+            if name not in self._types_by_name:
+                self._types_by_name[name] = next(
+                    (t for t, suffix in self.FILE_TYPES if name.endswith(suffix)),
+                    None,
+                )
+            file_type = self._types_by_name[name]
+            if file_type is not None:
+                files[file_type].append(path)
+        return files
+
+
+def parse_glean_commit(context, commit_hash, paths, parse_cache=None):
+    """
+    Parse the Glean files in `paths` of one commit of the repository
+    described by the `GleanRepoContext` `context`.
+
+    Returns `(results, errs, exc)`: `results` maps "tags", "metrics" and
+    "pings" to the results of each parser that ran, `errs` holds the errors
+    reported by the last parser that ran (None if none did), and `exc` is
+    the formatted traceback if parsing raised, otherwise None.
+    """
+    if parse_cache is None:
+        parse_cache = _worker_parse_cache
+
+    files = context.classify(paths)
+    config = context.config
+
+    results = {}
+    errs = None
+    try:
+        if files["tags"]:
+            results["tags"], errs = GLEAN_TAGS_PARSER.parse(
+                files["tags"], config, context.url, commit_hash, parse_cache
+            )
+
+        if files["metrics"]:
+            results["metrics"], errs = GLEAN_PARSER.parse(
+                files["metrics"], config, context.url, commit_hash, parse_cache
+            )
+
+        if files["pings"]:
+            results["pings"], errs = GLEAN_PINGS_PARSER.parse(
+                files["pings"], config, context.url, commit_hash, parse_cache
+            )
+    except Exception:
+        return results, errs, traceback.format_exc()
+    return results, errs, None
+
+
+def parse_glean_metrics(repositories, repos_metrics_data, emails, cache_dir, jobs=1):
+    """
+    Parse the Glean files of every scraped commit into the form:
+    <repo_name>:  {
+      <commit-hash>:  {
+        <metric-name>: {
+          ...
+        },
+      },
+      ...
+    }
+    for each of tags, metrics and pings, which are returned in that order.
+
+    Problems with the files are added to `emails`. With `jobs` > 1, the
+    commits are parsed on a pool of that many processes; results are merged
+    in scraping order, so the output doesn't depend on `jobs`.
+    """
+    contexts = {repo.name: GleanRepoContext(repo) for repo in repositories}
+    tasks = [
+        (contexts[repo_name], commit_hash, paths)
+        for repo_name, commits in repos_metrics_data.items()
+        for commit_hash, paths in commits.items()
+    ]
+
+    if jobs > 1 and len(tasks) > 1:
+        # Consecutive commits of a repository mostly share their files, so
+        # hand them out in runs to keep each worker's parse cache warm.
+        chunksize = max(1, len(tasks) // (jobs * 4))
+        executor = ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_glean_worker, initargs=(cache_dir,)
+        )
+        with executor:
+            parsed = list(
+                executor.map(parse_glean_commit, *zip(*tasks), chunksize=chunksize)
+            )
+    else:
+        parse_cache = ParseCache(cache_dir)
+        parsed = [parse_glean_commit(*task, parse_cache) for task in tasks]
+
+    tags = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    metrics = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    pings = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    by_type = {"tags": tags, "metrics": metrics, "pings": pings}
+    errs = None
+    for (context, commit_hash, paths), (results, commit_errs, exc) in zip(
+        tasks, parsed
+    ):
+        repo_name = context.name
+        for probe_type, commit_results in results.items():
+            by_type[probe_type][repo_name][commit_hash] = commit_results
+        if commit_errs is not None:
+            errs = commit_errs
+
+        if exc is not None:
+            files = context.classify(paths)
+            files = files["metrics"] + files["pings"]
+            msg = "Improper file in {}\n{}".format(", ".join(files), exc)
+            emails[repo_name]["emails"].append(
+                {"subject": "Probe Scraper: Improper File", "message": msg}
+            )
+        elif errs:
+            msg = ("Error in processing commit {}\n" "Errors: [{}]").format(
+                commit_hash, ".".join(errs)
+            )
+            emails[repo_name]["emails"].append(
+                {
+                    "subject": "Probe Scraper: Error on parsing metric or ping files",
+                    "message": msg,
+                }
+            )
+
+    return tags, metrics, pings
 
 
 def load_glean_metrics(
@@ -290,10 +519,13 @@ def load_glean_metrics(
     dry_run,
     glean_repos,
     bugzilla_api_key: Optional[str],
+    git_workers=git_scraper.WORKERS,
+    jobs=1,
+    manifest=None,
 ):
     repositories = RepositoriesParser().parse(repositories_file, glean_repos)
     commit_timestamps, repos_metrics_data, emails = git_scraper.scrape(
-        cache_dir, repositories
+        cache_dir, repositories, git_workers
     )
 
     glean_checks.check_glean_metric_structure(repos_metrics_data)
@@ -307,57 +539,16 @@ def load_glean_metrics(
     #   },
     #   ...
     # }
-    tags = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-    metrics = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-    pings = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-    for repo_name, commits in repos_metrics_data.items():
-        for commit_hash, paths in commits.items():
-            tags_files = [p for p in paths if p.endswith(GLEAN_TAGS_FILENAME)]
-            metrics_files = [p for p in paths if p.endswith(GLEAN_METRICS_FILENAME)]
-            pings_files = [p for p in paths if p.endswith(GLEAN_PINGS_FILENAME)]
-
-            try:
-                config = {"allow_reserved": repo_name.startswith("glean")}
-                repo = next(r for r in repositories if r.name == repo_name).to_dict()
-
-                if tags_files:
-                    results, errs = GLEAN_TAGS_PARSER.parse(
-                        tags_files, config, repo["url"], commit_hash
-                    )
-                    tags[repo_name][commit_hash] = results
-
-                if metrics_files:
-                    results, errs = GLEAN_PARSER.parse(
-                        metrics_files, config, repo["url"], commit_hash
-                    )
-                    metrics[repo_name][commit_hash] = results
-
-                if pings_files:
-                    results, errs = GLEAN_PINGS_PARSER.parse(
-                        pings_files, config, repo["url"], commit_hash
-                    )
-                    pings[repo_name][commit_hash] = results
-            except Exception:
-                files = metrics_files + pings_files
-                msg = "Improper file in {}\n{}".format(
-                    ", ".join(files), traceback.format_exc()
-                )
-                emails[repo_name]["emails"].append(
-                    {"subject": "Probe Scraper: Improper File", "message": msg}
-                )
-            else:
-                if errs:
-                    msg = ("Error in processing commit {}\n" "Errors: [{}]").format(
-                        commit_hash, ".".join(errs)
-                    )
-                    emails[repo_name]["emails"].append(
-                        {
-                            "subject": "Probe Scraper: Error on parsing metric or ping files",
-                            "message": msg,
-                        }
-                    )
-
-    abort_after_emails = False
+    tags, metrics, pings = parse_glean_metrics(
+        repositories, repos_metrics_data, emails, cache_dir, jobs
+    )
+
+    # Repositories that failed to be scraped have no data, rather than no
+    # probes. No output is written for them, so their published data isn't
+    # replaced with empty files, and the run is aborted once the emails are
+    # sent, so nothing is uploaded.
+    failed = git_scraper.failed_repos(emails)
+    abort_after_emails = bool(failed)
 
     tags_by_repo = {repo: {} for repo in repos_metrics_data}
     tags_by_repo.update(
@@ -401,15 +592,18 @@ def load_glean_metrics(
     if fog_emails_by_repo is not None:
         emails.update(fog_emails_by_repo)
 
+    for repo in failed:
+        del tags_by_repo[repo], metrics_by_repo[repo], pings_by_repo[repo]
+
     print("\nwriting output:")
-    write_glean_tag_data(tags_by_repo, out_dir)
-    write_glean_metric_data(metrics_by_repo, dependencies_by_repo, out_dir)
-    write_glean_ping_data(pings_by_repo, out_dir)
-    write_repositories_data(repositories, out_dir)
-    write_general_data(out_dir)
+    write_glean_tag_data(tags_by_repo, out_dir, manifest)
+    write_glean_metric_data(metrics_by_repo, dependencies_by_repo, out_dir, manifest)
+    write_glean_ping_data(pings_by_repo, out_dir, manifest)
+    write_repositories_data(repositories, out_dir, manifest)
+    write_general_data(out_dir, manifest)
 
     repos_v2 = RepositoriesParser().parse_v2(repositories_file)
-    write_v2_data(repos_v2, out_dir)
+    write_v2_data(repos_v2, out_dir, manifest)
 
     for repo_name, email_info in list(emails.items()):
         addresses = email_info["addresses"] + [DEFAULT_TO_EMAIL]
@@ -426,86 +620,115 @@ def load_glean_metrics(
         raise ValueError("Errors processing Glean metrics")
 
 
-def setup_output_and_cache_dirs(output_bucket, cache_bucket, out_dir, cache_dir):
+# The cache files that are synced with S3. Only the blob store, the
+# references into it, the parse results, the walked git histories and the
+# top-level caches are synced; the per-revision files are links into the
+# blob store that are restored on demand.
+CACHE_FILES = [
+    f"{blob_store.BLOBS_DIR}/*",
+    f"{blob_store.REFS_DIR}/*",
+    f"{PARSE_CACHE_DIR}/*",
+    f"{git_scraper.STATE_DIR}/*",
+    "probe_scraper_*.json",
+    MANIFEST_FILENAME,
+]
+
+
+def setup_output_and_cache_dirs(
+    output_bucket, cache_bucket, out_dir, cache_dir, s3=None, packed=False
+):
+    if s3 is None:
+        s3 = s3_sync.S3Sync()
+
     # Create the output directory
     os.mkdir(out_dir)
 
     # Sync the cache directory
     cache_path = f"s3://{cache_bucket}/cache/probe-scraper"
+    if packed:
+        # The packed cache lives next to the file-by-file one, which is
+        # only read until the packed cache is first uploaded.
+        packed_path = cache_path + "-packed"
+        print(f"Restoring packed cache from {packed_path} into {cache_dir}")
+        if cache_pack.restore(s3, packed_path, cache_dir) is not None:
+            return packed_path
+        print(f"No packed cache at {packed_path}")
     print(f"Syncing cache from {cache_path} with {cache_dir}")
-    subprocess.check_call(["aws", "s3", "sync", cache_path, cache_dir])
-    return cache_path
+    # Caches from before the blob store have per-revision files, which are
+    # only downloaded to move them into the store. Once it has been
+    # uploaded, these are left in S3.
+    migrated = s3.list_keys(f"{cache_path}/{blob_store.REFS_DIR}")
+    s3.download(cache_path, cache_dir, include=CACHE_FILES if migrated else None)
+    return cache_path + "-packed" if packed else cache_path
+
+
+def output_upload_args(rel_path):
+    # All files are uploaded compressed, see `compression.gzip_tree`.
+    args = {
+        "CacheControl": "max-age=28800",
+        "ACL": "public-read",
+        "ContentType": "application/json",
+        "ContentEncoding": "gzip",
+    }
+    if rel_path == "index.html":
+        args["ContentType"] = "text/html"
+    elif rel_path.endswith(compression.SIBLING_SUFFIXES["br"]):
+        args["ContentEncoding"] = "br"
+    return args
 
 
 def sync_output_and_cache_dirs(
-    output_bucket, cache_bucket, out_dir, cache_dir, cache_path
+    output_bucket,
+    cache_bucket,
+    out_dir,
+    cache_dir,
+    cache_path,
+    manifest=None,
+    compress_workers=compression.WORKERS,
+    gzip_level=compression.GZIP_LEVEL,
+    s3=None,
+    packed=False,
 ):
-    # Check output dir and then sync with cloudfront
-    if not os.listdir(out_dir):
+    if s3 is None:
+        s3 = s3_sync.S3Sync()
+
+    # Check output dir and then sync with cloudfront. With a manifest, only
+    # the files that changed since the last upload are in the output dir.
+    if not (os.listdir(out_dir) if manifest is None else manifest.files):
         print("{} is empty".format(out_dir))
         sys.exit(1)
     else:
         print("Syncing output dir {}/ with s3://{}/".format(out_dir, output_bucket))
+        output_path = f"s3://{output_bucket}/"
 
         # cloudfront is supposed to automatically gzip objects, but it won't do that
         # if the object size is > 10 megabytes (https://webmasters.stackexchange.com/a/111734)
         # which our files sometimes are. to work around this, we'll regzip the contents into a
-        # temporary directory, and upload that with a special content encoding
+        # temporary directory, and upload that with a special content encoding.
+        # Files that were written gzipped already are only linked, and
+        # pre-compressed brotli siblings are uploaded under their own names.
         with tempfile.TemporaryDirectory() as tmpdirname:
-            for root, dirnames, filenames in os.walk(out_dir):
-                rel_root = os.path.relpath(root, start=out_dir)
-                for dirname in dirnames:
-                    os.mkdir(os.path.join(tmpdirname, rel_root, dirname))
-                for filename in filenames:
-                    in_filename = os.path.join(root, filename)
-                    out_filename = os.path.join(tmpdirname, rel_root, filename)
-                    with open(in_filename, "rb") as f1:
-                        with gzip.open(out_filename, "wb") as f2:
-                            f2.write(f1.read())
-
-            # Synchronize the json files and index.html separately,
-            # as they have different mimetypes
-            sync_params = [
-                "--content-encoding",
-                "gzip",
-                "--cache-control",
-                "max-age=28800",
-                "--acl",
-                "public-read",
-            ]
-            subprocess.check_call(
-                [
-                    "aws",
-                    "s3",
-                    "sync",
-                    f"{tmpdirname}/",
-                    f"s3://{output_bucket}/",
-                    "--delete",
-                    "--exclude",
-                    "index.html",
-                    "--content-type",
-                    "application/json",
-                ]
-                + sync_params
-            )
-            subprocess.check_call(
-                [
-                    "aws",
-                    "s3",
-                    "cp",
-                    f"{tmpdirname}/index.html",
-                    f"s3://{output_bucket}/",
-                    "--content-type",
-                    "text/html",
-                ]
-                + sync_params
+            compression.gzip_tree(out_dir, tmpdirname, compress_workers, gzip_level)
+
+            # Files that are no longer written are deleted. With a manifest,
+            # the unchanged files are missing from the output dir, so the
+            # removed ones are deleted explicitly instead.
+            delete = manifest is None or manifest.previous is None
+            s3.upload(
+                tmpdirname, output_path, extra_args=output_upload_args, delete=delete
             )
 
-        # Sync cache data
+        if manifest is not None:
+            s3.delete(output_path, manifest.removed())
+            manifest.save(cache_dir)
+
+        # Sync cache data. Files that are unchanged since they were
+        # downloaded are skipped.
         print(f"Syncing cache dir {cache_dir}/ with {cache_path}")
-        subprocess.check_call(
-            ["aws", "s3", "sync", "--exclude=*.git/*", cache_dir, cache_path]
-        )
+        if packed:
+            cache_pack.pack(s3, cache_dir, cache_path, include=CACHE_FILES)
+        else:
+            s3.upload(cache_dir, cache_path, include=CACHE_FILES)
 
 
 def main(
@@ -523,18 +746,50 @@ def main(
     cache_bucket,
     env,
     bugzilla_api_key: Optional[str],
+    download_workers: int = moz_central_scraper.DOWNLOAD_WORKERS,
+    only_changed_files: bool = False,
+    jobs: int = 1,
+    git_workers: int = git_scraper.WORKERS,
+    json_backend: str = "auto",
+    compact_json: bool = False,
+    gzip_output: bool = False,
+    compress_workers: int = compression.WORKERS,
+    precompress=(),
+    gzip_level: int = compression.GZIP_LEVEL,
+    brotli_level: int = compression.BROTLI_LEVEL,
+    s3_workers: int = s3_sync.WORKERS,
+    packed_cache: bool = False,
 ):
+    serializers.set_default(serializers.get_serializer(json_backend, compact_json))
+    compression.set_output_level(gzip_level if gzip_output else None)
+    levels = {"gzip": gzip_level, "br": brotli_level}
+    compression.set_sibling_levels(
+        {encoding: levels[encoding] for encoding in precompress}
+    )
 
     # Sync dirs with s3 if we are not running pytest or local dryruns
+    manifest = None
     if env == "prod":
+        # The same syncer is used for both directions, so that cache files
+        # that are unchanged since they were downloaded aren't uploaded.
+        s3 = s3_sync.S3Sync(workers=s3_workers)
         cache_path = setup_output_and_cache_dirs(
-            output_bucket, cache_bucket, out_dir, cache_dir
+            output_bucket, cache_bucket, out_dir, cache_dir, s3, packed_cache
         )
+        manifest = OutputManifest.load(cache_dir, out_dir)
 
     process_both = not (process_moz_central_probes or process_glean_metrics)
     if process_moz_central_probes or process_both:
         load_moz_central_probes(
-            cache_dir, out_dir, firefox_version, min_firefox_version, firefox_channel
+            cache_dir,
+            out_dir,
+            firefox_version,
+            min_firefox_version,
+            firefox_channel,
+            download_workers,
+            only_changed_files,
+            jobs,
+            manifest,
         )
     if process_glean_metrics or process_both:
         load_glean_metrics(
@@ -544,12 +799,30 @@ def main(
             dry_run,
             glean_repos,
             bugzilla_api_key,
+            git_workers,
+            jobs,
+            manifest,
+        )
+
+    print(
+        "\nHTTP traffic: {requests} requests, {retries} retries, {bytes} bytes".format(
+            **http_client.stats.to_dict()
         )
+    )
 
     # Sync results with s3 if we are not running pytest or local dryruns
     if env == "prod":
         sync_output_and_cache_dirs(
-            output_bucket, cache_bucket, out_dir, cache_dir, cache_path
+            output_bucket,
+            cache_bucket,
+            out_dir,
+            cache_dir,
+            cache_path,
+            manifest,
+            compress_workers,
+            gzip_level,
+            s3,
+            packed_cache,
         )
 
 
@@ -617,6 +890,86 @@ if __name__ == "__main__":
         type=str,
         required=False,
     )
+    parser.add_argument(
+        "--download-workers",
+        help="Number of concurrent downloads of moz-central registry files.",
+        type=int,
+        default=moz_central_scraper.DOWNLOAD_WORKERS,
+    )
+    parser.add_argument(
+        "--only-changed-files",
+        help="Only download moz-central registry files that changed since a "
+        "revision that is already in the cache.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--jobs",
+        help="Number of processes to parse probe definition files with.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--git-workers",
+        help="Number of Glean repositories to scrape concurrently.",
+        type=int,
+        default=git_scraper.WORKERS,
+    )
+    parser.add_argument(
+        "--json-backend",
+        help="JSON encoder to write the output with. All backends write the "
+        "same files; 'auto' uses orjson if it is installed.",
+        choices=serializers.BACKENDS,
+        default="auto",
+    )
+    parser.add_argument(
+        "--compact-json",
+        help="Write the output JSON files without indentation.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--gzip-output",
+        help="Write the output files gzipped, so they don't need to be "
+        "compressed again before uploading.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--compress-workers",
+        help="Number of output files to compress concurrently before uploading.",
+        type=int,
+        default=compression.WORKERS,
+    )
+    parser.add_argument(
+        "--precompress",
+        help="Also write a pre-compressed sibling of each output JSON file with "
+        "this encoding, which is uploaded instead of compressing the file again. "
+        "Brotli siblings are uploaded as <name>.br. Can be given more than once.",
+        choices=list(compression.SIBLING_SUFFIXES),
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--gzip-level",
+        help="Compression level of gzipped output files.",
+        type=int,
+        default=compression.GZIP_LEVEL,
+    )
+    parser.add_argument(
+        "--brotli-level",
+        help="Compression level of brotli-compressed output files.",
+        type=int,
+        default=compression.BROTLI_LEVEL,
+    )
+    parser.add_argument(
+        "--s3-workers",
+        help="Number of files to transfer to and from S3 concurrently.",
+        type=int,
+        default=s3_sync.WORKERS,
+    )
+    parser.add_argument(
+        "--packed-cache",
+        help="Store the cache in S3 as a few large pack files, see cache_pack.",
+        action="store_true",
+    )
 
     application = parser.add_mutually_exclusive_group()
     application.add_argument(
@@ -659,4 +1012,17 @@ if __name__ == "__main__":
         args.cache_bucket,
         args.env,
         args.bugzilla_api_key,
+        args.download_workers,
+        args.only_changed_files,
+        args.jobs,
+        args.git_workers,
+        args.json_backend,
+        args.compact_json,
+        args.gzip_output,
+        args.compress_workers,
+        args.precompress,
+        args.gzip_level,
+        args.brotli_level,
+        args.s3_workers,
+        args.packed_cache,
     )
@@ -0,0 +1,225 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+In-process, parallel synchronization of local directories with S3.
+
+`S3Sync` downloads and uploads files on a pool of threads, with multipart
+transfers for large files. It remembers the size and modification time of
+every file it transferred, so files that are unchanged since they were
+downloaded are not uploaded again, without listing the bucket to find out.
+
+Like `aws s3 sync`, downloaded files get the modification time of their
+object, and local files are only downloaded again if their size differs or
+the object was modified after them.
+"""
+
+import fnmatch
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+
+WORKERS = 16
+MULTIPART_SIZE = 8 * 1024 * 1024
+MULTIPART_CONCURRENCY = 4
+# The maximum number of keys in a DeleteObjects request.
+DELETE_BATCH_SIZE = 1000
+
+
+def parse_s3_url(url):
+    """Split an s3://bucket/prefix URL into the bucket and prefix."""
+    parsed = urlparse(url)
+    if parsed.scheme != "s3":
+        raise ValueError("Not an S3 URL: " + url)
+    return parsed.netloc, parsed.path.strip("/")
+
+
+def _key(prefix, rel_path):
+    rel_path = rel_path.replace(os.sep, "/")
+    return f"{prefix}/{rel_path}" if prefix else rel_path
+
+
+def _stat(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def list_files(local_dir, include=None):
+    """
+    Return the sorted `(rel_path, path)` of the files under `local_dir`,
+    with relative paths in S3 form. Only files with a relative path matching
+    one of the `fnmatch` patterns in `include` are listed, if given.
+    """
+    files = []
+    for root, _, filenames in os.walk(local_dir):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            rel_path = os.path.relpath(path, local_dir).replace(os.sep, "/")
+            if is_included(rel_path, include):
+                files.append((rel_path, path))
+    return sorted(files)
+
+
+def is_included(rel_path, include=None):
+    return include is None or any(
+        fnmatch.fnmatchcase(rel_path, pattern) for pattern in include
+    )
+
+
+class S3Sync:
+    def __init__(self, client=None, workers=WORKERS):
+        if client is None:
+            client = boto3.client("s3")
+        self.client = client
+        self.workers = workers
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_SIZE,
+            multipart_chunksize=MULTIPART_SIZE,
+            max_concurrency=MULTIPART_CONCURRENCY,
+        )
+        # Local path -> (size, mtime) when it was last downloaded or uploaded.
+        self._synced = {}
+        self._lock = threading.Lock()
+
+    def record(self, path):
+        """Record that `path` is the same as its copy in S3."""
+        stat = _stat(path)
+        with self._lock:
+            self._synced[path] = stat
+
+    def unchanged(self, path):
+        """Return whether `path` is unchanged since it was recorded."""
+        with self._lock:
+            return self._synced.get(path) == _stat(path)
+
+    def run(self, fn, items):
+        """Call `fn` on each of `items` on the pool, raising the first failure."""
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            futures = [executor.submit(fn, *item) for item in items]
+        # All transfers are done before the first failure is raised.
+        for future in futures:
+            future.result()
+
+    def list_keys(self, url):
+        """
+        Return a dict of the keys under the S3 `url` to their sizes and
+        modification times, as POSIX timestamps.
+        """
+        bucket, prefix = parse_s3_url(url)
+        kwargs = {"Bucket": bucket}
+        if prefix:
+            kwargs["Prefix"] = prefix + "/"
+        keys = {}
+        while True:
+            response = self.client.list_objects_v2(**kwargs)
+            for obj in response.get("Contents", []):
+                keys[obj["Key"]] = (obj["Size"], obj["LastModified"].timestamp())
+            if not response.get("IsTruncated"):
+                return keys
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    def download(self, url, local_dir, include=None):
+        """
+        Download the files under the S3 `url` into `local_dir`. Files that
+        exist locally with the same size, and that are not older than their
+        object, are kept. Only files with a relative path matching one of
+        the `fnmatch` patterns in `include` are downloaded, if given.
+        """
+        bucket, prefix = parse_s3_url(url)
+        start = len(prefix) + 1 if prefix else 0
+        to_download = []
+        for key, (size, mtime) in self.list_keys(url).items():
+            rel_path = key[start:]
+            # Skip the empty objects some tools create for directories.
+            if not rel_path or rel_path.endswith("/"):
+                continue
+            if not is_included(rel_path, include):
+                continue
+            path = os.path.join(local_dir, *rel_path.split("/"))
+            if (
+                os.path.exists(path)
+                and os.path.getsize(path) == size
+                and os.path.getmtime(path) >= mtime
+            ):
+                self.record(path)
+            else:
+                to_download.append((key, path, mtime))
+
+        def download_file(key, path, mtime):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.client.download_file(bucket, key, path, Config=self.transfer_config)
+            os.utime(path, (mtime, mtime))
+            self.record(path)
+
+        print(f"Downloading {len(to_download)} files from {url}")
+        self.run(download_file, to_download)
+
+    def upload(self, local_dir, url, include=None, extra_args=None, delete=False):
+        """
+        Upload the files under `local_dir` to the S3 `url`, and return the
+        relative paths of the uploaded files.
+
+        Only files with a relative path matching one of the `fnmatch`
+        patterns in `include` are uploaded, if given. `extra_args` is called
+        with the relative path of each file to get the `ExtraArgs` of its
+        upload, e.g. its content type. Files that are unchanged since they
+        were downloaded or uploaded are skipped. With `delete`, the included
+        keys under `url` without a local file are deleted.
+        """
+        bucket, prefix = parse_s3_url(url)
+        local = list_files(local_dir, include)
+        to_upload = [
+            (rel_path, path) for rel_path, path in local if not self.unchanged(path)
+        ]
+
+        def upload_file(rel_path, path):
+            args = extra_args(rel_path) if extra_args is not None else None
+            self.client.upload_file(
+                path,
+                bucket,
+                _key(prefix, rel_path),
+                ExtraArgs=args,
+                Config=self.transfer_config,
+            )
+            self.record(path)
+
+        print(f"Uploading {len(to_upload)} of {len(local)} files to {url}")
+        self.run(upload_file, to_upload)
+
+        if delete:
+            start = len(prefix) + 1 if prefix else 0
+            local_keys = {_key(prefix, rel_path) for rel_path, _ in local}
+            self._delete_keys(
+                bucket,
+                [
+                    key
+                    for key in self.list_keys(url)
+                    if key not in local_keys and is_included(key[start:], include)
+                ],
+            )
+        return [rel_path for rel_path, _ in to_upload]
+
+    def delete(self, url, rel_paths):
+        """Delete the files at `rel_paths` under the S3 `url`."""
+        bucket, prefix = parse_s3_url(url)
+        self._delete_keys(bucket, [_key(prefix, rel_path) for rel_path in rel_paths])
+
+    def _delete_keys(self, bucket, keys):
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            end = start + DELETE_BATCH_SIZE
+            response = self.client.delete_objects(
+                Bucket=bucket,
+                Delete={
+                    "Objects": [{"Key": key} for key in keys[start:end]],
+                    "Quiet": True,
+                },
+            )
+            if response.get("Errors"):
+                raise RuntimeError(
+                    "Failed to delete from {}: {}".format(bucket, response["Errors"])
+                )
@@ -2,7 +2,7 @@ import pprint
 import re
 from datetime import datetime
 
-import requests
+from .. import http_client
 
 
 class NoDataFoundException(Exception):
@@ -104,7 +104,8 @@ class Buildhub(object):
             print("------QUERY STRING------\n")
             pprint.pprint(body)
 
-        response = requests.post(url=Buildhub.search_url, json=body)
+        # The search is read-only, so it is safe to retry.
+        response = http_client.post(Buildhub.search_url, read_only=True, json=body)
         data = response.json()
 
         if verbose:
@@ -2,14 +2,36 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import hashlib
+import heapq
+import json
 import os
+import re
 import tempfile
+import threading
 import traceback
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import git
 
+from .. import blob_store
+
+# The walked histories of each repository are kept in this directory of the
+# cache, so that later runs only need to walk the new commits.
+STATE_DIR = "git_state"
+# Bump this whenever the content of the state files changes.
+STATE_VERSION = 1
+
+# Number of repositories that are scraped concurrently.
+WORKERS = 4
+
+# Repositories are cloned into this directory of the cache, once per URL.
+GIT_DIR = "git"
+# Objects are resolved and fetched in batches of this many at once.
+OBJECT_BATCH_SIZE = 1000
+
 # WARNING!
 # Changing these dates can cause files that had metrics to
 # stop being scraped. When the probe-info-service
@@ -64,42 +86,300 @@ SKIP_COMMITS = {
 }
 
 
-def _file_in_repo_head(repo, filename):
-    # adapted from https://stackoverflow.com/a/25961128
-    subtree = repo.head.commit.tree
-    for path_element in filename.split(os.path.sep)[:-1]:
-        try:
-            subtree = subtree[path_element]
-        except KeyError:
-            return False  # subdirectory not in tree
-    return filename in subtree
+def _get_commit_graph(repo, rev="HEAD"):
+    """Return {<commit>: (<timestamp>, [<parent>, ...])} for all commits in `rev`."""
+    graph = {}
+    for line in repo.git.rev_list("--parents", "--timestamp", rev).splitlines():
+        timestamp, commit, *parents = line.split()
+        graph[commit] = (int(timestamp), parents)
+    return graph
+
+
+def _get_changed_files(repo, graph, filenames):
+    """
+    Return {(<commit>, <parent>): {<filename>, ...}} for every commit and each
+    of its parents, where the parent of root commits is None. Pairs that
+    don't change any of `filenames` are left out.
+    """
+    pairs = [
+        (commit, parent)
+        for commit, (_, parents) in graph.items()
+        for parent in parents or [None]
+    ]
+    with tempfile.TemporaryFile() as stdin:
+        for commit, parent in pairs:
+            stdin.write(f"{commit} {parent or ''}".rstrip().encode("ascii") + b"\n")
+        stdin.seek(0)
+        # With --always, every input line gets a commit line in the output,
+        # followed by the files that changed against the given parent.
+        output = repo.git.diff_tree(
+            "--stdin",
+            "--always",
+            "--root",
+            "-r",
+            "--name-only",
+            "--no-renames",
+            "--",
+            *filenames,
+            istream=stdin,
+        )
+
+    changed = defaultdict(set)
+    i = -1
+    for line in output.splitlines():
+        if i + 1 < len(pairs) and line == pairs[i + 1][0]:
+            i += 1
+        elif line:
+            changed[pairs[i]].add(line)
+    return changed
+
+
+def _walk_file_history(graph, head, changed, filename):
+    """
+    Return the commits `git log -- <filename>` shows, in the same order.
+
+    This follows git's default history simplification: a merge that has the
+    same content as one of its parents for `filename` is only followed to
+    the first such parent, and commits are visited by descending commit
+    date, in the order they were found on ties. The walk stops at parents
+    that are not in `graph`.
+    """
+    shown = []
+    seen = {head}
+    queue = [(-graph[head][0], 0, head)]
+    counter = 1
+    while queue:
+        _, _, commit = heapq.heappop(queue)
+        parents = graph[commit][1]
+
+        if not parents:
+            treesame = filename not in changed.get((commit, None), ())
+        else:
+            treesame = False
+            for parent in parents:
+                if filename not in changed.get((commit, parent), ()):
+                    parents = [parent]
+                    treesame = True
+                    break
+
+        if not treesame:
+            shown.append(commit)
+        for parent in parents:
+            if parent not in seen and parent in graph:
+                seen.add(parent)
+                heapq.heappush(queue, (-graph[parent][0], counter, parent))
+                counter += 1
+    return shown
+
+
+def _walk_history(repo, filenames, head, rev=None):
+    """
+    Return the commits `git log <rev> -- <filename>` shows for each of
+    `filenames`, and the timestamps of those commits and of `head`, where
+    `rev` defaults to `head`.
+    """
+    graph = _get_commit_graph(repo, rev or head)
+    changed = _get_changed_files(repo, graph, filenames)
+
+    commits = {}
+    timestamps = {}
+    if head in graph:
+        timestamps[head] = graph[head][0]
+    for filename in set(filenames):
+        commits[filename] = _walk_file_history(graph, head, changed, filename)
+        for commit in commits[filename]:
+            timestamps[commit] = graph[commit][0]
+    return commits, timestamps
+
+
+def _is_ancestor(repo, ancestor, rev):
+    try:
+        return repo.is_ancestor(ancestor, rev)
+    except git.GitCommandError:
+        # e.g. `ancestor` doesn't exist anymore
+        return False
+
+
+def _update_history(repo, filenames, state, head):
+    """
+    Walk the commits from the head recorded in `state` to `head`, and prepend
+    those to the histories in it. Returns None if they can't be updated like
+    that, and the history needs to be walked in full.
+    """
+    if state["head"] == head:
+        return state
+    if not _is_ancestor(repo, state["head"], head):
+        return None
+
+    rev = f"{state['head']}..{head}"
+    if repo.git.rev_list("--merges", "-n", "1", rev):
+        # Merges can change which earlier commits a file's log shows.
+        return None
+
+    new_commits, new_timestamps = _walk_history(repo, filenames, head, rev)
+    return {
+        "version": STATE_VERSION,
+        "head": head,
+        "files": state["files"],
+        "timestamps": {**state["timestamps"], **new_timestamps},
+        "commits": {
+            filename: new_commits[filename] + state["commits"][filename]
+            for filename in state["files"]
+        },
+    }
+
+
+def update_all_commits(repo, filenames, state=None, rev="HEAD"):
+    """
+    Like `get_all_commits`, but takes the `state` returned by a previous
+    call for the same repository, and only walks the commits that were
+    added since then, if `rev` was fast-forwarded without merges.
+
+    Returns the commits, and the state to pass to the next call.
+    """
+    if not filenames:
+        return {}, state
+
+    files = sorted(set(filenames))
+    head = repo.commit(rev).hexsha
+    if state is not None and (
+        state.get("version") != STATE_VERSION or state["files"] != files
+    ):
+        state = None
+    if state is not None:
+        state = _update_history(repo, filenames, state, head)
+    if state is None:
+        commits, timestamps = _walk_history(repo, filenames, head)
+        state = {
+            "version": STATE_VERSION,
+            "head": head,
+            "files": files,
+            "timestamps": timestamps,
+            "commits": commits,
+        }
+
+    timestamps = state["timestamps"]
+    in_head = set(
+        repo.git.ls_tree("-r", "--name-only", head, "--", *files).splitlines()
+    )
+
+    results = {}
+    for filename in filenames:
+        commits = state["commits"][filename]
+        result = {commit: (timestamps[commit], i) for i, commit in enumerate(commits)}
+        if filename in in_head:
+            # include HEAD when it contains filename
+            result[head] = (timestamps[head], 0)
+        results[filename] = result
+    return results, state
+
+
+def get_all_commits(repo, filenames, rev="HEAD"):
+    """
+    Return {<filename>: {<commit>: (<timestamp>, <index>)}} for all of
+    `filenames`, from a single walk over the history of `rev` rather than
+    one `git log` per file.
+
+    The commits of a file are those that changed it, and `rev` itself if
+    the file exists in it. `index` is the position of the commit in
+    `git log -- <filename>`, and 0 for `rev`.
+    """
+    return update_all_commits(repo, filenames, rev=rev)[0]
+
+
+def _state_path(cache_dir, name):
+    return os.path.join(cache_dir, STATE_DIR, f"{name}.json")
+
 
+def load_state(cache_dir, name):
+    """Return the state of repository `name` saved by `save_state`, or None."""
+    path = _state_path(cache_dir, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
 
-def get_commits(repo, filename):
-    sep = ":"
-    log_format = '--format="%H{}%ct"'.format(sep)
-    # include "--" to prevent error for filename not in current tree
-    change_commits = repo.git.log(log_format, "--", filename).split("\n")
-    # filter out empty strings
-    change_commits = filter(None, change_commits)
-    commits = set(enumerate(change_commits))
-    if _file_in_repo_head(repo, filename):
-        # include HEAD when it contains filename
-        commits |= set(enumerate(repo.git.log("-n", "1", log_format).split("\n")))
 
-    # Store the index in the ref-log as well as the timestamp, so that the
-    # ordering of commits will be deterministic and always in the correct
-    # order.
-    result = {}
-    for index, entry in commits:
-        commit, timestamp = entry.strip('"').split(sep)
-        result[commit] = (int(timestamp), index)
+def save_state(cache_dir, name, state):
+    path = _state_path(cache_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(state, f, sort_keys=True)
 
-    return result
 
+def resolve_blob_ids(repo, entries):
+    """
+    Return the blob ids of the files in `entries` of (hash, filename).
+
+    This only needs the trees of the commits, so it doesn't fetch any blobs
+    that a partial clone is missing.
+    """
+    revs = [f"{_hash}:{filename}" for _hash, filename in entries]
+    blob_ids = []
+    for start in range(0, len(revs), OBJECT_BATCH_SIZE):
+        end = start + OBJECT_BATCH_SIZE
+        blob_ids.extend(repo.git.rev_parse(*revs[start:end]).splitlines())
+    return blob_ids
+
+
+def _is_partial_clone(repo):
+    return repo.config_reader().has_option('remote "origin"', "promisor")
+
+
+def prefetch_blobs(repo, blob_ids):
+    """
+    Fetch the blobs in `blob_ids` that a partial clone doesn't have yet in
+    a single request, instead of letting git fetch them one at a time.
+    """
+    if not blob_ids or not _is_partial_clone(repo):
+        return
+
+    with tempfile.TemporaryFile() as stdin:
+        stdin.write("".join(f"{blob_id}\n" for blob_id in blob_ids).encode("ascii"))
+        stdin.seek(0)
+        # --missing=print keeps rev-list from fetching the missing blobs itself.
+        present = repo.git.rev_list(
+            "--objects",
+            "--no-object-names",
+            "--ignore-missing",
+            "--missing=print",
+            "--stdin",
+            istream=stdin,
+        )
+    missing = sorted(set(blob_ids) - set(present.splitlines()))
+    if not missing:
+        return
+
+    print(f"  Fetching {len(missing)} files")
+    with tempfile.TemporaryFile() as stdin:
+        stdin.write("".join(f"{blob_id}\n" for blob_id in missing).encode("ascii"))
+        stdin.seek(0)
+        repo.git.fetch(
+            "origin",
+            "--no-tags",
+            "--no-write-fetch-head",
+            "--recurse-submodules=no",
+            "--filter=blob:none",
+            "--stdin",
+            istream=stdin,
+        )
+
+
+def read_files_at_hashes(repo, entries):
+    """
+    Yield (blob id, content) for each (hash, filename) in `entries`.
 
-def get_file_at_hash(repo, _hash, filename):
-    return repo.git.show("{hash}:{path}".format(hash=_hash, path=filename))
+    All files are read through a single long-lived `git cat-file --batch`
+    process, rather than spawning a `git show` per file. The content is the
+    exact bytes of the blob, including any trailing newline; files scraped
+    with `git show` before lack it, which only matters to their digests.
+    Raises ValueError if a file doesn't exist at its commit.
+    """
+    for _hash, filename in entries:
+        blob_id, _, _, data = repo.git.get_object_data(f"{_hash}:{filename}")
+        if isinstance(blob_id, bytes):
+            blob_id = blob_id.decode("ascii")
+        yield blob_id, data
 
 
 def utc_timestamp(d):
@@ -108,54 +388,133 @@ def utc_timestamp(d):
     return (d - datetime(1970, 1, 1)) / timedelta(seconds=1)
 
 
+_repo_locks = defaultdict(threading.Lock)
+_repo_locks_lock = threading.Lock()
+
+
+def _repo_lock(repo_path):
+    """
+    Return the lock that guards updates to the clone in `repo_path`, which
+    is the same for all relative or symlinked paths to it.
+    """
+    with _repo_locks_lock:
+        return _repo_locks[os.path.realpath(repo_path)]
+
+
+def get_repo_path(cache_dir, url):
+    """
+    Return where the repository at `url` is cloned to. Repositories with
+    the same URL share a clone, with a branch for each branch they scrape.
+    """
+    name = re.sub(r"[^A-Za-z0-9.-]+", "_", url.split("://")[-1]).strip("_.")
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(cache_dir, GIT_DIR, f"{name}-{digest}.git")
+
+
+def open_repo(repo_info, cache_dir):
+    """
+    Clone or update the repository of `repo_info`, and return it along with
+    the commit its branch points at.
+
+    Clones are partial, i.e. files are only fetched once they are read. The
+    repository must be closed by the caller.
+    """
+    repo_path = get_repo_path(cache_dir, repo_info.url)
+    with _repo_lock(repo_path):
+        if os.path.exists(repo_path):
+            print(f"Pulling latest commits into {repo_path}")
+            repo = git.Repo(repo_path)
+        else:
+            print(f"Cloning {repo_info.url} into {repo_path}")
+            repo = git.Repo.clone_from(
+                repo_info.url, repo_path, bare=True, filter="blob:none"
+            )
+
+        # HEAD is left at the default branch of the remote, so that other
+        # repositories using the same clone see the same default.
+        try:
+            branch = repo_info.branch or repo.active_branch.name
+            repo.git.fetch("origin", f"{branch}:{branch}")
+            head = repo.commit(f"refs/heads/{branch}").hexsha
+        except Exception:
+            repo.close()
+            raise
+    return repo, head
+
+
 def retrieve_files(repo_info, cache_dir):
     results = defaultdict(list)
     timestamps = dict()
     base_path = os.path.join(cache_dir, repo_info.name)
-    repo_path = f"{base_path}.git"
 
     min_date = None
     if repo_info.name in MIN_DATES:
         min_date = utc_timestamp(datetime.fromisoformat(MIN_DATES[repo_info.name]))
 
     skip_commits = SKIP_COMMITS.get(repo_info.name, [])
+    refs = blob_store.open_refs(cache_dir, repo_info.name, base_path)
+
+    repo, head = open_repo(repo_info, cache_dir)
+    # Closing the repository stops its `git cat-file` processes.
+    with repo:
+        missing = []
+        state = load_state(cache_dir, repo_info.name)
+        commits_by_file, state = update_all_commits(
+            repo, repo_info.get_change_files(), state, head
+        )
+        for rel_path in repo_info.get_change_files():
+            hashes = commits_by_file[rel_path]
+            for _hash, (ts, index) in hashes.items():
+                if min_date and ts < min_date:
+                    continue
+                if _hash in skip_commits:
+                    continue
+
+                disk_path = os.path.join(base_path, _hash, rel_path)
+                if os.path.exists(disk_path):
+                    refs.add_existing(disk_path)
+                elif not refs.restore(disk_path):
+                    missing.append((_hash, rel_path, disk_path))
+
+                results[_hash].append(disk_path)
+                timestamps[_hash] = (ts, index)
+
+        # Files with content that is already in the store don't need to be read.
+        entries = [(_hash, rel_path) for _hash, rel_path, _ in missing]
+        to_read = []
+        for (_hash, rel_path, disk_path), blob_id in zip(
+            missing, resolve_blob_ids(repo, entries)
+        ):
+            if refs.store.has(blob_id):
+                refs.link(disk_path, blob_id)
+            else:
+                to_read.append(((_hash, rel_path), disk_path, blob_id))
+
+        with _repo_lock(get_repo_path(cache_dir, repo_info.url)):
+            prefetch_blobs(repo, [blob_id for _, _, blob_id in to_read])
+        blobs = read_files_at_hashes(repo, [entry for entry, _, _ in to_read])
+        for (_, disk_path, _), (blob_id, contents) in zip(to_read, blobs):
+            refs.add(disk_path, contents, blob_id)
+
+    refs.save()
+    if state is not None:
+        save_state(cache_dir, repo_info.name, state)
+    return timestamps, results
 
-    if os.path.exists(repo_path):
-        print(f"Pulling latest commits into {repo_path}")
-        repo = git.Repo(repo_path)
-    else:
-        print(f"Cloning {repo_info.url} into {repo_path}")
-        repo = git.Repo.clone_from(repo_info.url, repo_path, bare=True)
-
-    branch = repo_info.branch or repo.active_branch
-    repo.git.fetch("origin", f"{branch}:{branch}")
-    repo.git.symbolic_ref("HEAD", f"refs/heads/{branch}")
-
-    for rel_path in repo_info.get_change_files():
-        hashes = get_commits(repo, rel_path)
-        for _hash, (ts, index) in hashes.items():
-            if min_date and ts < min_date:
-                continue
-            if _hash in skip_commits:
-                continue
-
-            disk_path = os.path.join(base_path, _hash, rel_path)
-            if not os.path.exists(disk_path):
-                contents = get_file_at_hash(repo, _hash, rel_path)
-
-                dir = os.path.split(disk_path)[0]
-                if not os.path.exists(dir):
-                    os.makedirs(dir)
-                with open(disk_path, "wb") as f:
-                    f.write(contents.encode("UTF-8"))
-
-            results[_hash].append(disk_path)
-            timestamps[_hash] = (ts, index)
 
-    return timestamps, results
+FAILED_IMPORT_SUBJECT = "Probe Scraper: Failed Probe Import"
+
+
+def failed_repos(emails):
+    """Return the names of the repositories `scrape` failed to scrape."""
+    return {
+        name
+        for name, info in emails.items()
+        if any(email["subject"] == FAILED_IMPORT_SUBJECT for email in info["emails"])
+    }
 
 
-def scrape(folder=None, repos=None):
+def scrape(folder=None, repos=None, workers=WORKERS):
     """
     Returns two data structures. The first is the commit timestamps:
     {
@@ -176,6 +535,14 @@ def scrape(folder=None, repos=None):
       },
       ...
     }
+
+    With `workers` > 1, that many repositories are scraped concurrently, and
+    the results are the same as when scraping them in sequence.
+
+    A repository that fails to be scraped gets empty timestamps and probe
+    data, and a "Failed Probe Import" email with the error in the third
+    returned value, so it doesn't stop the others from being scraped. See
+    `failed_repos`.
     """
     if folder is None:
         folder = tempfile.mkdtemp()
@@ -184,25 +551,36 @@ def scrape(folder=None, repos=None):
     timestamps = {}
     emails = {}
 
-    for repo_info in repos:
+    def retrieve(repo_info):
         print("Getting commits for repository " + repo_info.name)
+        ts, commits = retrieve_files(repo_info, folder)
+        print("  Got {} commits for {}".format(len(commits), repo_info.name))
+        return ts, commits
 
+    futures = None
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(retrieve, repo_info) for repo_info in repos]
+
+    for i, repo_info in enumerate(repos):
         results[repo_info.name] = {}
+        timestamps[repo_info.name] = {}
         emails[repo_info.name] = {
             "addresses": repo_info.notification_emails,
             "emails": [],
         }
 
         try:
-            ts, commits = retrieve_files(repo_info, folder)
-            print("  Got {} commits".format(len(commits)))
+            if futures is not None:
+                ts, commits = futures[i].result()
+            else:
+                ts, commits = retrieve(repo_info)
             results[repo_info.name] = commits
             timestamps[repo_info.name] = ts
         except Exception:
-            raise
             emails[repo_info.name]["emails"].append(
                 {
-                    "subject": "Probe Scraper: Failed Probe Import",
+                    "subject": FAILED_IMPORT_SUBJECT,
                     "message": traceback.format_exc(),
                 }
             )
@@ -5,10 +5,15 @@
 import json
 import os
 import re
+import shutil
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 import requests
 
+from .. import blob_store, http_client
 from .buildhub import Buildhub
 
 BASE_URI = "https://hg.mozilla.org"
@@ -54,8 +59,14 @@ CHANNELS = {
 
 MIN_FIREFOX_VERSION = 30
 ERROR_CACHE_FILENAME = "probe_scraper_errors_cache.json"
+FILELOG_CACHE_FILENAME = "probe_scraper_filelog_cache.json"
 ARTIFICIAL_TAG = "artificial"
 
+# Bounds for the registry file downloads. hg.mozilla.org is the only host we
+# download from, so the per-host limit is what keeps us a polite client.
+DOWNLOAD_WORKERS = 16
+DOWNLOAD_WORKERS_PER_HOST = 8
+
 
 def extract_major_version(version_str):
     """
@@ -80,8 +91,7 @@ def relative_path_is_in_version(rel_path, version):
     return True
 
 
-def download_files(channel, node, temp_dir, error_cache, version, tree=None):
-
+def get_revision_uri(channel, node, tree=None, command="raw-file"):
     if tree is None:
         uri = CHANNELS[channel]["base_uri"]
     else:
@@ -91,21 +101,30 @@ def download_files(channel, node, temp_dir, error_cache, version, tree=None):
             tree = f"releases/{tree}"
         uri = f"{BASE_URI}/{tree}"
 
-    base_uri = f"{uri}/raw-file/{node}/"
-    node_path = os.path.join(temp_dir, "hg", node)
+    return f"{uri}/{command}/{node}/"
 
-    results = {}
 
-    def add_result(ptype, disk_path):
-        if ptype not in results:
-            results[ptype] = []
-        results[ptype].append(disk_path)
+def plan_downloads(channel, node, temp_dir, error_cache, version, tree=None, refs=None):
+    """
+    Returns a list of (probe_type, rel_path, disk_path, uri) tuples for every
+    registry file of a revision that we care about. `uri` is None when the
+    file is already cached on disk, or could be restored from `refs`.
+    """
+    base_uri = get_revision_uri(channel, node, tree)
+    node_path = os.path.join(temp_dir, "hg", node)
 
+    planned = []
     all_files = [(k, x) for k, l in list(REGISTRY_FILES.items()) for x in l]
     for (ptype, rel_path) in all_files:
         disk_path = os.path.join(node_path, rel_path)
         if os.path.exists(disk_path):
-            add_result(ptype, disk_path)
+            if refs is not None:
+                refs.add_existing(disk_path)
+            planned.append((ptype, rel_path, disk_path, None))
+            continue
+
+        if refs is not None and refs.restore(disk_path):
+            planned.append((ptype, rel_path, disk_path, None))
             continue
 
         uri = base_uri + rel_path
@@ -117,44 +136,279 @@ def download_files(channel, node, temp_dir, error_cache, version, tree=None):
         if not relative_path_is_in_version(rel_path, int(version)):
             continue
 
-        req = requests.get(uri)
-        if req.status_code != requests.codes.ok:
-            if os.path.basename(rel_path) == "Histograms.json":
-                raise Exception(
-                    "Request returned status " + str(req.status_code) + " for " + uri
+        planned.append((ptype, rel_path, disk_path, uri))
+
+    return planned
+
+
+class HostLimiter:
+    """
+    Bounds the number of requests that are in flight to a single host at
+    any one time, independently of the number of download workers.
+    """
+
+    def __init__(self, limit=DOWNLOAD_WORKERS_PER_HOST):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def __call__(self, uri):
+        host = urlparse(uri).netloc
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.limit)
+            return self._semaphores[host]
+
+
+def _get(uri, host_limiter=None):
+    if host_limiter is None:
+        return http_client.get(uri)
+    with host_limiter(uri):
+        return http_client.get(uri)
+
+
+def download_file(uri, disk_path, error_cache, host_limiter=None, refs=None):
+    """
+    Download `uri` to `disk_path`, storing its content in `refs` if given.
+
+    Returns True if the file was downloaded, False if the request failed
+    and the failure was recorded in the error cache.
+    """
+    req = _get(uri, host_limiter)
+    if req.status_code != requests.codes.ok:
+        if os.path.basename(disk_path) == "Histograms.json":
+            raise Exception(
+                "Request returned status " + str(req.status_code) + " for " + uri
+            )
+        else:
+            error_cache[uri] = req.status_code
+            return False
+
+    if refs is not None:
+        refs.add(disk_path, req.content)
+        return True
+
+    dir = os.path.split(disk_path)[0]
+    os.makedirs(dir, exist_ok=True)
+    with open(disk_path, "wb") as f:
+        for chunk in req.iter_content(chunk_size=128):
+            f.write(chunk)
+
+    return True
+
+
+def get_last_change(channel, node, tree, rel_path, host_limiter=None):
+    """
+    Ask hg for the changeset that last modified `rel_path` as of `node`.
+
+    Two revisions for which this is the same changeset have identical
+    copies of the file. Returns None if hg couldn't tell us.
+    """
+    uri = get_revision_uri(channel, node, tree, "json-log") + rel_path
+    req = _get(uri + "?revcount=1", host_limiter)
+    if req.status_code != requests.codes.ok:
+        return None
+    try:
+        return req.json()["entries"][0]["node"]
+    except (ValueError, KeyError, IndexError):
+        return None
+
+
+def copy_file(src_path, disk_path, refs=None):
+    if refs is not None:
+        refs.copy(src_path, disk_path)
+        return True
+
+    dir = os.path.split(disk_path)[0]
+    os.makedirs(dir, exist_ok=True)
+    shutil.copyfile(src_path, disk_path)
+    return True
+
+
+def collect_results(planned, downloaded):
+    """
+    Group the planned files of a revision by probe type, skipping the
+    ones that failed to download.
+    """
+    results = {}
+    for (ptype, rel_path, disk_path, uri), ok in zip(planned, downloaded):
+        if not ok:
+            continue
+        if ptype not in results:
+            results[ptype] = []
+        results[ptype].append(disk_path)
+
+    return results
+
+
+def download_files(channel, node, temp_dir, error_cache, version, tree=None, refs=None):
+    planned = plan_downloads(channel, node, temp_dir, error_cache, version, tree, refs)
+    downloaded = [
+        uri is None or download_file(uri, disk_path, error_cache, refs=refs)
+        for (ptype, rel_path, disk_path, uri) in planned
+    ]
+    return collect_results(planned, downloaded)
+
+
+def find_unchanged_files(
+    executor, channel, revisions, plans, temp_dir, filelog_cache, host_limiter
+):
+    """
+    Find the planned downloads whose content is already available locally,
+    either from the cache or from another download in the same batch.
+
+    `filelog_cache` maps "<node>/<rel_path>" to the changeset that last
+    modified the file as of that node, and is updated in place.
+
+    Returns a dict of disk_path -> source disk_path to copy it from.
+    """
+    hg_dir = os.path.join(temp_dir, "hg")
+    known = {}
+    for key, change in filelog_cache.items():
+        node, rel_path = key.split("/", 1)
+        if os.path.exists(os.path.join(hg_dir, key)):
+            known.setdefault((rel_path, change), os.path.join(hg_dir, key))
+
+    lookups = {}
+    for (node, version, tree), (_, planned) in zip(revisions, plans):
+        for ptype, rel_path, disk_path, uri in planned:
+            if uri is not None and disk_path not in lookups:
+                lookups[disk_path] = executor.submit(
+                    get_last_change, channel, node, tree, rel_path, host_limiter
                 )
-            else:
-                error_cache[uri] = req.status_code
+
+    sources = {}
+    for (node, version, tree), (_, planned) in zip(revisions, plans):
+        for ptype, rel_path, disk_path, uri in planned:
+            if uri is None or disk_path in sources:
                 continue
+            change = lookups[disk_path].result()
+            if change is None:
+                continue
+            filelog_cache[f"{node}/{rel_path}"] = change
+            source = known.setdefault((rel_path, change), disk_path)
+            if source != disk_path:
+                sources[disk_path] = source
+
+    return sources
+
+
+def download_revisions(
+    channel,
+    revisions,
+    temp_dir,
+    error_cache,
+    workers=DOWNLOAD_WORKERS,
+    workers_per_host=DOWNLOAD_WORKERS_PER_HOST,
+    filelog_cache=None,
+    refs=None,
+):
+    """
+    Download the registry files for many revisions at once, fanning out
+    across revisions and registry files on a pool of `workers` threads.
+    If `refs` is given, the content of the files is kept in its blob store.
+
+    If a `filelog_cache` dict is passed, hg is asked which changeset last
+    modified each file first, and files that didn't change since a revision
+    we already have are copied locally instead of downloaded again.
+
+    :param revisions: a list of (node, version, tree) tuples.
+    :return: a dict of node -> {probe_type: [path, ...]}, in the order of
+             `revisions`. Each value is the same as what `download_files`
+             would return for that revision.
+    """
+    host_limiter = HostLimiter(workers_per_host)
+    plans = [
+        (
+            node,
+            plan_downloads(channel, node, temp_dir, error_cache, version, tree, refs),
+        )
+        for node, version, tree in revisions
+    ]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        sources = {}
+        if filelog_cache is not None:
+            sources = find_unchanged_files(
+                executor,
+                channel,
+                revisions,
+                plans,
+                temp_dir,
+                filelog_cache,
+                host_limiter,
+            )
 
-        dir = os.path.split(disk_path)[0]
-        if not os.path.exists(dir):
-            os.makedirs(dir)
-        with open(disk_path, "wb") as f:
-            for chunk in req.iter_content(chunk_size=128):
-                f.write(chunk)
+        # Dedupe by download target, in case a node is listed more than once.
+        futures = {}
+        for node, planned in plans:
+            for ptype, rel_path, disk_path, uri in planned:
+                if uri is None or disk_path in futures or disk_path in sources:
+                    continue
+                futures[disk_path] = executor.submit(
+                    download_file, uri, disk_path, error_cache, host_limiter, refs
+                )
 
-        add_result(ptype, disk_path)
+        def is_available(disk_path, uri):
+            if uri is None:
+                return True
+            if disk_path not in sources:
+                return futures[disk_path].result()
+            source = sources[disk_path]
+            if source not in futures or futures[source].result():
+                return copy_file(source, disk_path, refs)
+            # The source failed to download, so try this one on its own.
+            return download_file(uri, disk_path, error_cache, host_limiter, refs)
+
+        results = {}
+        for node, planned in plans:
+            downloaded = [
+                is_available(disk_path, uri)
+                for (ptype, rel_path, disk_path, uri) in planned
+            ]
+            results[node] = collect_results(planned, downloaded)
 
     return results
 
 
-def load_error_cache(folder):
-    path = os.path.join(folder, ERROR_CACHE_FILENAME)
+def _load_json_cache(folder, filename):
+    path = os.path.join(folder, filename)
     if not os.path.exists(path):
         return {}
     with open(path, "r") as f:
         return json.load(f)
 
 
-def save_error_cache(folder, error_cache):
-    path = os.path.join(folder, ERROR_CACHE_FILENAME)
+def _save_json_cache(folder, filename, data):
+    path = os.path.join(folder, filename)
     with open(path, "w") as f:
-        json.dump(error_cache, f, sort_keys=True, indent=2, separators=(",", ": "))
+        json.dump(data, f, sort_keys=True, indent=2, separators=(",", ": "))
+
+
+def load_error_cache(folder):
+    return _load_json_cache(folder, ERROR_CACHE_FILENAME)
+
+
+def save_error_cache(folder, error_cache):
+    _save_json_cache(folder, ERROR_CACHE_FILENAME, error_cache)
+
+
+def load_filelog_cache(folder):
+    return _load_json_cache(folder, FILELOG_CACHE_FILENAME)
+
+
+def save_filelog_cache(folder, filelog_cache):
+    _save_json_cache(folder, FILELOG_CACHE_FILENAME, filelog_cache)
 
 
 def scrape_channel_revisions(
-    folder=None, min_fx_version=None, max_fx_version=None, channels=None
+    folder=None,
+    min_fx_version=None,
+    max_fx_version=None,
+    channels=None,
+    workers=DOWNLOAD_WORKERS,
+    workers_per_host=DOWNLOAD_WORKERS_PER_HOST,
+    only_changed=False,
 ):
     """
     Returns data in the format:
@@ -172,11 +426,21 @@ def scrape_channel_revisions(
       },
       ...
     }
+
+    Registry files are downloaded on a pool of `workers` threads, with at
+    most `workers_per_host` requests in flight to any one host. Their content
+    is kept in the cache's blob store, and `<folder>/hg/<revision>/...` are
+    links into it.
+
+    If `only_changed` is set, only registry files that changed since a
+    revision we already have are downloaded, the others are copied locally.
     """
     if min_fx_version is None:
         min_fx_version = MIN_FIREFOX_VERSION
 
     error_cache = load_error_cache(folder)
+    filelog_cache = load_filelog_cache(folder) if only_changed else None
+    refs = blob_store.open_refs(folder, "hg", os.path.join(folder, "hg"))
     bh = Buildhub()
     results = defaultdict(dict)
 
@@ -194,25 +458,34 @@ def scrape_channel_revisions(
 
         print("  " + str(num_revisions) + " revisions found")
 
-        for i, rd in enumerate(revision_dates):
-            revision = rd["revision"]
-
-            print(
-                (
-                    f"  Downloading files for revision number {str(i+1)}/{str(num_revisions)}"
-                    f" - revision: {revision}, tree: {rd['tree']}, version: {str(rd['version'])}"
-                )
-            )
+        revisions = []
+        for rd in revision_dates:
             version = extract_major_version(rd["version"])
-            files = download_files(
-                channel, revision, folder, error_cache, version, tree=rd["tree"]
+            revisions.append((rd["revision"], version, rd["tree"]))
+
+        print(f"  Downloading files for {num_revisions} revisions")
+        try:
+            files = download_revisions(
+                channel,
+                revisions,
+                folder,
+                error_cache,
+                workers=workers,
+                workers_per_host=workers_per_host,
+                filelog_cache=filelog_cache,
+                refs=refs,
             )
+        finally:
+            save_error_cache(folder, error_cache)
+            refs.save()
+            if filelog_cache is not None:
+                save_filelog_cache(folder, filelog_cache)
 
+        for rd, (revision, version, tree) in zip(revision_dates, revisions):
             results[channel][revision] = {
                 "date": rd["date"],
                 "version": version,
-                "registries": files,
+                "registries": files[revision],
             }
-            save_error_cache(folder, error_cache)
 
     return results
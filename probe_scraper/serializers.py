@@ -0,0 +1,167 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Serializers for the JSON files written by probe-scraper.
+
+`JSONSerializer` uses the standard library and defines the output format.
+`OrjsonSerializer` produces the same bytes with the C-accelerated `orjson`
+encoder, if it is installed. Both can write a compact form instead, which
+the standard library also encodes in C, for when the output doesn't need
+to match the indented files.
+
+The serializer used by `runner.dump_json` is picked with `set_default`.
+"""
+
+import codecs
+import datetime
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ["auto", "json", "orjson"]
+
+
+def _isoformat(o):
+    # Only datetimes are serialized, other objects (dates and times too) are
+    # written as null, as they always have been.
+    if isinstance(o, datetime.datetime):
+        return o.isoformat()
+
+
+class JSONSerializer:
+    name = "json"
+
+    def __init__(self, compact=False):
+        self.compact = compact
+
+    def dumps(self, data):
+        """Return `data` serialized with sorted keys, as bytes."""
+        if self.compact:
+            # Without `indent`, the standard library uses its C encoder.
+            text = json.dumps(
+                data, sort_keys=True, separators=(",", ":"), default=_isoformat
+            )
+        else:
+            text = json.dumps(
+                data,
+                sort_keys=True,
+                indent=2,
+                separators=(",", ": "),
+                default=_isoformat,
+            )
+        return text.encode("ascii")
+
+
+def _escape_non_ascii(error):
+    # An encoding error handler escaping non-ASCII characters like `json`
+    # does when `ensure_ascii` is set. orjson writes them, and DEL, as is,
+    # which can only happen inside strings.
+    escaped = []
+    start, end = error.start, error.end
+    for char in error.object[start:end]:
+        code = ord(char)
+        if code > 0xFFFF:
+            code -= 0x10000
+            escaped.append(0xD800 | ((code >> 10) & 0x3FF))
+            escaped.append(0xDC00 | (code & 0x3FF))
+        else:
+            escaped.append(code)
+    return "".join("\\u{0:04x}".format(code) for code in escaped), end
+
+
+codecs.register_error("probe_scraper.json_escape", _escape_non_ascii)
+
+# Maps all digits to 0 and drops minus signs, so that the numbers in
+# exponent notation, which orjson writes differently from `repr` (1e-7 vs.
+# 1e-07), can be found with plain substring searches.
+_DIGITS = bytes.maketrans(b"123456789", b"000000000")
+
+# How numbers in exponent notation end, after `_DIGITS`, in indented and
+# compact output. A float's exponent has at most three digits. Matches
+# inside strings only cause an unneeded fallback.
+_EXPONENT_ENDS = {False: (b"\n", b",\n"), True: (b"\n", b",", b"]", b"}")}
+_EXPONENTS = {
+    compact: [b"0e" + b"0" * digits + end for digits in (1, 2, 3) for end in ends]
+    for compact, ends in _EXPONENT_ENDS.items()
+}
+
+
+class OrjsonSerializer(JSONSerializer):
+    """
+    Serialize with orjson, producing the same bytes as `JSONSerializer`.
+
+    Data that orjson would write differently (numbers written in exponent
+    notation by either encoder) or can't encode (non-string keys, integers
+    beyond 64 bits) is handed to `JSONSerializer` instead. Non-finite
+    floats, which aren't valid JSON, are written as null rather than NaN or
+    Infinity.
+    """
+
+    name = "orjson"
+
+    def __init__(self, compact=False):
+        if orjson is None:
+            raise ValueError("The orjson JSON backend is not installed")
+        super().__init__(compact)
+        # orjson writes dates and times itself unless passed through.
+        self.option = (
+            orjson.OPT_SORT_KEYS
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+            | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+        if not compact:
+            self.option |= orjson.OPT_INDENT_2
+
+    def dumps(self, data):
+        try:
+            encoded = orjson.dumps(data, default=_isoformat, option=self.option)
+        except orjson.JSONEncodeError:
+            return super().dumps(data)
+
+        numbers = encoded.translate(_DIGITS, b"-") + b"\n"
+        if b"0e" in numbers and any(e in numbers for e in _EXPONENTS[self.compact]):
+            return super().dumps(data)
+        # orjson writes numbers from 1e-6 to 1e-4 in decimal notation.
+        if b"0.0000" in encoded:
+            return super().dumps(data)
+
+        if not encoded.isascii():
+            encoded = encoded.decode("utf-8").encode(
+                "ascii", "probe_scraper.json_escape"
+            )
+        return encoded.replace(b"\x7f", b"\\u007f")
+
+
+def get_serializer(backend="auto", compact=False):
+    """
+    Return a serializer for `backend`, one of `BACKENDS`. "auto" picks
+    orjson if it is installed, and the standard library otherwise.
+    """
+    if backend == "auto":
+        backend = "json" if orjson is None else "orjson"
+    if backend == "json":
+        return JSONSerializer(compact)
+    if backend == "orjson":
+        return OrjsonSerializer(compact)
+    raise ValueError("Unknown JSON backend: " + backend)
+
+
+_default = None
+
+
+def get_default():
+    """Return the serializer set with `set_default`, or the "auto" one."""
+    global _default
+    if _default is None:
+        _default = get_serializer()
+    return _default
+
+
+def set_default(serializer):
+    global _default
+    _default = serializer
@@ -2,9 +2,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import copy
 from collections import defaultdict
 from datetime import datetime
+from operator import itemgetter
 
 DATES_KEY = "dates"
 COMMITS_KEY = "git-commits"
@@ -36,36 +36,95 @@ def get_probe_id(probe_type, name):
     return probe_type + "/" + name
 
 
+# The properties that make up a probe's state, as paths into its definition.
+PROBE_EQUALITY_PROPS = [
+    # Common.
+    "cpp_guard",
+    "optout",
+    "notification_emails",
+    # Histograms & scalars.
+    "details/keyed",
+    "details/kind",
+    # Histograms.
+    "details/n_buckets",
+    "details/n_values",
+    "details/low",
+    "details/high",
+    "details/record_in_processes",
+    "details/labels",
+    # Events.
+    "details/methods",
+    "details/objects",
+    "details/extra_keys",
+]
+_PROBE_EQUALITY_PATHS = [
+    (tuple(prop.split("/")[:-1]), prop.split("/")[-1]) for prop in PROBE_EQUALITY_PROPS
+]
+
+
+def probe_fingerprint(probe):
+    """Return the values of all PROBE_EQUALITY_PROPS of a probe, as a tuple."""
+    values = []
+    for parents, key in _PROBE_EQUALITY_PATHS:
+        dictionary = probe
+        for k in parents:
+            dictionary = dictionary[k]
+        values.append(dictionary.get(key))
+    return tuple(values)
+
+
+class FingerprintCache:
+    """
+    Memoizes the fingerprint of definitions by identity, so that comparing a
+    definition against the others it is checked against only computes its
+    fingerprint once.
+
+    Fingerprints are computed lazily here rather than by the parsers, so the
+    parsed definitions and the parse cache keep their format. They are
+    compared as tuples: their values can be lists or dicts, which can't be
+    hashed. Comparing two definitions that share a fingerprint, as copies
+    made with `assign` do, is an identity check.
+
+    Definitions are keyed by `id()`, which is only unique among live
+    objects. The cache keeps a reference to every definition it has seen, so
+    an id can't be reused by another object while the cache is alive.
+    Definitions must not change their fingerprinted values while cached.
+    """
+
+    def __init__(self, fingerprint_fn):
+        self.fingerprint_fn = fingerprint_fn
+        self._by_id = {}
+
+    def __call__(self, definition):
+        entry = self._by_id.get(id(definition))
+        if entry is None or entry[0] is not definition:
+            entry = (definition, self.fingerprint_fn(definition))
+            self._by_id[id(definition)] = entry
+        return entry[1]
+
+    def assign(self, definition, fingerprint):
+        """Record the fingerprint of a copy of an already fingerprinted definition."""
+        self._by_id[id(definition)] = (definition, fingerprint)
+
+    def equal(self, def1, def2):
+        fingerprint1 = self(def1)
+        fingerprint2 = self(def2)
+        return fingerprint1 is fingerprint2 or fingerprint1 == fingerprint2
+
+
 def probes_equal(probe1, probe2):
-    props = [
-        # Common.
-        "cpp_guard",
-        "optout",
-        "notification_emails",
-        # Histograms & scalars.
-        "details/keyed",
-        "details/kind",
-        # Histograms.
-        "details/n_buckets",
-        "details/n_values",
-        "details/low",
-        "details/high",
-        "details/record_in_processes",
-        "details/labels",
-        # Events.
-        "details/methods",
-        "details/objects",
-        "details/extra_keys",
-    ]
-
-    for prop in props:
-        if get_from_nested_dict(probe1, prop) != get_from_nested_dict(probe2, prop):
-            return False
-    return True
+    return probe_fingerprint(probe1) == probe_fingerprint(probe2)
 
 
 def extract_node_data(
-    node_id, channel, probe_type, probe_data, result_data, version, break_by_channel
+    node_id,
+    channel,
+    probe_type,
+    probe_data,
+    result_data,
+    version,
+    break_by_channel,
+    fingerprints=None,
 ):
     """Extract the probe data and group it by channel.
 
@@ -110,7 +169,13 @@ def extract_node_data(
     :param break_by_channel: True if probe data for different channels needs to be
            stored separately, False otherwise. If True, probe data will be saved
            to result_data[channel] instead of just result_data.
+    :param fingerprints: (optional) a FingerprintCache of probe_fingerprint to
+           compare probes with. It must be reused across calls for the same
+           result_data.
     """
+    if fingerprints is None:
+        fingerprints = FingerprintCache(probe_fingerprint)
+
     for name, probe in probe_data.items():
         # Telemetrys test probes are never submitted to the servers.
         if is_test_probe(probe_type, name):
@@ -127,7 +192,7 @@ def extract_node_data(
             # If the probes state didn't change from the previous revision,
             # we just override with the latest state and continue.
             previous = storage[probe_id][HISTORY_KEY][channel][-1]
-            if probes_equal(previous, probe):
+            if fingerprints.equal(previous, probe):
                 previous["revisions"]["first"] = node_id
                 previous["versions"]["first"] = version
                 continue
@@ -142,7 +207,12 @@ def extract_node_data(
         if channel not in storage[probe_id][HISTORY_KEY]:
             storage[probe_id][HISTORY_KEY][channel] = []
 
-        probe = copy.deepcopy(probe)
+        # Probe dicts are interned across revisions and channels, so history
+        # entries share their contents and only own the revision and version
+        # bounds, which are the only parts that are updated later on.
+        fingerprint = fingerprints(probe)
+        probe = dict(probe)
+        fingerprints.assign(probe, fingerprint)
 
         probe["revisions"] = {
             "first": node_id,
@@ -212,6 +282,7 @@ def transform(probe_data, node_data, break_by_channel, revision_dates=None):
         channels = sorted_node_lists_by_date(node_data, revision_dates)
 
     result_data = {}
+    fingerprints = FingerprintCache(probe_fingerprint)
     for channel, channel_data in channels.items():
         print("\n" + channel + " - transforming probe data:")
         for entry in channel_data:
@@ -229,11 +300,19 @@ def transform(probe_data, node_data, break_by_channel, revision_dates=None):
                     result_data,
                     readable_version,
                     break_by_channel,
+                    fingerprints,
                 )
 
     return result_data
 
 
+def get_first_date(history, channel, revision_dates):
+    return min(
+        revision_dates[channel][entry["revisions"]["first"]]["date"]
+        for entry in history
+    )
+
+
 def get_minimum_date(probe_data, revision_data, revision_dates):
     probe_histories = transform(
         probe_data, revision_data, break_by_channel=True, revision_dates=revision_dates
@@ -242,26 +321,67 @@ def get_minimum_date(probe_data, revision_data, revision_dates):
 
     for channel, probes in probe_histories.items():
         for probe_id, entry in probes.items():
-            dates = []
-            for history in entry["history"][channel]:
-                revision = history["revisions"]["first"]
-                dates.append(revision_dates[channel][revision]["date"])
-            min_dates[probe_id][channel] = min(dates)
+            min_dates[probe_id][channel] = get_first_date(
+                entry[HISTORY_KEY][channel], channel, revision_dates
+            )
 
     return min_dates
 
 
+def transform_all(probe_data, revision_data, revision_dates):
+    """Build the per-channel and the cross-channel histories in a single pass.
+
+    The history of a probe in a channel only depends on the revisions of that
+    channel, so the cross-channel ("all") history is assembled from the
+    per-channel ones instead of being transformed again.
+
+    :return: a tuple of (probes_by_channel, first_appeared_dates), where
+             probes_by_channel has the output of `transform` with
+             break_by_channel=True, plus the output of `transform` with
+             break_by_channel=False under "all", and first_appeared_dates is
+             the output of `get_minimum_date`.
+    """
+    probes_by_channel = transform(
+        probe_data, revision_data, break_by_channel=True, revision_dates=revision_dates
+    )
+    all_probes = {}
+    min_dates = defaultdict(lambda: defaultdict(str))
+
+    for channel, probes in probes_by_channel.items():
+        for probe_id, entry in probes.items():
+            # The history lists are shared with the per-channel output.
+            history = entry[HISTORY_KEY][channel]
+            if probe_id not in all_probes:
+                all_probes[probe_id] = {
+                    TYPE_KEY: entry[TYPE_KEY],
+                    NAME_KEY: entry[NAME_KEY],
+                    HISTORY_KEY: {},
+                }
+            all_probes[probe_id][HISTORY_KEY][channel] = history
+            min_dates[probe_id][channel] = get_first_date(
+                history, channel, revision_dates
+            )
+
+    probes_by_channel["all"] = all_probes
+    return probes_by_channel, min_dates
+
+
 def pretty_ts(ts):
     return datetime.utcfromtimestamp(ts).isoformat(" ")
 
 
 def make_item_defn(definition, commit, commit_timestamps):
+    """
+    Record `commit` as the first or last commit of `definition`.
+
+    The dates are kept as numeric timestamps here, see `format_item_dates`.
+    """
     if COMMITS_KEY not in definition:
         # This is the first time we've seen this definition
         definition[COMMITS_KEY] = {"first": commit, "last": commit}
         definition[DATES_KEY] = {
-            "first": pretty_ts(commit_timestamps[commit][0]),
-            "last": pretty_ts(commit_timestamps[commit][0]),
+            "first": commit_timestamps[commit][0],
+            "last": commit_timestamps[commit][0],
         }
         definition[REFLOG_KEY] = {
             "first": commit_timestamps[commit][1],
@@ -270,48 +390,78 @@ def make_item_defn(definition, commit, commit_timestamps):
     else:
         # we've seen this definition, update the `last` commit
         definition[COMMITS_KEY]["last"] = commit
-        definition[DATES_KEY]["last"] = pretty_ts(commit_timestamps[commit][0])
+        definition[DATES_KEY]["last"] = commit_timestamps[commit][0]
         definition[REFLOG_KEY]["last"] = commit_timestamps[commit][1]
 
     return definition
 
 
-def tags_equal(def1, def2):
-    return def1["description"] == def2["description"]
+def format_item_dates(repo_items):
+    """Replace the numeric timestamps of all definitions with readable dates."""
+    for item in repo_items.values():
+        for defn in item[HISTORY_KEY]:
+            dates = defn[DATES_KEY]
+            defn[DATES_KEY] = {
+                "first": pretty_ts(dates["first"]),
+                "last": pretty_ts(dates["last"]),
+            }
 
 
-def metrics_equal(def1, def2):
-    return all(
-        (
-            def1.get(l) == def2.get(l)
-            for l in {
-                "bugs",
-                "data_reviews",
-                "data_sensitivity",
-                "description",
-                "disabled",
-                "expires",
-                "labeled",
-                "labels",
-                "lifetime",
-                "metadata",
-                "notification_emails",
-                "send_in_pings",
-                "time_unit",
-                "type",
-                "version",
-                "extra_keys",
-            }
+METRIC_EQUALITY_KEYS = (
+    "bugs",
+    "data_reviews",
+    "data_sensitivity",
+    "description",
+    "disabled",
+    "expires",
+    "labeled",
+    "labels",
+    "lifetime",
+    "metadata",
+    "notification_emails",
+    "send_in_pings",
+    "time_unit",
+    "type",
+    "version",
+    "extra_keys",
+)
+
+# Pings are compared on all keys except the ones the probe-scraper adds
+PING_IGNORED_KEYS = frozenset([DATES_KEY, COMMITS_KEY, HISTORY_KEY, REFLOG_KEY])
+
+
+def tag_fingerprint(defn):
+    return (defn["description"],)
+
+
+def metric_fingerprint(defn):
+    return tuple(defn.get(key) for key in METRIC_EQUALITY_KEYS)
+
+
+def ping_fingerprint(defn):
+    # A missing key and a None value compare equal, like with `dict.get`.
+    return tuple(
+        sorted(
+            (
+                (key, value)
+                for key, value in defn.items()
+                if key not in PING_IGNORED_KEYS and value is not None
+            ),
+            key=itemgetter(0),
         )
     )
 
 
-def ping_equal(def1, def2):
-    # Test all keys except the ones the probe-scraper adds
-    ignored_keys = set([DATES_KEY, COMMITS_KEY, HISTORY_KEY, REFLOG_KEY])
-    all_keys = set(def1.keys()).union(def2.keys()).difference(ignored_keys)
+def tags_equal(def1, def2):
+    return tag_fingerprint(def1) == tag_fingerprint(def2)
 
-    return all((def1.get(l) == def2.get(l) for l in all_keys))
+
+def metrics_equal(def1, def2):
+    return metric_fingerprint(def1) == metric_fingerprint(def2)
+
+
+def ping_equal(def1, def2):
+    return ping_fingerprint(def1) == ping_fingerprint(def2)
 
 
 def tag_constructor(defn, tag):
@@ -339,30 +489,44 @@ def update_or_add_item(
     commit_timestamps,
     equal_fn,
     type_ctor,
+    latest,
 ):
-    # If we've seen this item before, check previous definitions
+    """
+    :param latest - of the form
+      <item-name>: [<history index>, <timestamp>]
+
+      The index of the definition of each item that was seen last and when,
+      which is kept up to date by this function. Commits must be passed in
+      ascending timestamp order.
+    """
+    timestamp = commit_timestamps[commit_hash][0]
+
+    # If we've seen this item before, check the latest definition
     if item in repo_items:
         prev_defns = repo_items[item][HISTORY_KEY]
-        max_defn_i = max(
-            range(len(prev_defns)),
-            key=lambda i: datetime.fromisoformat(prev_defns[i][DATES_KEY]["last"]),
-        )
-        max_defn = prev_defns[max_defn_i]
+        item_latest = latest[item]
+        max_defn = prev_defns[item_latest[0]]
 
         # If equal to previous commit, update date and commit on existing definition
         if equal_fn(definition, max_defn):
-            new_defn = make_item_defn(max_defn, commit_hash, commit_timestamps)
-            repo_items[item][HISTORY_KEY][max_defn_i] = new_defn
+            make_item_defn(max_defn, commit_hash, commit_timestamps)
+            new_i = item_latest[0]
 
-        # Otherwise, prepend changed definition for existing item
+        # Otherwise, append changed definition for existing item
         else:
             new_defn = make_item_defn(definition, commit_hash, commit_timestamps)
-            repo_items[item][HISTORY_KEY] = prev_defns + [new_defn]
+            prev_defns.append(new_defn)
+            new_i = len(prev_defns) - 1
+
+        # On a tie, the earliest definition seen at that timestamp stays the latest.
+        if timestamp > item_latest[1]:
+            item_latest[:] = [new_i, timestamp]
 
     # We haven't seen this item before, add it
     else:
         defn = make_item_defn(definition, commit_hash, commit_timestamps)
         repo_items[item] = type_ctor(defn, item)
+        latest[item] = [0, timestamp]
 
     if commit_timestamps[commit_hash][1] == 0:
         # if this commit is the first one, we consider this object to be present
@@ -372,7 +536,7 @@ def update_or_add_item(
     return repo_items
 
 
-def transform_by_hash(commit_timestamps, data, equal_fn, type_ctor):
+def transform_by_hash(commit_timestamps, data, fingerprint_fn, type_ctor):
     """
     :param commit_timestamps - of the form
       <repo_name>: {
@@ -421,6 +585,8 @@ def transform_by_hash(commit_timestamps, data, equal_fn, type_ctor):
     all_items = {}
     for repo_name, commits in data.items():
         repo_items = {}
+        latest = {}
+        fingerprints = FingerprintCache(fingerprint_fn)
 
         # iterate through commits, sorted by timestamp of the commit
         sorted_commits = sorted(
@@ -435,23 +601,29 @@ def transform_by_hash(commit_timestamps, data, equal_fn, type_ctor):
                     item,
                     definition,
                     commit_timestamps[repo_name],
-                    equal_fn,
+                    fingerprints.equal,
                     type_ctor,
+                    latest,
                 )
 
+        format_item_dates(repo_items)
         all_items[repo_name] = repo_items
     return all_items
 
 
 def transform_tags_by_hash(commit_timestamps, tag_data):
-    return transform_by_hash(commit_timestamps, tag_data, tags_equal, tag_constructor)
+    return transform_by_hash(
+        commit_timestamps, tag_data, tag_fingerprint, tag_constructor
+    )
 
 
 def transform_metrics_by_hash(commit_timestamps, metric_data):
     return transform_by_hash(
-        commit_timestamps, metric_data, metrics_equal, metric_constructor
+        commit_timestamps, metric_data, metric_fingerprint, metric_constructor
     )
 
 
 def transform_pings_by_hash(commit_timestamps, ping_data):
-    return transform_by_hash(commit_timestamps, ping_data, ping_equal, ping_constructor)
+    return transform_by_hash(
+        commit_timestamps, ping_data, ping_fingerprint, ping_constructor
+    )
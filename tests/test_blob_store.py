@@ -0,0 +1,68 @@
+import os
+import shutil
+import subprocess
+
+from probe_scraper import blob_store
+
+
+def test_git_blob_id(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"some content\n")
+    expected = subprocess.check_output(["git", "hash-object", str(path)]).strip()
+    assert blob_store.git_blob_id(b"some content\n") == expected.decode("ascii")
+
+
+def test_blob_store(tmp_path):
+    store = blob_store.BlobStore(str(tmp_path))
+    blob_id = store.put(b"data")
+
+    assert store.has(blob_id)
+    assert not store.has(blob_store.git_blob_id(b"other"))
+    assert store.put(b"data") == blob_id
+
+    dest = tmp_path / "a" / "b"
+    store.link(blob_id, str(dest))
+    assert dest.read_bytes() == b"data"
+
+    # Blobs are read-only, and linking over a path leaves its blob intact.
+    assert not os.stat(store.path(blob_id)).st_mode & 0o222
+    store.link(store.put(b"other"), str(dest))
+    assert dest.read_bytes() == b"other"
+    with open(store.path(blob_id), "rb") as f:
+        assert f.read() == b"data"
+
+
+def test_refs(tmp_path):
+    cache_dir = str(tmp_path)
+    base_dir = os.path.join(cache_dir, "hg")
+    refs = blob_store.open_refs(cache_dir, "hg", base_dir)
+
+    rev_a = os.path.join(base_dir, "rev-a", "dir", "file.yaml")
+    rev_b = os.path.join(base_dir, "rev-b", "dir", "file.yaml")
+    legacy = os.path.join(base_dir, "rev-c", "dir", "file.yaml")
+    os.makedirs(os.path.dirname(legacy))
+    with open(legacy, "wb") as f:
+        f.write(b"legacy")
+
+    refs.add(rev_a, b"content")
+    refs.copy(rev_a, rev_b)
+    refs.add_existing(legacy)
+    refs.save()
+
+    # Identical content is only stored once.
+    assert refs.blob_id(rev_a) == refs.blob_id(rev_b)
+    assert len(os.listdir(os.path.join(cache_dir, blob_store.BLOBS_DIR))) == 2
+
+    # A cache that only has the blobs and refs can restore every file.
+    shutil.rmtree(base_dir)
+    refs = blob_store.open_refs(cache_dir, "hg", base_dir)
+    for path, content in [
+        (rev_a, b"content"),
+        (rev_b, b"content"),
+        (legacy, b"legacy"),
+    ]:
+        assert refs.restore(path)
+        with open(path, "rb") as f:
+            assert f.read() == content
+
+    assert not refs.restore(os.path.join(base_dir, "rev-d", "dir", "file.yaml"))
@@ -0,0 +1,177 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from probe_scraper import cache_pack, runner
+from probe_scraper.s3_sync import S3Sync
+
+from .test_s3_sync import FakeS3Client, write_files
+
+URL = "s3://bucket/cache-packed"
+FILES = {
+    "blobs/ab/abcd": b"blob",
+    "refs/repo.json": b"{}",
+    "probe_scraper_errors_cache.json": b"[]",
+    "hg/node/Histograms.json": b"not packed",
+}
+INCLUDE = ["blobs/*", "refs/*", "probe_scraper_*.json"]
+
+
+def read_files(root):
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            rel_path = os.path.relpath(path, root).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                files[rel_path] = f.read()
+    return files
+
+
+def segment_keys(client):
+    return sorted(key for _, key in client.objects if key.endswith(".pack"))
+
+
+def test_pack_and_restore(tmp_path):
+    client = FakeS3Client()
+    write_files(tmp_path / "local", FILES)
+    s3 = S3Sync(client)
+    assert cache_pack.restore(s3, URL, str(tmp_path / "local")) is None
+
+    index = cache_pack.pack(s3, str(tmp_path / "local"), URL, INCLUDE)
+    assert segment_keys(client) == ["cache-packed/segments/000001.pack"]
+    assert sorted(index["files"]) == [
+        "blobs/ab/abcd",
+        "probe_scraper_errors_cache.json",
+        "refs/repo.json",
+    ]
+    assert cache_pack.dead_bytes(index) == 0
+
+    # Packing again without any change uploads nothing.
+    client.uploads = []
+    assert cache_pack.pack(s3, str(tmp_path / "local"), URL, INCLUDE) == index
+    assert client.uploads == []
+
+    # All files are restored with a single ranged GET.
+    client.gets = []
+    restored = cache_pack.restore(S3Sync(client), URL, str(tmp_path / "restored"))
+    assert restored == index
+    assert [key for key, _ in client.gets] == [
+        "cache-packed/index.json.gz",
+        "cache-packed/segments/000001.pack",
+    ]
+    expected = {k: v for k, v in FILES.items() if not k.startswith("hg/")}
+    assert read_files(tmp_path / "restored") == expected
+
+
+def test_pack_changes_and_compact(tmp_path):
+    client = FakeS3Client()
+    write_files(tmp_path / "local", FILES)
+    cache_pack.pack(S3Sync(client), str(tmp_path / "local"), URL, INCLUDE)
+
+    # Only the changed and new files are appended, as a new segment.
+    s3 = S3Sync(client)
+    index = cache_pack.restore(s3, URL, str(tmp_path / "restored"))
+    write_files(
+        tmp_path / "restored", {"refs/repo.json": b'{"a": 1}', "refs/new": b"new"}
+    )
+    os.remove(tmp_path / "restored" / "blobs" / "ab" / "abcd")
+    index = cache_pack.pack(s3, str(tmp_path / "restored"), URL, INCLUDE, index)
+    assert segment_keys(client) == [
+        "cache-packed/segments/000001.pack",
+        "cache-packed/segments/000002.pack",
+    ]
+    assert client.objects[("bucket", "cache-packed/segments/000002.pack")][0] == (
+        b"new" + b'{"a": 1}'
+    )
+    assert cache_pack.dead_bytes(index) == len(b"blob" + b"{}")
+
+    index = cache_pack.compact(S3Sync(client), URL)
+    assert segment_keys(client) == ["cache-packed/segments/000003.pack"]
+    assert cache_pack.dead_bytes(index) == 0
+    cache_pack.restore(S3Sync(client), URL, str(tmp_path / "compacted"))
+    assert read_files(tmp_path / "compacted") == read_files(tmp_path / "restored")
+
+
+def test_restore_ranges(tmp_path, monkeypatch):
+    client = FakeS3Client()
+    write_files(tmp_path / "local", {"a": b"a" * 10, "b": b"b" * 10, "c": b"c" * 10})
+    cache_pack.pack(S3Sync(client), str(tmp_path / "local"), URL)
+    write_files(tmp_path / "restored", {"a": b"x" * 10, "b": b"b" * 10})
+
+    # The file that exists locally with the same content is skipped, which
+    # leaves a gap too large to fetch with the others. Files of the same
+    # size with a different content are restored.
+    monkeypatch.setattr(cache_pack, "MAX_GAP", 5)
+    client.gets = []
+    cache_pack.restore(S3Sync(client), URL, str(tmp_path / "restored"))
+    assert [rng for _, rng in client.gets] == [None, "bytes=0-9", "bytes=20-29"]
+    assert read_files(tmp_path / "restored") == {
+        "a": b"a" * 10,
+        "b": b"b" * 10,
+        "c": b"c" * 10,
+    }
+
+
+def test_restore_checks_content(tmp_path):
+    client = FakeS3Client()
+    write_files(tmp_path / "local", {"a": b"a" * 10})
+    cache_pack.pack(S3Sync(client), str(tmp_path / "local"), URL)
+    client.objects[("bucket", "cache-packed/segments/000001.pack")] = (b"b" * 10, None)
+    with pytest.raises(IOError):
+        cache_pack.restore(S3Sync(client), URL, str(tmp_path / "restored"))
+
+
+def test_format_version():
+    client = FakeS3Client()
+    index = cache_pack.new_index()
+    index["version"] = cache_pack.FORMAT_VERSION + 1
+    client.put_object(
+        Bucket="bucket",
+        Key="cache-packed/index.json.gz",
+        Body=gzip.compress(json.dumps(index).encode()),
+    )
+    with pytest.raises(ValueError):
+        cache_pack.load_index(S3Sync(client), URL)
+
+
+def test_sync_packed_cache(tmp_path):
+    client = FakeS3Client()
+    client.objects[("cache-bucket", "cache/probe-scraper/refs/repo.json")] = (
+        b"{}",
+        None,
+    )
+
+    # Without a packed cache yet, the file-by-file cache is restored.
+    cache_dir = str(tmp_path / "cache")
+    s3 = S3Sync(client)
+    cache_path = runner.setup_output_and_cache_dirs(
+        "bucket", "cache-bucket", str(tmp_path / "out"), cache_dir, s3, packed=True
+    )
+    assert cache_path == "s3://cache-bucket/cache/probe-scraper-packed"
+    assert read_files(cache_dir) == {"refs/repo.json": b"{}"}
+
+    runner.dump_json({}, str(tmp_path / "out"), "general")
+    runner.sync_output_and_cache_dirs(
+        "bucket",
+        "cache-bucket",
+        str(tmp_path / "out"),
+        cache_dir,
+        cache_path,
+        s3=s3,
+        packed=True,
+    )
+    assert segment_keys(client) == ["cache/probe-scraper-packed/segments/000001.pack"]
+
+    cache_dir = str(tmp_path / "cache-2")
+    runner.setup_output_and_cache_dirs(
+        "bucket",
+        "cache-bucket",
+        str(tmp_path / "out-2"),
+        cache_dir,
+        S3Sync(client),
+        packed=True,
+    )
+    assert read_files(cache_dir) == {"refs/repo.json": b"{}"}
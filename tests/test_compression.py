@@ -0,0 +1,101 @@
+import gzip
+import os
+
+import pytest
+
+from probe_scraper import compression, runner
+from probe_scraper.output_manifest import OutputManifest
+
+
+def test_gzip_tree(tmp_path, monkeypatch):
+    # Make sure files span several chunks.
+    monkeypatch.setattr(compression, "CHUNK_SIZE", 1000)
+    src = tmp_path / "src"
+    contents = {
+        "index.html": b"<html></html>",
+        "glean/repo/metrics": os.urandom(5000),
+        "firefox/release/main/all_probes": b'{"a": 1}' * 2000,
+    }
+    for rel_path, content in contents.items():
+        (src / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (src / rel_path).write_bytes(content)
+    with open(src / "glean" / "repo" / "pings", "wb") as f:
+        compression.write_gzipped(f, b"{}")
+
+    dst = tmp_path / "dst"
+    dst.mkdir()
+    compression.gzip_tree(str(src), str(dst), workers=3)
+
+    for rel_path, content in contents.items():
+        assert gzip.decompress((dst / rel_path).read_bytes()) == content
+    # Files that were gzipped already aren't compressed twice.
+    assert gzip.decompress((dst / "glean" / "repo" / "pings").read_bytes()) == b"{}"
+
+
+def test_gzipped_output(tmp_path):
+    outputs = []
+    for level in (None, compression.GZIP_LEVEL):
+        compression.set_output_level(level)
+        try:
+            runner.dump_json({"b": [1], "a": "é"}, str(tmp_path / str(level)), "data")
+        finally:
+            compression.set_output_level(None)
+        outputs.append((tmp_path / str(level) / "data").read_bytes())
+
+    plain, gzipped = outputs
+    assert compression.is_gzipped(str(tmp_path / "9" / "data"))
+    assert gzip.decompress(gzipped) == plain
+    # The same content always compresses to the same bytes.
+    with open(tmp_path / "again", "wb") as f:
+        compression.write_gzipped(f, plain)
+    assert (tmp_path / "again").read_bytes() == gzipped
+
+
+def test_precompressed_siblings(tmp_path):
+    brotli = pytest.importorskip("brotli")
+    out_dir = tmp_path / "out"
+    compression.set_sibling_levels({"gzip": 6, "br": 5})
+    try:
+        runner.dump_json({"a": 1}, str(out_dir), "metrics")
+        runner.write_general_data(str(out_dir))
+    finally:
+        compression.set_sibling_levels({})
+
+    content = (out_dir / "metrics").read_bytes()
+    assert gzip.decompress((out_dir / "metrics.gz").read_bytes()) == content
+    assert brotli.decompress((out_dir / "metrics.br").read_bytes()) == content
+    # Only JSON files get siblings.
+    assert not (out_dir / "index.html.br").exists()
+
+    dst = tmp_path / "dst"
+    dst.mkdir()
+    compression.gzip_tree(str(out_dir), str(dst))
+    assert sorted(p.name for p in dst.iterdir()) == [
+        "general",
+        "general.br",
+        "index.html",
+        "metrics",
+        "metrics.br",
+    ]
+    assert os.path.samefile(dst / "metrics", out_dir / "metrics.gz")
+    assert os.path.samefile(dst / "metrics.br", out_dir / "metrics.br")
+
+
+def test_precompressed_siblings_manifest(tmp_path):
+    pytest.importorskip("brotli")
+    first = OutputManifest(str(tmp_path / "out-1"))
+    runner.dump_json({"a": 1}, str(tmp_path / "out-1"), "metrics", first)
+
+    # Only the new brotli sibling of the unchanged file needs uploading.
+    second = OutputManifest(str(tmp_path / "out-2"), first.files)
+    compression.set_sibling_levels({"gzip": 6, "br": 5})
+    try:
+        runner.dump_json({"a": 1}, str(tmp_path / "out-2"), "metrics", second)
+    finally:
+        compression.set_sibling_levels({})
+    assert second.changed() == ["metrics.br"]
+    assert [p.name for p in (tmp_path / "out-2").iterdir()] == ["metrics.br"]
+
+    third = OutputManifest(str(tmp_path / "out-3"), second.files)
+    runner.dump_json({"a": 1}, str(tmp_path / "out-3"), "metrics", third)
+    assert third.removed() == ["metrics.br"]
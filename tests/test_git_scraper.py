@@ -6,17 +6,22 @@
 import datetime
 import json
 import os
+import random
 import shutil
 import time
 import unittest.mock
 from pathlib import Path
 
+import git
 import pytest
 import yaml
 from git import Head, Repo
 
 from probe_scraper import runner
+from probe_scraper.blob_store import git_blob_id
 from probe_scraper.emailer import EMAIL_FILE
+from probe_scraper.parsers.repositories import RepositoriesParser, Repository
+from probe_scraper.scrapers import git_scraper
 from probe_scraper.transform_probes import COMMITS_KEY, HISTORY_KEY
 
 # Where the test files are located
@@ -297,6 +302,43 @@ def test_improper_metrics_repo(improper_metrics_repo):
     assert len(emails) == 1
 
 
+def test_failed_repo_writes_no_output(normal_repo):
+    with open(repositories_file) as f:
+        repositories_info = yaml.safe_load(f)
+    repositories_info["libraries"][0]["url"] = os.path.join(test_dir, "missing")
+    with open(repositories_file, "w") as f:
+        f.write(yaml.dump(repositories_info))
+
+    with pytest.raises(ValueError):
+        runner.main(
+            cache_dir,
+            out_dir,
+            None,
+            None,
+            False,
+            True,
+            repositories_file,
+            True,
+            None,
+            None,
+            None,
+            None,
+            "dev",
+            None,
+        )
+
+    # The other repositories are written, but not the failed one.
+    assert not os.path.exists(os.path.join(out_dir, "glean", "glean"))
+    for name in (normal_repo_name, "boollib"):
+        for file_name in ("metrics", "pings", "tags"):
+            assert os.path.exists(os.path.join(out_dir, "glean", name, file_name))
+
+    with open(EMAIL_FILE, "r") as email_file:
+        emails = yaml.load(email_file, Loader=yaml.FullLoader)
+    # The emailer stores the subject as "to".
+    assert [e["to"] for e in emails] == [git_scraper.FAILED_IMPORT_SUBJECT]
+
+
 @pytest.fixture
 def normal_duplicate_repo():
     return get_repo(normal_repo_name)
@@ -525,3 +567,363 @@ def test_repo_default_main_branch(main_repo):
         dependencies = json.load(data)
 
     assert len(dependencies) == 2
+
+
+def test_read_files_at_hashes(normal_repo):
+    repo = Repo(normal_repo)
+    commits = [c.hexsha for c in repo.iter_commits()]
+    entries = [(commit, "metrics.yaml") for commit in commits]
+
+    blobs = list(git_scraper.read_files_at_hashes(repo, entries))
+
+    assert len(blobs) == len(commits)
+    for i, (blob_id, contents) in enumerate(blobs):
+        path = os.path.join(base_dir, normal_repo_name, str(len(commits) - 1 - i))
+        with open(os.path.join(path, "metrics.yaml"), "rb") as f:
+            assert contents == f.read()
+        assert blob_id == git_blob_id(contents)
+
+    with pytest.raises(ValueError):
+        list(git_scraper.read_files_at_hashes(repo, [(commits[0], "missing.yaml")]))
+
+
+def _file_in_repo_head(repo, filename):
+    # adapted from https://stackoverflow.com/a/25961128
+    subtree = repo.head.commit.tree
+    for path_element in filename.split(os.path.sep)[:-1]:
+        try:
+            subtree = subtree[path_element]
+        except KeyError:
+            return False  # subdirectory not in tree
+    return filename in subtree
+
+
+def get_commits(repo, filename):
+    """
+    The commits of `filename`, as returned by `git_scraper.get_all_commits`,
+    from one `git log` for the file. This is how the scraper used to get
+    them, and is kept as the reference for the history walk.
+    """
+    sep = ":"
+    log_format = '--format="%H{}%ct"'.format(sep)
+    # include "--" to prevent error for filename not in current tree
+    change_commits = repo.git.log(log_format, "--", filename).split("\n")
+    # filter out empty strings
+    change_commits = filter(None, change_commits)
+    commits = set(enumerate(change_commits))
+    if _file_in_repo_head(repo, filename):
+        # include HEAD when it contains filename
+        commits |= set(enumerate(repo.git.log("-n", "1", log_format).split("\n")))
+
+    result = {}
+    for index, entry in commits:
+        commit, timestamp = entry.strip('"').split(sep)
+        result[commit] = (int(timestamp), index)
+
+    return result
+
+
+def test_get_all_commits_matches_get_commits():
+    directory = os.path.join(test_dir, "merges")
+    repo = Repo.init(directory)
+    repo.head.reference = Head(repo, "refs/heads/master")
+    os.makedirs(os.path.join(directory, "sub"))
+    files = ["metrics.yaml", "pings.yaml", "sub/metrics.yaml"]
+
+    def commit(changes, timestamp):
+        for filename, content in changes.items():
+            with open(os.path.join(directory, filename), "w") as f:
+                f.write(content)
+        repo.index.add(list(changes))
+        date = f"{timestamp} +0000"
+        return repo.index.commit("Commit", author_date=date, commit_date=date)
+
+    def merge(branch, timestamp, changes=None):
+        # The index starts out with the content of the current branch.
+        parents = [repo.head.commit, repo.heads[branch].commit]
+        for filename, content in (changes or {}).items():
+            with open(os.path.join(directory, filename), "w") as f:
+                f.write(content)
+        repo.index.add(list(changes or {}))
+        date = f"{timestamp} +0000"
+        return repo.index.commit(
+            "Merge", parent_commits=parents, author_date=date, commit_date=date
+        )
+
+    base = 1600000000
+    commit({"metrics.yaml": "1", "pings.yaml": "1"}, base)
+    repo.create_head("side")
+    commit({"sub/metrics.yaml": "1"}, base + 1)
+    repo.heads.side.checkout()
+    commit({"metrics.yaml": "2"}, base + 1)
+    commit({"pings.yaml": "2", "other": "1"}, base + 3)
+    repo.heads.master.checkout(force=True)
+    commit({"pings.yaml": "3"}, base + 2)
+    # Takes metrics.yaml from "side", so only that file follows the side branch.
+    merge("side", base + 4, {"metrics.yaml": "2"})
+    commit({"sub/metrics.yaml": "2"}, base + 4)
+
+    result = git_scraper.get_all_commits(repo, files)
+
+    assert result == {f: get_commits(repo, f) for f in files}
+    assert len(result["metrics.yaml"]) == 3
+
+
+HISTORY_FILES = ["metrics.yaml", "pings.yaml", "sub/metrics.yaml"]
+
+
+def commit_tree(repo, files, parents, timestamp):
+    """
+    Commit exactly `files`, {<filename>: <content>}, on top of `parents`,
+    without moving any branch.
+    """
+    for filename in HISTORY_FILES:
+        path = os.path.join(repo.working_tree_dir, filename)
+        if filename in files:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(files[filename])
+        elif os.path.exists(path):
+            os.remove(path)
+    repo.git.add("-A")
+    date = f"{timestamp} +0000"
+    return repo.index.commit(
+        "Commit",
+        parent_commits=parents,
+        head=False,
+        author_date=date,
+        commit_date=date,
+    )
+
+
+def assert_matches_git_log(repo, head):
+    repo.head.reference = repo.create_head("scraped", head, force=True)
+    result = git_scraper.get_all_commits(repo, HISTORY_FILES)
+    assert result == {f: get_commits(repo, f) for f in HISTORY_FILES}
+    return result
+
+
+def test_get_all_commits_matches_git_log_on_complex_merges(tmp_path):
+    repo = Repo.init(tmp_path)
+    base = 1600000000
+    root = commit_tree(repo, {"metrics.yaml": "1", "pings.yaml": "1"}, [], base)
+    left = commit_tree(repo, {"metrics.yaml": "2", "pings.yaml": "1"}, [root], base + 5)
+    right = commit_tree(
+        repo,
+        {"metrics.yaml": "1", "pings.yaml": "2", "sub/metrics.yaml": "1"},
+        [root],
+        base + 1,
+    )
+
+    # A criss-cross merge: each side merges the other one, with different
+    # resolutions.
+    both = {"metrics.yaml": "2", "pings.yaml": "2", "sub/metrics.yaml": "1"}
+    left_merge = commit_tree(repo, both, [left, right], base + 6)
+    right_merge = commit_tree(
+        repo, {**both, "pings.yaml": "3"}, [right, left], base + 2
+    )
+
+    # Commits dated before their parents.
+    left_next = commit_tree(repo, {**both, "metrics.yaml": "3"}, [left_merge], base + 3)
+    right_next = commit_tree(
+        repo,
+        {"metrics.yaml": "2", "pings.yaml": "3"},
+        [right_merge],
+        base + 4,
+    )
+
+    # An evil merge, with content that is in neither parent.
+    evil = commit_tree(
+        repo,
+        {"metrics.yaml": "4", "pings.yaml": "3", "sub/metrics.yaml": "2"},
+        [left_next, right_next],
+        base + 4,
+    )
+    result = assert_matches_git_log(repo, evil)
+    assert evil.hexsha in result["metrics.yaml"]
+
+    # A merge that takes each file from a different parent, after one that
+    # reverts a file to an earlier content.
+    revert = commit_tree(
+        repo,
+        {"metrics.yaml": "1", "pings.yaml": "1", "sub/metrics.yaml": "1"},
+        [right_merge],
+        base + 7,
+    )
+    merge = commit_tree(
+        repo,
+        {"metrics.yaml": "4", "pings.yaml": "1", "sub/metrics.yaml": "2"},
+        [evil, revert],
+        base + 7,
+    )
+    assert_matches_git_log(repo, merge)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_get_all_commits_matches_git_log_on_random_histories(tmp_path, seed):
+    rnd = random.Random(seed)
+    repo = Repo.init(tmp_path)
+    base = 1600000000
+
+    def change(files):
+        files = dict(files)
+        for filename in HISTORY_FILES:
+            if rnd.random() < 0.3:
+                if filename in files and rnd.random() < 0.2:
+                    del files[filename]
+                else:
+                    files[filename] = str(rnd.randint(0, 3))
+        return files
+
+    # Timestamps are drawn from a small range, so there are many ties and
+    # commits dated before their parents.
+    tips = [commit_tree(repo, change({}), [], base)]
+    contents = {tips[0]: {}}
+    for _ in range(40):
+        parent = rnd.choice(tips)
+        if rnd.random() < 0.3 and len(tips) > 1:
+            other = rnd.choice([tip for tip in tips if tip != parent])
+            # Keep either side's content, or change it (an evil merge).
+            files = rnd.choice(
+                [contents[parent], contents[other], change(contents[parent])]
+            )
+            parents = [parent, other]
+        else:
+            files = change(contents[parent])
+            parents = [parent]
+        commit = commit_tree(repo, files, parents, base + rnd.randint(0, 20))
+        contents[commit] = files
+        if rnd.random() < 0.3:
+            tips.append(commit)
+        else:
+            tips[tips.index(parent)] = commit
+
+    head, files = tips[0], contents[tips[0]]
+    for tip in tips[1:]:
+        head = commit_tree(repo, files, [head, tip], base + 10)
+    assert_matches_git_log(repo, head)
+
+
+def test_update_all_commits_incrementally(normal_repo):
+    repo = Repo(normal_repo)
+    files = ["metrics.yaml", "pings.yaml"]
+    _, state = git_scraper.update_all_commits(repo, files)
+    old_head = repo.head.commit.hexsha
+
+    with open(os.path.join(normal_repo, "pings.yaml"), "w") as f:
+        f.write("---\n")
+    repo.index.add(["pings.yaml"])
+    repo.index.commit("Add pings")
+    with open(os.path.join(normal_repo, "other.txt"), "w") as f:
+        f.write("\n")
+    repo.index.add(["other.txt"])
+    repo.index.commit("Unrelated change")
+
+    with unittest.mock.patch.object(
+        git_scraper, "_get_commit_graph", wraps=git_scraper._get_commit_graph
+    ) as get_commit_graph:
+        result, state = git_scraper.update_all_commits(repo, files, state)
+        result_unchanged, _ = git_scraper.update_all_commits(repo, files, state)
+
+    # Only the new commits were walked, and only once.
+    new_head = repo.head.commit.hexsha
+    get_commit_graph.assert_called_once_with(repo, f"{old_head}..{new_head}")
+    expected = {f: get_commits(repo, f) for f in files}
+    assert result == expected
+    assert result_unchanged == expected
+
+    # Histories are walked in full when the tracked files change.
+    result, _ = git_scraper.update_all_commits(repo, ["metrics.yaml"], state)
+    assert result == {"metrics.yaml": expected["metrics.yaml"]}
+
+
+def test_scrape_in_parallel(normal_repo):
+    repositories = RepositoriesParser().parse(repositories_file)
+
+    parallel = git_scraper.scrape(cache_dir, repositories, workers=4)
+    sequential = git_scraper.scrape(cache_dir, repositories, workers=1)
+
+    assert parallel == sequential
+    assert list(parallel[1]) == [r.name for r in repositories]
+
+    # A failing repository gets an email, and doesn't stop the others.
+    broken = Repository(
+        "broken",
+        {
+            "url": os.path.join(test_dir, "missing"),
+            "notification_emails": ["nobody@example.com"],
+        },
+    )
+    rm_if_exists(os.path.join(cache_dir, git_scraper.STATE_DIR))
+    timestamps, results, emails = git_scraper.scrape(
+        cache_dir, [broken] + repositories, workers=4
+    )
+    assert timestamps["broken"] == {}
+    assert results["broken"] == {}
+    assert emails["broken"]["addresses"] == ["nobody@example.com"]
+    [email] = emails["broken"]["emails"]
+    assert email["subject"] == "Probe Scraper: Failed Probe Import"
+    assert "missing" in email["message"]
+    for name in parallel[1]:
+        assert timestamps[name] == parallel[0][name]
+        assert results[name] == parallel[1][name]
+        assert emails[name]["emails"] == []
+    scraped = [r.name for r in repositories if r.get_change_files()]
+    assert scraped
+    for name in scraped:
+        assert git_scraper.load_state(cache_dir, name) is not None
+
+
+def test_retrieve_files_from_shared_partial_clone(normal_repo):
+    source = Repo(normal_repo)
+    with source.config_writer() as config:
+        config.set_value("uploadpack", "allowFilter", "true")
+        config.set_value("uploadpack", "allowAnySHA1InWant", "true")
+    url = "file://" + os.path.abspath(normal_repo)
+    definition = {"url": url, "metrics_files": ["metrics.yaml"]}
+    repos = [Repository("first", definition), Repository("second", definition)]
+
+    with unittest.mock.patch.object(
+        git_scraper.git.Repo, "close", autospec=True, side_effect=git.Repo.close
+    ) as close:
+        timestamps, results, _ = git_scraper.scrape(cache_dir, repos)
+
+    # The repositories are closed, along with their `git cat-file` processes.
+    # Other repositories may be closed as they are garbage collected.
+    clone_path = os.path.realpath(git_scraper.get_repo_path(cache_dir, url))
+    closed = {
+        id(call.args[0])
+        for call in close.call_args_list
+        if os.path.realpath(call.args[0].git_dir) == clone_path
+    }
+    assert len(closed) == 2
+
+    # Both repositories use the same partial clone.
+    clones = os.listdir(os.path.join(cache_dir, git_scraper.GIT_DIR))
+    assert clones == [os.path.basename(git_scraper.get_repo_path(cache_dir, url))]
+    clone = Repo(git_scraper.get_repo_path(cache_dir, url))
+    assert clone.config_reader().get_value('remote "origin"', "promisor")
+
+    assert timestamps["first"] == timestamps["second"]
+    commits = [c.hexsha for c in source.iter_commits()]
+    assert sorted(results["first"]) == sorted(commits)
+    for i, commit in enumerate(commits):
+        path = os.path.join(base_dir, normal_repo_name, str(len(commits) - 1 - i))
+        with open(os.path.join(path, "metrics.yaml"), "rb") as expected:
+            content = expected.read()
+        for name in ("first", "second"):
+            with open(results[name][commit][0], "rb") as f:
+                assert f.read() == content
+
+
+def test_repo_lock_is_per_clone(tmp_path, monkeypatch):
+    (tmp_path / "cache").mkdir()
+    os.symlink(tmp_path / "cache", tmp_path / "link")
+    monkeypatch.chdir(tmp_path)
+    url = "https://example.com/repo"
+
+    lock = git_scraper._repo_lock(git_scraper.get_repo_path("cache", url))
+    for cache in (str(tmp_path / "cache"), str(tmp_path / "link"), "link"):
+        assert git_scraper._repo_lock(git_scraper.get_repo_path(cache, url)) is lock
+    other = git_scraper.get_repo_path("cache", "https://example.com/other")
+    assert git_scraper._repo_lock(other) is not lock
@@ -0,0 +1,135 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import responses
+
+from probe_scraper import http_client
+from probe_scraper.scrapers.buildhub import Buildhub
+
+URL = "https://example.com/file"
+
+
+@pytest.fixture
+def server():
+    """
+    A local HTTP server answering with the statuses in `server.statuses`, in
+    order, then with 200 and `server.body`. Retries happen in urllib3,
+    below the adapter that `responses` mocks, so they need a real server.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status = httpd.statuses.pop(0) if httpd.statuses else 200
+            body = httpd.body if status == 200 else b""
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    httpd = HTTPServer(("127.0.0.1", 0), Handler)
+    httpd.statuses = []
+    httpd.body = b"data"
+    httpd.url = "http://127.0.0.1:{}/file".format(httpd.server_port)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_retry_transient_errors(server):
+    server.statuses = [503, 502]
+
+    http_client.stats.reset()
+    session = http_client.Session(backoff_factor=0)
+    response = session.get(server.url)
+
+    assert response.status_code == 200
+    assert response.text == "data"
+    assert http_client.stats.to_dict() == {"requests": 1, "retries": 2, "bytes": 4}
+
+
+def test_retries_exhausted_returns_last_response(server):
+    server.statuses = [500, 500, 500]
+
+    session = http_client.Session(max_retries=2, backoff_factor=0)
+    response = session.get(server.url)
+
+    assert response.status_code == 500
+
+
+def test_post_is_only_retried_if_read_only(server):
+    server.statuses = [503]
+    response = http_client.Session(backoff_factor=0).post(server.url)
+    assert response.status_code == 503
+
+    server.statuses = [503]
+    session = http_client.Session(
+        backoff_factor=0, retry_methods=http_client.RETRY_METHODS | {"POST"}
+    )
+    assert session.post(server.url).status_code == 200
+
+
+def test_buildhub_search_is_retried(server, monkeypatch):
+    monkeypatch.setattr(Buildhub, "search_url", server.url)
+    server.statuses = [503]
+    server.body = b'{"hits": {"hits": []}}'
+
+    http_client.stats.reset()
+    data = Buildhub()._paginate_revision_dates(
+        0, "nightly", 67, "firefox", "en-US", "win64", None, False, 10
+    )
+
+    assert data == {"hits": {"hits": []}}
+    assert http_client.stats.to_dict()["retries"] == 1
+
+
+def test_streamed_body_is_not_read(server):
+    http_client.stats.reset()
+    response = http_client.Session(backoff_factor=0).get(server.url, stream=True)
+
+    assert http_client.stats.to_dict()["bytes"] == 4
+    assert not response._content_consumed
+    assert b"".join(response.iter_content(1)) == b"data"
+
+
+@responses.activate
+def test_not_found_is_not_retried():
+    responses.add(responses.GET, URL, status=404)
+
+    http_client.stats.reset()
+    response = http_client.Session(backoff_factor=0).get(URL)
+
+    assert response.status_code == 404
+    assert http_client.stats.to_dict()["retries"] == 0
+
+
+def test_jittered_backoff():
+    retry = http_client.JitteredRetry(total=10, backoff_factor=1)
+    for _ in range(4):
+        retry = retry.increment(method="GET", url=URL)
+
+    for _ in range(100):
+        assert 0 <= retry.get_backoff_time() <= 8
+
+
+def test_host_rate_limiter():
+    limiter = http_client.HostRateLimiter({"example.com": 20})
+
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.wait(URL)
+        # Hosts without a limit are never delayed.
+        limiter.wait("https://example.org/")
+    elapsed = time.monotonic() - start
+
+    assert elapsed >= 4 / 20
@@ -1,5 +1,9 @@
+from unittest import mock
+
 import pytest
+from glean_parser.parser import parse_objects
 
+from probe_scraper.parse_cache import ParseCache
 from probe_scraper.parsers.metrics import GleanMetricsParser
 
 
@@ -41,3 +45,56 @@ def test_source_url():
     )
     with pytest.raises(KeyError):
         parsed_metrics["example.os"]["defined_in"]
+
+
+def write_metrics(path, categories):
+    lines = ["$schema: moz://mozilla.org/schemas/glean/metrics/2-0-0", ""]
+    for category, names in categories.items():
+        lines.append(f"{category}:")
+        for name in names:
+            lines += [
+                f"  {name}:",
+                "    type: counter",
+                "    description: A counter.",
+                "    bugs: [https://bugzilla.mozilla.org/show_bug.cgi?id=1]",
+                "    data_reviews: [https://example.com]",
+                "    notification_emails: [nobody@example.com]",
+                "    expires: never",
+            ]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("\n".join(lines) + "\n")
+
+
+def test_parse_per_file(tmp_path):
+    parser = GleanMetricsParser()
+    cache = ParseCache()
+    checkout = tmp_path / "commit"
+    first = checkout / "first" / "metrics.yaml"
+    second = checkout / "second" / "metrics.yaml"
+    write_metrics(first, {"b": ["one"], "c": ["one"]})
+    write_metrics(second, {"a": ["one"], "b": ["two"]})
+    files = [str(first), str(second)]
+
+    expected = parser.parse(files, {}, "https://example.com", "commit")
+    with mock.patch(
+        "probe_scraper.parsers.metrics.parse_objects", wraps=parse_objects
+    ) as parse:
+        result = parser.parse(files, {}, "https://example.com", "commit", cache)
+        write_metrics(second, {"b": ["three"]})
+        parser.parse(files, {}, "https://example.com", "commit", cache)
+
+    assert result == expected
+    assert expected[1] == []
+    assert list(result[0]) == list(expected[0]) == ["b.one", "b.two", "c.one", "a.one"]
+    # Only the changed file was parsed again.
+    assert [call.args[0] for call in parse.call_args_list] == [
+        [first],
+        [second],
+        [second],
+    ]
+
+    # Metrics defined in more than one file get glean_parser's errors.
+    write_metrics(second, {"b": ["one"]})
+    expected = parser.parse(files, {}, "https://example.com", "commit")
+    assert expected[1]
+    assert parser.parse(files, {}, "https://example.com", "commit", cache) == expected
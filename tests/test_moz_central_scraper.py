@@ -1,8 +1,13 @@
+import json
 import os
+import re
+import shutil
 from datetime import datetime
 
 import pytest
+import responses
 
+from probe_scraper import blob_store
 from probe_scraper.scrapers import moz_central_scraper
 
 
@@ -45,3 +50,185 @@ def test_channel_revisions():
     }
 
     assert res[channel][revision] == record
+
+
+HG_URI = "https://hg.mozilla.org/mozilla-central/raw-file"
+
+
+def registry_uri(node, rel_path):
+    return f"{HG_URI}/{node}/{rel_path}"
+
+
+@responses.activate
+def test_download_revisions(tmp_path):
+    nodes = ["rev-a", "rev-b", "rev-c"]
+    for node in nodes:
+        for paths in moz_central_scraper.REGISTRY_FILES.values():
+            for rel_path in paths:
+                responses.add(
+                    responses.GET,
+                    registry_uri(node, rel_path),
+                    body=f"{node}:{rel_path}",
+                )
+    # Events.yaml is missing in one revision
+    missing_uri = registry_uri("rev-b", "toolkit/components/telemetry/Events.yaml")
+    responses.replace(responses.GET, missing_uri, status=404)
+
+    error_cache = {}
+    revisions = [(node, 62, "mozilla-central") for node in nodes]
+    results = moz_central_scraper.download_revisions(
+        "nightly", revisions, str(tmp_path), error_cache, workers=4
+    )
+
+    assert list(results) == nodes
+    assert error_cache == {missing_uri: 404}
+    assert "event" not in results["rev-b"]
+    for node in nodes:
+        expected = moz_central_scraper.download_files(
+            "nightly", node, str(tmp_path), error_cache, 62, tree="mozilla-central"
+        )
+        assert results[node] == expected
+        for paths in results[node].values():
+            for path in paths:
+                rel_path = os.path.relpath(path, tmp_path / "hg" / node)
+                with open(path) as f:
+                    assert f.read() == f"{node}:{rel_path}"
+
+    # Cached files and known errors are not requested again.
+    num_calls = len(responses.calls)
+    moz_central_scraper.download_revisions(
+        "nightly", revisions, str(tmp_path), error_cache, workers=4
+    )
+    assert len(responses.calls) == num_calls
+
+
+@responses.activate
+def test_download_revisions_missing_histograms(tmp_path):
+    responses.add(responses.GET, re.compile(f"{HG_URI}/.*"), status=404)
+
+    with pytest.raises(Exception, match="Histograms.json"):
+        moz_central_scraper.download_revisions(
+            "nightly", [("rev-a", 62, "mozilla-central")], str(tmp_path), {}
+        )
+
+
+HG_JSON_LOG_URI = "https://hg.mozilla.org/mozilla-central/json-log"
+HISTOGRAMS = "toolkit/components/telemetry/Histograms.json"
+SCALARS = "toolkit/components/telemetry/Scalars.yaml"
+
+
+def add_fake_hg(history):
+    """
+    Serve raw-file and json-log requests from `history`, a dict of
+    node -> {rel_path: changeset that last modified the file}.
+    Files that are not listed for a node don't exist in it.
+    """
+
+    def callback(request):
+        command, node, rel_path = re.match(
+            r".*/(raw-file|json-log)/([^/]+)/([^?]+)", request.url
+        ).groups()
+        change = history[node].get(rel_path)
+        if change is None:
+            return (404, {}, "not found")
+        if command == "json-log":
+            return (200, {}, json.dumps({"entries": [{"node": change}]}))
+        return (200, {}, f"{rel_path}@{change}")
+
+    for uri in (HG_URI, HG_JSON_LOG_URI):
+        responses.add_callback(responses.GET, re.compile(f"{uri}/.*"), callback)
+
+
+def raw_file_requests(rel_path):
+    return [
+        call.request.url
+        for call in responses.calls
+        if "/raw-file/" in call.request.url and call.request.url.endswith(rel_path)
+    ]
+
+
+@responses.activate
+def test_download_revisions_only_changed(tmp_path):
+    history = {
+        "rev-a": {HISTOGRAMS: "change-1", SCALARS: "change-2"},
+        "rev-b": {HISTOGRAMS: "change-1", SCALARS: "change-2"},
+        "rev-c": {HISTOGRAMS: "change-3", SCALARS: "change-2"},
+        "rev-d": {HISTOGRAMS: "change-3", SCALARS: "change-2"},
+    }
+    add_fake_hg(history)
+
+    error_cache = {}
+    filelog_cache = {}
+    revisions = [(node, 62, "mozilla-central") for node in ["rev-a", "rev-b", "rev-c"]]
+    results = moz_central_scraper.download_revisions(
+        "nightly",
+        revisions,
+        str(tmp_path),
+        error_cache,
+        filelog_cache=filelog_cache,
+    )
+
+    assert raw_file_requests(HISTOGRAMS) == [registry_uri("rev-a", HISTOGRAMS)] + [
+        registry_uri("rev-c", HISTOGRAMS)
+    ]
+    assert raw_file_requests(SCALARS) == [registry_uri("rev-a", SCALARS)]
+    assert filelog_cache["rev-b/" + HISTOGRAMS] == "change-1"
+    assert filelog_cache["rev-c/" + HISTOGRAMS] == "change-3"
+
+    # Events.yaml doesn't exist in any revision.
+    assert all("event" not in files for files in results.values())
+    for node, _, _ in revisions:
+        assert registry_uri(node, "toolkit/components/telemetry/Events.yaml") in (
+            error_cache
+        )
+
+    for node, files in results.items():
+        for path in files["histogram"] + files["scalar"]:
+            rel_path = os.path.relpath(path, tmp_path / "hg" / node)
+            with open(path) as f:
+                assert f.read() == f"{rel_path}@{history[node][rel_path]}"
+
+    # A later run reuses the files that are already in the cache.
+    responses.calls.reset()
+    results = moz_central_scraper.download_revisions(
+        "nightly",
+        [("rev-d", 62, "mozilla-central")],
+        str(tmp_path),
+        error_cache,
+        filelog_cache=filelog_cache,
+    )
+    assert raw_file_requests(HISTOGRAMS) == []
+    assert raw_file_requests(SCALARS) == []
+    with open(results["rev-d"]["histogram"][0]) as f:
+        assert f.read() == f"{HISTOGRAMS}@change-3"
+
+
+@responses.activate
+def test_download_revisions_blob_store(tmp_path):
+    history = {
+        "rev-a": {HISTOGRAMS: "change-1", SCALARS: "change-2"},
+        "rev-b": {HISTOGRAMS: "change-3", SCALARS: "change-2"},
+    }
+    add_fake_hg(history)
+
+    revisions = [(node, 62, "mozilla-central") for node in history]
+    refs = blob_store.open_refs(str(tmp_path), "hg", str(tmp_path / "hg"))
+    results = moz_central_scraper.download_revisions(
+        "nightly", revisions, str(tmp_path), {}, refs=refs
+    )
+    refs.save()
+
+    # The per-revision files are restored from the blob store when only the
+    # store and its refs are in the cache.
+    shutil.rmtree(tmp_path / "hg")
+    responses.calls.reset()
+    refs = blob_store.open_refs(str(tmp_path), "hg", str(tmp_path / "hg"))
+    restored = moz_central_scraper.download_revisions(
+        "nightly", revisions, str(tmp_path), {}, refs=refs
+    )
+
+    assert raw_file_requests(HISTOGRAMS) == []
+    assert raw_file_requests(SCALARS) == []
+    assert restored == results
+    with open(restored["rev-b"]["histogram"][0]) as f:
+        assert f.read() == f"{HISTOGRAMS}@change-3"
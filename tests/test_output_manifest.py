@@ -0,0 +1,41 @@
+import json
+
+from probe_scraper import runner
+from probe_scraper.output_manifest import MANIFEST_FILENAME, OutputManifest
+
+
+def write_run(cache_dir, out_dir, outputs):
+    manifest = OutputManifest.load(str(cache_dir), str(out_dir))
+    for file_name, data in outputs.items():
+        runner.dump_json(data, str(out_dir / "glean" / "repo"), file_name, manifest)
+    return manifest
+
+
+def test_only_changed_files_are_written(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+
+    first = write_run(cache_dir, tmp_path / "out-1", {"metrics": {"a": 1}, "pings": {}})
+    assert first.changed() == ["glean/repo/metrics", "glean/repo/pings"]
+    assert first.removed() == []
+    assert (tmp_path / "out-1" / "glean" / "repo" / "pings").exists()
+    first.save(str(cache_dir))
+
+    second = write_run(cache_dir, tmp_path / "out-2", {"metrics": {"a": 2}, "tags": {}})
+    assert second.changed() == ["glean/repo/metrics", "glean/repo/tags"]
+    assert second.removed() == ["glean/repo/pings"]
+    out_dir = tmp_path / "out-2" / "glean" / "repo"
+    assert sorted(p.name for p in out_dir.iterdir()) == ["metrics", "tags"]
+    assert json.loads((out_dir / "metrics").read_text()) == {"a": 2}
+
+    # Nothing is recorded as uploaded until the manifest is saved.
+    third = write_run(cache_dir, tmp_path / "out-3", {"metrics": {"a": 2}})
+    assert third.changed() == ["glean/repo/metrics"]
+
+
+def test_outdated_manifest_is_ignored(tmp_path):
+    (tmp_path / MANIFEST_FILENAME).write_text(
+        json.dumps({"version": 0, "files": {"glean/repo/metrics": "0" * 64}})
+    )
+    manifest = OutputManifest.load(str(tmp_path), str(tmp_path / "out"))
+    assert manifest.previous is None
@@ -0,0 +1,231 @@
+import json
+import shutil
+from unittest import mock
+
+from probe_scraper import runner
+from probe_scraper.parse_cache import ParseCache, file_digest
+from probe_scraper.parsers.histograms import HistogramsParser
+from probe_scraper.parsers.metrics import GleanMetricsParser
+from probe_scraper.parsers.repositories import Repository
+
+HISTOGRAM_FILES = [
+    "tests/resources/Histograms.json",
+    "tests/resources/nsDeprecatedOperationList.h",
+    "tests/resources/UseCounters.conf",
+]
+
+
+def copy_files(tmp_path, node):
+    paths = []
+    for path in HISTOGRAM_FILES:
+        dest = tmp_path / node / path
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, dest)
+        paths.append(str(dest))
+    return paths
+
+
+def test_file_digest(tmp_path):
+    a = tmp_path / "a"
+    b = tmp_path / "b"
+    a.write_bytes(b"content")
+    b.write_bytes(b"other content")
+
+    assert file_digest(str(a)) != file_digest(str(b))
+    b.write_bytes(b"content")
+    assert file_digest(str(a)) == file_digest(str(b))
+
+
+def test_key(tmp_path):
+    cache = ParseCache()
+    paths_a = copy_files(tmp_path, "rev-a")
+    paths_b = copy_files(tmp_path, "rev-b")
+
+    # The location of the files doesn't matter, but their content does.
+    assert cache.key("histogram", paths_a) == cache.key("histogram", paths_b)
+    assert cache.key("histogram", paths_a) != cache.key("scalar", paths_a)
+    assert cache.key("histogram", paths_a) != cache.key("histogram", paths_a[:1])
+    assert cache.key("histogram", paths_a, {"flag": True}) != cache.key(
+        "histogram", paths_a, {"flag": False}
+    )
+
+    with open(paths_b[0], "a") as f:
+        f.write("\n")
+    assert cache.key("histogram", paths_a) != cache.key("histogram", paths_b)
+
+
+def test_persistent_cache(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    cache.put("abcdef", {"probe": {"optout": True}})
+
+    assert cache.get("abcdef") == {"probe": {"optout": True}}
+    assert ParseCache(str(tmp_path)).get("abcdef") == {"probe": {"optout": True}}
+    assert ParseCache(str(tmp_path)).get("012345") is None
+    assert ParseCache().get("abcdef") is None
+
+    # Results are stored as JSON, in the order they were produced.
+    cache.put("fedcba", {"b": [1, None], "a": "x"})
+    with open(tmp_path / "parse_cache" / "fe" / "fedcba.json") as f:
+        assert list(json.load(f)) == ["b", "a"]
+    assert list(ParseCache(str(tmp_path)).get("fedcba")) == ["b", "a"]
+
+
+def test_memory_is_bounded(tmp_path):
+    cache = ParseCache(str(tmp_path), memory_size=2)
+    for key in ("aa", "bb", "cc"):
+        cache.put(key, [key])
+    cache.get("bb")
+    cache.put("dd", ["dd"])
+
+    # The least recently used results are dropped, and read back from disk.
+    assert list(cache._memory) == ["bb", "dd"]
+    assert cache.get("aa") == ["aa"]
+    assert list(cache._memory) == ["dd", "aa"]
+
+    # Without a cache directory, results are only in memory and all kept.
+    memory_only = ParseCache(memory_size=2)
+    for key in ("aa", "bb", "cc"):
+        memory_only.put(key, [key])
+    assert memory_only.get("aa") == ["aa"]
+
+
+def test_parse_moz_central_probes_memoized(tmp_path):
+    scraped_data = {
+        "release": {
+            node: {
+                "version": version,
+                "registries": {"histogram": copy_files(tmp_path, node)},
+            }
+            for node, version in [("rev-a", 64), ("rev-b", 64), ("rev-c", 65)]
+        }
+    }
+
+    parser = HistogramsParser()
+    with mock.patch.object(parser, "parse", wraps=parser.parse) as parse:
+        with mock.patch.dict(runner.PARSERS, {"histogram": parser}):
+            probes = runner.parse_moz_central_probes(
+                scraped_data, ParseCache(str(tmp_path / "cache"))
+            )
+            # The use counter optout changes in 65, so that must be parsed again.
+            assert parse.call_count == 2
+
+            release = probes["release"]
+            counter = "USE_COUNTER2_PROPERTY_FILL_PAGE"
+            assert release["rev-a"]["histogram"] == release["rev-b"]["histogram"]
+            assert not release["rev-b"]["histogram"][counter]["optout"]
+            assert release["rev-c"]["histogram"][counter]["optout"]
+
+            # A later run doesn't parse anything.
+            cached = runner.parse_moz_central_probes(
+                scraped_data, ParseCache(str(tmp_path / "cache"))
+            )
+            assert parse.call_count == 2
+            assert cached == probes
+
+
+def test_parse_moz_central_probes_jobs(tmp_path):
+    scraped_data = {
+        channel: {
+            node: {
+                "version": version,
+                "registries": {"histogram": copy_files(tmp_path, node)},
+            }
+            for node, version in [("rev-a", 64), ("rev-b", 65)]
+        }
+        for channel in ["beta", "release"]
+    }
+
+    sequential = runner.parse_moz_central_probes(scraped_data, jobs=1)
+    parallel = runner.parse_moz_central_probes(scraped_data, jobs=2)
+
+    assert parallel == sequential
+    # Identical probes are still interned across revisions and channels.
+    name = "TELEMETRY_TEST_FLAG"
+    assert (
+        parallel["beta"]["rev-a"]["histogram"][name]
+        is parallel["release"]["rev-b"]["histogram"][name]
+    )
+
+
+def test_glean_parse_cache(tmp_path):
+    parser = GleanMetricsParser()
+    repo_url = "https://github.com/mozilla/example"
+    paths = {}
+    for commit in ("commit-a", "commit-b"):
+        dest = tmp_path / "repo" / commit / "sub" / "metrics.yaml"
+        dest.parent.mkdir(parents=True)
+        shutil.copyfile("tests/resources/metrics.yaml", dest)
+        paths[commit] = [str(dest)]
+
+    cache = ParseCache(str(tmp_path / "cache"))
+    expected = parser.parse(paths["commit-b"], {}, repo_url, "commit-b")
+
+    with mock.patch.object(parser, "_parse", wraps=parser._parse) as parse:
+        first = parser.parse(paths["commit-a"], {}, repo_url, "commit-a", cache)
+        first_metric = next(iter(first[0].values()))
+        first_metric["send_in_pings"].append("modified")
+        second = parser.parse(paths["commit-b"], {}, repo_url, "commit-b", cache)
+        # The cache persists across runs.
+        fresh_cache = ParseCache(str(tmp_path / "cache"))
+        third = parser.parse(paths["commit-b"], {}, repo_url, "commit-b", fresh_cache)
+
+    assert parse.call_count == 1
+    assert second == expected
+    assert third == expected
+    assert first_metric["source_url"].startswith(
+        f"{repo_url}/blob/commit-a/sub/metrics.yaml#L"
+    )
+
+
+PINGS_YAML = """---
+$schema: moz://mozilla.org/schemas/glean/pings/2-0-0
+
+example:
+  description: An example ping.
+  include_client_id: true
+  bugs:
+    - https://bugzilla.mozilla.org/show_bug.cgi?id=1
+  data_reviews:
+    - https://bugzilla.mozilla.org/show_bug.cgi?id=1
+  notification_emails:
+    - nobody@example.com
+"""
+
+
+def test_parse_glean_metrics_jobs(tmp_path):
+    repositories = [
+        Repository("example", {"url": "https://github.com/mozilla/example"})
+    ]
+    repos_metrics_data = {"example": {}}
+    for commit in ("commit-a", "commit-b", "commit-c"):
+        commit_dir = tmp_path / "example" / commit
+        commit_dir.mkdir(parents=True)
+        shutil.copyfile("tests/resources/metrics.yaml", commit_dir / "metrics.yaml")
+        (commit_dir / "pings.yaml").write_text(PINGS_YAML)
+        repos_metrics_data["example"][commit] = [
+            str(commit_dir / "metrics.yaml"),
+            str(commit_dir / "pings.yaml"),
+        ]
+    # An unreadable pings file is reported, without failing the other commits.
+    (tmp_path / "example" / "commit-b" / "pings.yaml").write_text("- [")
+
+    results = {}
+    for jobs in (1, 2):
+        emails = {"example": {"emails": [], "addresses": []}}
+        results[jobs] = runner.parse_glean_metrics(
+            repositories,
+            repos_metrics_data,
+            emails,
+            str(tmp_path / f"cache-{jobs}"),
+            jobs,
+        )
+        assert [email["subject"] for email in emails["example"]["emails"]] == [
+            "Probe Scraper: Error on parsing metric or ping files"
+        ]
+
+    assert results[2] == results[1]
+    tags, metrics, pings = results[2]
+    assert list(metrics["example"]) == ["commit-a", "commit-b", "commit-c"]
+    assert list(pings["example"]) == ["commit-a", "commit-b", "commit-c"]
+    assert pings["example"]["commit-b"] == {}
+    assert "example" in pings["example"]["commit-c"]
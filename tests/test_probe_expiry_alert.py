@@ -252,7 +252,7 @@ def test_bugs_created_only_for_new_probes(mock_create_bugs, mock_find_bugs):
     )
 
 
-@mock.patch("requests.post")
+@mock.patch("probe_scraper.http_client.post")
 def test_create_bug(mock_post):
     mock_response = mock.MagicMock()
     mock_response.json = mock.MagicMock(return_value={"id": 2})
@@ -274,7 +274,7 @@ def test_create_bug(mock_post):
     assert bug_id == 2
 
 
-@mock.patch("requests.post")
+@mock.patch("probe_scraper.http_client.post")
 def test_create_bug_try_on_needinfo_blocked(mock_post):
     error_response = mock.MagicMock()
     error_response.text = json.dumps(
@@ -317,7 +317,7 @@ def test_create_bug_try_on_needinfo_blocked(mock_post):
     assert len(call_args_2["cc"]) == 1
 
 
-@mock.patch("requests.get")
+@mock.patch("probe_scraper.http_client.get")
 def test_bug_description_parser(mock_get):
     """
     Checking if current expiring probes have already had bugs filed uses regex on the bug
@@ -374,7 +374,7 @@ def test_get_longest_prefix():
     assert probe_expiry_alert.get_longest_prefix(["abc"]) == "abc"
 
 
-@mock.patch("requests.get")
+@mock.patch("probe_scraper.http_client.get")
 def test_check_bugzilla_user_account_not_found(mock_get):
     mock_response = mock.MagicMock()
     mock_response.status_code = 400
@@ -389,7 +389,7 @@ def test_check_bugzilla_user_account_not_found(mock_get):
     assert not probe_expiry_alert.check_bugzilla_user_exists("test@test.com", "")
 
 
-@mock.patch("requests.get")
+@mock.patch("probe_scraper.http_client.get")
 def test_check_bugzilla_user_account_not_found_200(mock_get):
     mock_response = mock.MagicMock()
     mock_response.status_code = 200
@@ -407,7 +407,7 @@ def test_check_bugzilla_user_account_not_found_200(mock_get):
     assert not probe_expiry_alert.check_bugzilla_user_exists("test@test.com", "")
 
 
-@mock.patch("requests.get")
+@mock.patch("probe_scraper.http_client.get")
 def test_check_bugzilla_user_account_inactive(mock_get):
     users = {
         "users": [
@@ -429,7 +429,7 @@ def test_check_bugzilla_user_account_inactive(mock_get):
     assert not probe_expiry_alert.check_bugzilla_user_exists("test@test.com", "")
 
 
-@mock.patch("requests.get")
+@mock.patch("probe_scraper.http_client.get")
 def test_check_bugzilla_user_account_active(mock_get):
     users = {
         "users": [
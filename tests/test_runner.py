@@ -3,6 +3,7 @@ from copy import deepcopy
 from datetime import datetime
 
 from probe_scraper import runner
+from probe_scraper.parsers.repositories import Repository
 
 
 def test_add_first_appeared_dates():
@@ -78,3 +79,27 @@ def test_trailing_space(tmp_path):
                     trailing_spaces += 1
 
         assert not trailing_spaces
+
+
+def test_glean_repo_context():
+    repo = Repository(
+        "glean-core",
+        {
+            "url": "https://github.com/mozilla/glean",
+            "metrics_files": ["a/metrics.yaml", "b/extra_metrics.yaml"],
+            "ping_files": ["a/pings.yaml"],
+            "tag_files": ["a/tags.yaml"],
+        },
+    )
+    context = runner.GleanRepoContext(repo)
+    paths = [
+        os.path.join("/cache", "glean-core", "abc", rel_path)
+        for rel_path in repo.get_change_files() + ["README.md"]
+    ]
+
+    assert context.config == {"allow_reserved": True}
+    assert context.classify(paths) == {
+        "tags": [paths[3]],
+        "metrics": paths[:2],
+        "pings": [paths[2]],
+    }
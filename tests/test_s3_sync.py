@@ -0,0 +1,244 @@
+import datetime
+import io
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from probe_scraper import runner
+from probe_scraper.output_manifest import MANIFEST_FILENAME, OutputManifest
+from probe_scraper.s3_sync import S3Sync, parse_s3_url
+
+
+class FakeS3Client:
+    """An in-memory stand-in for the parts of the boto3 S3 client we use."""
+
+    def __init__(self, page_size=2):
+        self.objects = {}
+        self.page_size = page_size
+        self.uploads = []
+        self.gets = []
+        # Objects added to `objects` directly are as old as the client.
+        self.created = datetime.datetime.now(datetime.timezone.utc)
+        self.modified = {}
+
+    def _put(self, Bucket, Key, content, ExtraArgs=None):
+        self.objects[(Bucket, Key)] = (content, ExtraArgs)
+        self.modified[(Bucket, Key)] = datetime.datetime.now(datetime.timezone.utc)
+        self.uploads.append(Key)
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None):
+        keys = sorted(
+            key
+            for bucket, key in self.objects
+            if bucket == Bucket and key.startswith(Prefix)
+        )
+        start = int(ContinuationToken or 0)
+        end = start + self.page_size
+        response = {
+            "Contents": [
+                {
+                    "Key": key,
+                    "Size": len(self.objects[(Bucket, key)][0]),
+                    "LastModified": self.modified.get((Bucket, key), self.created),
+                }
+                for key in keys[start:end]
+            ],
+            "IsTruncated": end < len(keys),
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(end)
+        return response
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Config=None):
+        with open(Filename, "rb") as f:
+            self._put(Bucket, Key, f.read(), ExtraArgs)
+
+    def download_file(self, Bucket, Key, Filename, Config=None):
+        with open(Filename, "wb") as f:
+            f.write(self.objects[(Bucket, Key)][0])
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+        self._put(Bucket, Key, Fileobj.read(), ExtraArgs)
+
+    def put_object(self, Bucket, Key, Body):
+        self._put(Bucket, Key, Body)
+
+    def get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        self.gets.append((Key, Range))
+        content = self.objects[(Bucket, Key)][0]
+        if Range is not None:
+            start, end = map(int, Range.replace("bytes=", "").split("-"))
+            content = content[start:][: end + 1 - start]
+        return {"Body": io.BytesIO(content)}
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete["Objects"]:
+            self.objects.pop((Bucket, obj["Key"]), None)
+        return {}
+
+
+def write_files(root, files):
+    for rel_path, content in files.items():
+        path = os.path.join(root, *rel_path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+
+
+def test_parse_s3_url():
+    assert parse_s3_url("s3://bucket/cache/probe-scraper") == (
+        "bucket",
+        "cache/probe-scraper",
+    )
+    assert parse_s3_url("s3://bucket/") == ("bucket", "")
+    with pytest.raises(ValueError):
+        parse_s3_url("/tmp/bucket")
+
+
+def test_round_trip(tmp_path):
+    client = FakeS3Client()
+    files = {
+        "blobs/ab/abcd": b"blob",
+        "refs/repo.json": b"{}",
+        "probe_scraper_errors_cache.json": b"[]",
+        "hg/node/Histograms.json": b"not synced",
+    }
+    write_files(tmp_path / "local", files)
+    include = ["blobs/*", "refs/*", "probe_scraper_*.json"]
+
+    uploaded = S3Sync(client).upload(
+        str(tmp_path / "local"), "s3://bucket/cache", include=include
+    )
+    assert uploaded == [
+        "blobs/ab/abcd",
+        "probe_scraper_errors_cache.json",
+        "refs/repo.json",
+    ]
+    assert ("bucket", "cache/blobs/ab/abcd") in client.objects
+
+    # A fresh cache only uploads the files that changed since the download.
+    s3 = S3Sync(client)
+    s3.download("s3://bucket/cache", str(tmp_path / "restored"))
+    assert (tmp_path / "restored" / "refs" / "repo.json").read_bytes() == b"{}"
+    write_files(tmp_path / "restored", {"refs/repo.json": b'{"a": 1}', "refs/new": b""})
+    uploaded = s3.upload(
+        str(tmp_path / "restored"), "s3://bucket/cache", include=include
+    )
+    assert uploaded == ["refs/new", "refs/repo.json"]
+    assert client.objects[("bucket", "cache/refs/repo.json")][0] == b'{"a": 1}'
+
+
+def test_download_same_size(tmp_path):
+    client = FakeS3Client()
+    write_files(tmp_path / "local", {"refs/a.json": b"[1]", "refs/b.json": b"[2]"})
+    S3Sync(client).upload(str(tmp_path / "local"), "s3://bucket/cache")
+    s3 = S3Sync(client)
+    s3.download("s3://bucket/cache", str(tmp_path / "restored"))
+    restored = tmp_path / "restored" / "refs"
+    mtime = client.modified[("bucket", "cache/refs/a.json")].timestamp()
+    assert os.path.getmtime(restored / "a.json") == pytest.approx(mtime)
+
+    # A local file older than its object is downloaded again even if it
+    # has the same size, and one modified after it is kept.
+    write_files(tmp_path / "restored", {"refs/a.json": b"[3]", "refs/b.json": b"[4]"})
+    os.utime(restored / "a.json", (mtime - 60, mtime - 60))
+    S3Sync(client).download("s3://bucket/cache", str(tmp_path / "restored"))
+    assert (restored / "a.json").read_bytes() == b"[1]"
+    assert (restored / "b.json").read_bytes() == b"[4]"
+
+
+def test_setup_skips_legacy_cache_files(tmp_path):
+    client = FakeS3Client()
+    legacy = {"hg/node/Histograms.json": b"{}", "repo/hash/metrics.yaml": b""}
+    write_files(tmp_path / "legacy", legacy)
+    S3Sync(client).upload(
+        str(tmp_path / "legacy"), "s3://cache-bucket/cache/probe-scraper"
+    )
+
+    # Before the blob store is uploaded, the legacy files are downloaded so
+    # they can be moved into it.
+    cache_dir = tmp_path / "cache"
+    runner.setup_output_and_cache_dirs(
+        "bucket", "cache-bucket", str(tmp_path / "out"), str(cache_dir), S3Sync(client)
+    )
+    assert (cache_dir / "hg" / "node" / "Histograms.json").exists()
+
+    write_files(tmp_path / "migrated", {"refs/hg.json": b"{}", "blobs/ab/cd": b""})
+    S3Sync(client).upload(
+        str(tmp_path / "migrated"), "s3://cache-bucket/cache/probe-scraper"
+    )
+    cache_dir = tmp_path / "cache-2"
+    runner.setup_output_and_cache_dirs(
+        "bucket",
+        "cache-bucket",
+        str(tmp_path / "out-2"),
+        str(cache_dir),
+        S3Sync(client),
+    )
+    assert (cache_dir / "refs" / "hg.json").exists()
+    assert not (cache_dir / "hg").exists()
+    assert not (cache_dir / "repo").exists()
+
+
+def test_upload_delete(tmp_path):
+    client = FakeS3Client()
+    client.objects[("bucket", "old")] = (b"", None)
+    client.objects[("other", "old")] = (b"", None)
+    write_files(tmp_path, {"index.html": b"<html>", "glean/repo/metrics.br": b"br"})
+
+    S3Sync(client).upload(
+        str(tmp_path), "s3://bucket/", extra_args=runner.output_upload_args, delete=True
+    )
+
+    assert sorted(key for bucket, key in client.objects if bucket == "bucket") == [
+        "glean/repo/metrics.br",
+        "index.html",
+    ]
+    assert ("other", "old") in client.objects
+    _, args = client.objects[("bucket", "glean/repo/metrics.br")]
+    assert args["ContentEncoding"] == "br"
+    assert args["ContentType"] == "application/json"
+    _, args = client.objects[("bucket", "index.html")]
+    assert (args["ContentEncoding"], args["ContentType"]) == ("gzip", "text/html")
+
+
+def test_sync_only_changed_files(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    client = FakeS3Client()
+    first = OutputManifest(str(tmp_path / "out-1"))
+    runner.dump_json({}, str(tmp_path / "out-1" / "glean" / "repo"), "metrics", first)
+    runner.dump_json({}, str(tmp_path / "out-1" / "glean" / "repo"), "pings", first)
+    runner.sync_output_and_cache_dirs(
+        "bucket",
+        "cache-bucket",
+        str(tmp_path / "out-1"),
+        str(cache_dir),
+        "s3://cache-bucket/cache",
+        first,
+        s3=S3Sync(client),
+    )
+
+    second = OutputManifest.load(str(cache_dir), str(tmp_path / "out-2"))
+    assert second.previous == first.files
+    runner.dump_json(
+        {"a": 1}, str(tmp_path / "out-2" / "glean" / "repo"), "metrics", second
+    )
+    client.uploads = []
+    runner.sync_output_and_cache_dirs(
+        "bucket",
+        "cache-bucket",
+        str(tmp_path / "out-2"),
+        str(cache_dir),
+        "s3://cache-bucket/cache",
+        second,
+        s3=S3Sync(client),
+    )
+
+    assert client.uploads == ["glean/repo/metrics", f"cache/{MANIFEST_FILENAME}"]
+    assert sorted(key for bucket, key in client.objects if bucket == "bucket") == [
+        "glean/repo/metrics"
+    ]
@@ -0,0 +1,79 @@
+import datetime
+import json
+from unittest import mock
+
+import pytest
+from dateutil.tz import tzutc
+
+from probe_scraper import serializers
+
+DATA = {
+    "strings": ["plain", 'ü\x7f\x01\n\t"\\/   \U0001f600', ""],
+    "numbers": [0, -1, 2**63, 2**64 - 1, 0.1, -0.0, 100.0, 1e15, 123456789.123],
+    "nested": {"b": [], "a": {}, "B": [{"x": None, "y": True, "z": False}]},
+    "dates": [
+        datetime.datetime(2019, 1, 1),
+        datetime.datetime(2019, 1, 1, 1, 2, 3, 4500, tzinfo=tzutc()),
+        datetime.date(2019, 1, 1),
+        datetime.time(1, 2, 3),
+    ],
+    "é": "key",
+}
+
+FALLBACK_DATA = [
+    [1e-7, 1e16, 1.5e300],
+    [1e-7, 0],
+    {"a": -2.5e-300, "b": 0},
+    {1: "int keys", 2: "are converted"},
+    [2**64],
+    [3.5e-05, 0],
+]
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize(
+    "data",
+    [DATA, {"del": "\x7f", "ratio": "1e5"}, [], {}, "str", 5, None] + FALLBACK_DATA,
+)
+def test_backends_are_identical(data, compact):
+    expected = serializers.JSONSerializer(compact).dumps(data)
+    assert serializers.OrjsonSerializer(compact).dumps(data) == expected
+
+
+def baseline_default(o):
+    # The `default` of `runner.dump_json` before the serializers existed.
+    if isinstance(o, datetime.datetime):
+        return o.isoformat()
+
+
+def test_json_serializer_format():
+    assert serializers.JSONSerializer().dumps(DATA).decode("ascii") == json.dumps(
+        DATA,
+        sort_keys=True,
+        indent=2,
+        separators=(",", ": "),
+        default=baseline_default,
+    )
+    assert serializers.JSONSerializer(compact=True).dumps(
+        [datetime.date(2019, 1, 1), datetime.time(1, 2, 3)]
+    ) == (b"[null,null]")
+    assert serializers.JSONSerializer(compact=True).dumps({"b": [1], "a": 2}) == (
+        b'{"a":2,"b":[1]}'
+    )
+
+
+def test_get_serializer():
+    assert serializers.get_serializer("json").name == "json"
+    assert serializers.get_serializer("auto", compact=True).compact
+    with pytest.raises(ValueError):
+        serializers.get_serializer("yaml")
+
+
+def test_orjson_fallback():
+    orjson_serializer = serializers.OrjsonSerializer()
+    with mock.patch.object(serializers.JSONSerializer, "dumps") as dumps:
+        orjson_serializer.dumps(DATA)
+        assert dumps.call_count == 0
+        for data in FALLBACK_DATA:
+            orjson_serializer.dumps(data)
+        assert dumps.call_count == len(FALLBACK_DATA)
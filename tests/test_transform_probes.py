@@ -798,3 +798,94 @@ def test_transform_shared_object():
 
     result = transform.transform(in_probe_data, revision_data, break_by_channel=True)
     print_and_test(expected, result)
+
+
+def test_transform_all():
+    probes_by_channel, first_appeared_dates = transform.transform_all(
+        in_probe_data(), IN_NODE_DATA, REVISION_DATES
+    )
+
+    expected = transform.transform(
+        in_probe_data(), IN_NODE_DATA, True, revision_dates=REVISION_DATES
+    )
+    expected["all"] = transform.transform(
+        in_probe_data(), IN_NODE_DATA, False, revision_dates=REVISION_DATES
+    )
+    print_and_test(expected, probes_by_channel)
+
+    expected_dates = transform.get_minimum_date(
+        in_probe_data(), IN_NODE_DATA, REVISION_DATES
+    )
+    print_and_test(expected_dates, first_appeared_dates)
+
+
+def test_transform_shares_probe_contents():
+    probe_data = in_probe_data()
+    expected = transform.transform(in_probe_data(), IN_NODE_DATA, True)
+
+    result = transform.transform(probe_data, IN_NODE_DATA, True)
+
+    # The input isn't modified, and history entries share its nested values.
+    assert probe_data == in_probe_data()
+    print_and_test(expected, result)
+    source = probe_data["beta"]["node_id_1"]["histogram"]["TEST_HISTOGRAM_1"]
+    history = result["beta"]["histogram/TEST_HISTOGRAM_1"]["history"]["beta"]
+    assert history[-1]["details"] is source["details"]
+    assert history[-1] is not source
+
+
+def test_glean_fingerprints_match_equality():
+    metric = {"type": "counter", "description": "foo", "expires": "never"}
+    assert transform.metric_fingerprint(metric) == transform.metric_fingerprint(
+        dict(metric, unknown_key=1)
+    )
+    assert transform.metric_fingerprint(metric) != transform.metric_fingerprint(
+        dict(metric, description="bar")
+    )
+
+    # Missing keys and None values are equal, and probe-scraper keys are ignored.
+    ping = {"description": "foo", "include_client_id": True}
+    assert transform.ping_equal(ping, dict(ping, reasons=None))
+    assert transform.ping_equal(ping, dict(ping, **{transform.DATES_KEY: {}}))
+    assert not transform.ping_equal(ping, dict(ping, reasons={"a": "b"}))
+
+
+def test_fingerprint_cache():
+    calls = []
+
+    def fingerprint(defn):
+        calls.append(defn)
+        return transform.probe_fingerprint(defn)
+
+    fingerprints = transform.FingerprintCache(fingerprint)
+    probe = in_probe_data()["beta"]["node_id_1"]["histogram"]["TEST_HISTOGRAM_1"]
+    copy = dict(probe)
+    fingerprints.assign(copy, fingerprints(probe))
+
+    assert fingerprints.equal(probe, copy)
+    assert fingerprints.equal(copy, probe)
+    assert calls == [probe]
+
+
+def test_transform_metrics_by_hash_same_timestamp():
+    # Commits 1 and 2 share a timestamp: the definition seen first at that
+    # timestamp stays the one later commits are compared against.
+    timestamps = {"repo": {"0": (10, 3), "1": (20, 2), "2": (20, 1), "3": (30, 0)}}
+    data = {
+        "repo": {
+            "0": {"m": {"type": "counter", "description": "a"}},
+            "1": {"m": {"type": "counter", "description": "b"}},
+            "2": {"m": {"type": "counter", "description": "c"}},
+            "3": {"m": {"type": "counter", "description": "b"}},
+        }
+    }
+
+    result = transform.transform_metrics_by_hash(timestamps, data)
+
+    history = result["repo"]["m"]["history"]
+    assert [d["description"] for d in history] == ["a", "b", "c"]
+    assert history[1]["git-commits"] == {"first": "1", "last": "3"}
+    assert history[1]["dates"] == {
+        "first": "1970-01-01 00:00:20",
+        "last": "1970-01-01 00:00:30",
+    }